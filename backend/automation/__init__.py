@@ -8,7 +8,8 @@ from .data_ingestion import (
     processa_file_automatico
 )
 
-from .reconciliation import (
+# Il motore di riconciliazione vive in core/ (usato anche da Analyzer)
+from core.reconciliation import (
     StatoRiconciliazione,
     RisultatoRiconciliazione,
     riconcilia_contanti,
@@ -27,6 +28,8 @@ from .security_alerts import (
     genera_email_alert
 )
 
+from .watch_folder import WatchFolder, EsitoBatch
+
 from .reporting import (
     genera_report_anomalie,
     genera_html_report,
@@ -58,6 +61,10 @@ __all__ = [
     'monitora_sicurezza_db',
     'genera_email_alert',
     
+    # Watch folder
+    'WatchFolder',
+    'EsitoBatch',
+    
     # Reporting
     'genera_report_anomalie',
     'genera_html_report',
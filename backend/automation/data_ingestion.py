@@ -9,15 +9,27 @@ from datetime import datetime
 import re
 from typing import Dict, Optional, Tuple, List
 
-# Mapping colonne per identificazione fonte
-FONTE_SIGNATURES = {
-    'FORTECH': ['CodicePV', 'Corrispettivo Totale', 'DataContabile', 'StatoGiornata'],
-    'AS400': ['Registrazione//Data', 'Documento//Tipo', 'Importo', 'Segno'],
-    'NUMIA': ['Circuito', 'MID', 'ID Terminale / TML', 'Codice autorizzazione'],
-    'IP_CARTE': ['PV', 'Gestore', 'Circuito', 'Cod. Prod.'],
-    'IP_BUONI': ['Esercente', 'Descrizione esercente', 'Pan', 'Serial number'],
-    'SATISPAY': ['id transazione', 'codice negozio', 'totale commissioni']
-}
+from core.file_classifier import FileClassifier
+from core.parse_cache import ParseCache, file_hash
+from core.sources import SOURCES, source_from_filename
+
+# Versione dei parser di questo modulo: cambiarla invalida la cache dei file processati
+PARSER_VERSION = 4
+
+# Mapping colonne per identificazione fonte (dal registro core.sources)
+FONTE_SIGNATURES = {nome: list(schema.signature) for nome, schema in SOURCES.items()}
+
+# Formati data accettati, in ordine di priorità
+FORMATI_DATA = [
+    '%Y-%m-%d',
+    '%d/%m/%Y',
+    '%d-%m-%Y',
+    '%Y/%m/%d',
+    '%d.%m.%Y'
+]
+
+# Righe iniziali lette per cercare l'intestazione (Numia: header alla riga 2)
+SNIFF_RIGHE = 10
 
 
 def identifica_fonte(df: pd.DataFrame) -> Tuple[str, float]:
@@ -27,7 +39,12 @@ def identifica_fonte(df: pd.DataFrame) -> Tuple[str, float]:
     Returns:
         Tuple[str, float]: (nome_fonte, confidence_score 0-1)
     """
-    colonne = set(df.columns.tolist())
+    return identifica_fonte_da_colonne(df.columns.tolist())
+
+
+def identifica_fonte_da_colonne(colonne) -> Tuple[str, float]:
+    """Come identifica_fonte, ma su una semplice lista di nomi colonna (es. una riga candidata)."""
+    colonne = set(c for c in colonne if c is not None)
     
     best_match = ('UNKNOWN', 0.0)
     
@@ -57,26 +74,53 @@ def identifica_fonte(df: pd.DataFrame) -> Tuple[str, float]:
     return best_match
 
 
+def sniff_header(file_path: Path, max_righe: int = SNIFF_RIGHE) -> Tuple[str, float, int]:
+    """
+    Legge una sola volta le prime `max_righe` righe (openpyxl read-only) e
+    valuta FONTE_SIGNATURES su ogni riga candidata come intestazione.
+    
+    Returns:
+        Tuple[str, float, int]: (fonte, confidence, riga_header 0-based come header= di pd.read_excel)
+        ('UNKNOWN', 0.0, 0) se openpyxl non legge il file (.xls, file corrotto)
+    """
+    try:
+        righe = FileClassifier.read_header_rows(file_path, max_righe)
+    except Exception:
+        return ('UNKNOWN', 0.0, 0)
+    
+    best = ('UNKNOWN', 0.0, 0)
+    for idx, riga in enumerate(righe):
+        fonte, confidence = identifica_fonte_da_colonne(riga)
+        # A parità di punteggio vince la riga più in alto
+        if confidence > best[1]:
+            best = (fonte, confidence, idx)
+    return best
+
+
 def identifica_fonte_da_nome_file(filename: str) -> str:
     """
     Fallback: identifica fonte dal nome del file.
     """
-    filename_lower = filename.lower()
+    return source_from_filename(filename) or 'UNKNOWN'
+
+
+def _leggi_excel(file_path: Path) -> Tuple[pd.DataFrame, str, float, int]:
+    """
+    Sniffing dell'intestazione + una sola lettura completa, limitata alle
+    colonne della fonte riconosciuta (registro core.sources).
+    """
+    fonte, confidence, header = sniff_header(file_path)
     
-    if 'fortech' in filename_lower:
-        return 'FORTECH'
-    elif 'as400' in filename_lower or 'contanti' in filename_lower:
-        return 'AS400'
-    elif 'numia' in filename_lower or 'bancarie' in filename_lower:
-        return 'NUMIA'
-    elif 'petrolifere' in filename_lower or 'azzurro' in filename_lower:
-        return 'IP_CARTE'
-    elif 'buoni' in filename_lower or 'rosso' in filename_lower:
-        return 'IP_BUONI'
-    elif 'satispay' in filename_lower:
-        return 'SATISPAY'
+    # Se confidence bassa, usa nome file (lettura completa dalla prima riga)
+    if confidence < 0.3:
+        fonte = identifica_fonte_da_nome_file(file_path.name)
+        confidence = 0.5 if fonte != 'UNKNOWN' else 0.0
+        header = 0
     
-    return 'UNKNOWN'
+    # Solo le colonne del registro, con codici/ID letti come testo
+    schema = SOURCES.get(fonte)
+    df = pd.read_excel(file_path, header=header, **(schema.read_kwargs() if schema else {}))
+    return df, fonte, confidence, header
 
 
 def parse_excel_intelligente(file_path: Path) -> Dict:
@@ -87,6 +131,11 @@ def parse_excel_intelligente(file_path: Path) -> Dict:
     Returns:
         Dict con keys: fonte, confidence, records, errors
     """
+    result, _ = _parse_excel(Path(file_path))
+    return result
+
+
+def _parse_excel(file_path: Path) -> Tuple[Dict, Optional[pd.DataFrame]]:
     result = {
         'fonte': 'UNKNOWN',
         'confidence': 0.0,
@@ -94,30 +143,14 @@ def parse_excel_intelligente(file_path: Path) -> Dict:
         'errors': [],
         'file_name': file_path.name
     }
+    df = None
     
     try:
-        # Prova a leggere con header standard
-        df = pd.read_excel(file_path)
-        
-        # Identifica fonte
-        fonte, confidence = identifica_fonte(df)
-        
-        # Se confidence bassa, prova header riga 1
-        if confidence < 0.5:
-            df_alt = pd.read_excel(file_path, header=1)
-            fonte_alt, confidence_alt = identifica_fonte(df_alt)
-            if confidence_alt > confidence:
-                df = df_alt
-                fonte = fonte_alt
-                confidence = confidence_alt
-        
-        # Se ancora bassa, usa nome file
-        if confidence < 0.3:
-            fonte = identifica_fonte_da_nome_file(file_path.name)
-            confidence = 0.5 if fonte != 'UNKNOWN' else 0.0
+        df, fonte, confidence, header = _leggi_excel(file_path)
         
         result['fonte'] = fonte
         result['confidence'] = confidence
+        result['header_row'] = header
         result['records'] = df.to_dict('records')
         result['row_count'] = len(df)
         result['columns'] = list(df.columns)
@@ -125,7 +158,7 @@ def parse_excel_intelligente(file_path: Path) -> Dict:
     except Exception as e:
         result['errors'].append(str(e))
     
-    return result
+    return result, df
 
 
 def estrai_codice_pv(valore) -> Optional[str]:
@@ -178,15 +211,7 @@ def normalizza_data(valore) -> Optional[str]:
     valore_str = str(valore)
     
     # Prova vari formati
-    formati = [
-        '%Y-%m-%d',
-        '%d/%m/%Y',
-        '%d-%m-%Y',
-        '%Y/%m/%d',
-        '%d.%m.%Y'
-    ]
-    
-    for fmt in formati:
+    for fmt in FORMATI_DATA:
         try:
             dt = datetime.strptime(valore_str[:10], fmt)
             return dt.strftime('%Y-%m-%d')
@@ -196,111 +221,189 @@ def normalizza_data(valore) -> Optional[str]:
     return valore_str[:10] if len(valore_str) >= 10 else None
 
 
+# ============================================================================
+# VERSIONI VETTORIALI (intere colonne)
+# ============================================================================
+
+def estrai_codici_pv(serie: pd.Series) -> pd.Series:
+    """estrai_codice_pv su un'intera colonna"""
+    codici = serie.astype(str).str.extract(r'^(\d+)', expand=False)
+    return codici.where(serie.notna() & codici.notna(), None)
+
+
+def normalizza_importi(serie: pd.Series) -> pd.Series:
+    """normalizza_importo su un'intera colonna, con lo stesso risultato cella per cella"""
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.astype(float).fillna(0.0)
+    
+    # Numeri e testo già in formato inglese semplice
+    numeri = pd.to_numeric(serie, errors='coerce')
+    
+    testo = serie.astype(str).str.replace('€', '', regex=False).str.replace(' ', '', regex=False).str.strip()
+    # Virgola dopo l'ultimo punto (o senza punti) = italiano 1.234,56; altrimenti inglese 1,234.56
+    italiano = testo.str.contains(r',[^.]*$', regex=True)
+    inglese = testo.str.contains(',', regex=False) & ~italiano
+    testo = testo.where(~italiano, testo.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    testo = testo.where(~inglese, testo.str.replace(',', '', regex=False))
+    
+    risultato = numeri.fillna(pd.to_numeric(testo, errors='coerce')).astype(float)
+    risultato[serie.isna()] = 0.0
+    # Celle che pd.to_numeric non legge ma float() sì ('1_000', 'nan' testuale) o illeggibili:
+    # regole di normalizza_importo, cella per cella
+    da_rivedere = risultato.isna() & serie.notna()
+    if da_rivedere.any():
+        risultato[da_rivedere] = serie[da_rivedere].map(normalizza_importo)
+    return risultato
+
+
+def normalizza_date(serie: pd.Series) -> pd.Series:
+    """
+    normalizza_data su un'intera colonna: ogni formato di FORMATI_DATA viene
+    provato una sola volta sulle celle non ancora riconosciute.
+    """
+    valide = serie.notna()
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.dt.strftime('%Y-%m-%d').where(valide, None)
+    
+    # str(Timestamp) inizia con YYYY-MM-DD: gestito dal primo formato
+    testo_completo = serie.astype(str)
+    testo = testo_completo.str[:10]
+    date = pd.Series(pd.NaT, index=serie.index, dtype='datetime64[ns]')
+    for fmt in FORMATI_DATA:
+        mancanti = valide & date.isna()
+        if not mancanti.any():
+            break
+        date[mancanti] = pd.to_datetime(testo[mancanti], format=fmt, errors='coerce')
+    
+    # Non riconosciute: primi 10 caratteri se il valore è abbastanza lungo
+    grezze = testo.where(testo_completo.str.len() >= 10, None)
+    return date.dt.strftime('%Y-%m-%d').where(date.notna(), grezze).where(valide, None)
+
+
+def _colonna(df: pd.DataFrame, nome: str, default=None) -> pd.Series:
+    if nome in df.columns:
+        return df[nome]
+    return pd.Series(default, index=df.index, dtype=object)
+
+
+def _testo(df: pd.DataFrame, nome: str, max_len: Optional[int] = None) -> pd.Series:
+    """str(row.get(nome, '')) su tutta la colonna"""
+    testo = _colonna(df, nome, '').astype(str)
+    return testo.str[:max_len] if max_len else testo
+
+
 # ============================================================================
 # PARSER SPECIFICI PER FONTE
 # ============================================================================
 
 def parse_fortech(df: pd.DataFrame) -> List[Dict]:
     """Estrae dati strutturati da file Fortech"""
-    records = []
+    codici = estrai_codici_pv(_colonna(df, 'CodicePV'))
     
-    for _, row in df.iterrows():
-        codice_pv = estrai_codice_pv(row.get('CodicePV'))
-        if not codice_pv:
-            continue
-            
-        records.append({
-            'codice_pv': codice_pv,
-            'data_contabile': normalizza_data(row.get('DataContabile')),
-            'corrispettivo_totale': normalizza_importo(row.get('Corrispettivo Totale')),
-            'fatture_postpagate': normalizza_importo(row.get('Fatture Postpagate Totale')),
-            'fatture_prepagate': normalizza_importo(row.get('Fatture Prepagate Totale')),
-            'buoni_totale': normalizza_importo(row.get('Buoni Totale')),
-            'contanti_teorico': normalizza_importo(row.get('Incasso Contanti', 0))
-        })
+    records = pd.DataFrame({
+        'codice_pv': codici,
+        'data_contabile': normalizza_date(_colonna(df, 'DataContabile')),
+        'corrispettivo_totale': normalizza_importi(_colonna(df, 'Corrispettivo Totale')),
+        'fatture_postpagate': normalizza_importi(_colonna(df, 'Fatture Postpagate Totale')),
+        'fatture_prepagate': normalizza_importi(_colonna(df, 'Fatture Prepagate Totale')),
+        'buoni_totale': normalizza_importi(_colonna(df, 'Buoni Totale')),
+        'contanti_teorico': normalizza_importi(_colonna(df, 'Incasso Contanti', 0))
+    }, index=df.index)
     
-    return records
+    return records[codici.notna()].to_dict('records')
 
 
 def parse_as400(df: pd.DataFrame) -> List[Dict]:
     """Estrae dati strutturati da file AS400"""
-    records = []
+    importi = normalizza_importi(_colonna(df, 'Importo'))
     
-    for _, row in df.iterrows():
-        importo = normalizza_importo(row.get('Importo'))
-        if importo == 0:
-            continue
-            
-        records.append({
-            'data_registrazione': normalizza_data(row.get('Registrazione//Data')),
-            'data_documento': normalizza_data(row.get('Documento//Data')),
-            'importo': importo,
-            'segno': str(row.get('Segno', '')),
-            'descrizione': str(row.get('Descrizione', ''))[:200]
-        })
+    records = pd.DataFrame({
+        'data_registrazione': normalizza_date(_colonna(df, 'Registrazione//Data')),
+        'data_documento': normalizza_date(_colonna(df, 'Documento//Data')),
+        'importo': importi,
+        'segno': _testo(df, 'Segno'),
+        'descrizione': _testo(df, 'Descrizione', 200)
+    }, index=df.index)
     
-    return records
+    return records[importi != 0].to_dict('records')
 
 
 def parse_numia(df: pd.DataFrame) -> List[Dict]:
     """Estrae dati strutturati da file Numia"""
-    records = []
+    importi = normalizza_importi(_colonna(df, 'Importo'))
     
-    for _, row in df.iterrows():
-        importo = normalizza_importo(row.get('Importo'))
-        if importo == 0:
-            continue
-            
-        records.append({
-            'data_transazione': normalizza_data(row.get('Data e ora')),
-            'importo': importo,
-            'circuito': str(row.get('Circuito', '')),
-            'stato': str(row.get('Stato operazione', ''))
-        })
+    records = pd.DataFrame({
+        'data_transazione': normalizza_date(_colonna(df, 'Data e ora')),
+        'importo': importi,
+        'circuito': _testo(df, 'Circuito'),
+        'stato': _testo(df, 'Stato operazione')
+    }, index=df.index)
     
-    return records
+    return records[importi != 0].to_dict('records')
 
 
 def parse_ip_portal(df: pd.DataFrame, tipo: str) -> List[Dict]:
     """Estrae dati strutturati da file iP Portal (Carte o Buoni)"""
-    records = []
+    importi = normalizza_importi(_colonna(df, 'Importo'))
     
-    for _, row in df.iterrows():
-        importo = normalizza_importo(row.get('Importo'))
-        if importo == 0:
-            continue
-        
-        # Determina codice PV
-        if tipo == 'IP_CARTE':
-            codice_pv = estrai_codice_pv(row.get('PV'))
-            data_op = row.get('Data\noperazione') or row.get('Data operazione')
-        else:  # IP_BUONI
-            codice_pv = estrai_codice_pv(row.get('Esercente'))
-            data_op = row.get('Data operazione')
-            
-        records.append({
-            'tipo': tipo,
-            'codice_pv': codice_pv,
-            'data_operazione': normalizza_data(data_op),
-            'importo': importo,
-            'prodotto': str(row.get('Prodotto', ''))[:100]
-        })
+    # Determina codice PV
+    if tipo == 'IP_CARTE':
+        codici = estrai_codici_pv(_colonna(df, 'PV'))
+        data_op = _colonna(df, 'Data\noperazione')
+        data_op = data_op.where(data_op.notna() & (data_op != ''), _colonna(df, 'Data operazione'))
+    else:  # IP_BUONI
+        codici = estrai_codici_pv(_colonna(df, 'Esercente'))
+        data_op = _colonna(df, 'Data operazione')
     
-    return records
+    records = pd.DataFrame({
+        'tipo': tipo,
+        'codice_pv': codici,
+        'data_operazione': normalizza_date(data_op),
+        'importo': importi,
+        'prodotto': _testo(df, 'Prodotto', 100)
+    }, index=df.index)
+    
+    return records[importi != 0].to_dict('records')
 
 
 # ============================================================================
 # FUNZIONE PRINCIPALE
 # ============================================================================
 
-def processa_file_automatico(file_path: Path) -> Dict:
+def processa_file_automatico(file_path: Path, cache=True) -> Dict:
     """
     Processa un file Excel automaticamente:
     1. Identifica la fonte
     2. Applica il parser appropriato
     3. Restituisce dati normalizzati
+    
+    cache: ParseCache (True = cache predefinita, None = disattivata). Un file
+    con lo stesso contenuto già processato viene riletto senza parsing.
     """
-    info = parse_excel_intelligente(file_path)
+    file_path = Path(file_path)
+    if cache is True:
+        cache = ParseCache()
+    try:
+        digest = file_hash(file_path) if cache else None
+    except OSError:
+        cache = None
+    
+    if cache:
+        info = cache.load(digest, 'AUTO', PARSER_VERSION)
+        if info is not None:
+            info['file_name'] = file_path.name
+            return info
+    
+    info = _processa_file(file_path)
+    if cache and not info['errors']:
+        cache.save(digest, 'AUTO', PARSER_VERSION, info)
+        cache.evict()
+    return info
+
+
+def _processa_file(file_path: Path) -> Dict:
+    # Il DataFrame letto per l'identificazione è lo stesso usato dai parser
+    info, df = _parse_excel(file_path)
     
     if info['fonte'] == 'UNKNOWN':
         info['errors'].append('Impossibile identificare la fonte del file')
@@ -308,8 +411,6 @@ def processa_file_automatico(file_path: Path) -> Dict:
     
     # Applica parser specifico
     try:
-        df = pd.read_excel(file_path)
-        
         if info['fonte'] == 'FORTECH':
             info['parsed_data'] = parse_fortech(df)
         elif info['fonte'] == 'AS400':
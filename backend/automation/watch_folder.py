@@ -0,0 +1,237 @@
+"""
+CALOR SYSTEMS - Cartella di ingresso monitorata (modalità daemon)
+
+Gli export di Fortech, AS400, Numia, iP Portal e Satispay salvati nella
+cartella di ingresso vengono raccolti in un unico batch quando la cartella
+resta ferma per `quiet_seconds` (i file arrivano uno alla volta, anche
+mentre vengono ancora copiati), classificati con FileClassifier, importati,
+analizzati e spostati in processed/ o failed/.
+
+Le modifiche alla cartella arrivano dalle notifiche del sistema operativo
+tramite watchdog, se installato (pip install watchdog); altrimenti la
+cartella viene riletta ogni `poll_seconds`.
+
+Uso: python -m automation.watch_folder --inbox /percorso/inbox [--quiet 30]
+"""
+
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from core.analyzer import Analyzer
+from core.database import Database
+from core.importer import DataImporter
+
+try:
+    from watchdog.observers import Observer
+except ImportError:  # dipendenza opzionale: si usa il polling
+    Observer = None
+
+
+ESTENSIONI = ('.xlsx', '.xls')
+
+
+@dataclass
+class EsitoBatch:
+    """Risultato di un batch: file spostati in processed/ e in failed/"""
+    processati: List[str] = field(default_factory=list)
+    falliti: List[str] = field(default_factory=list)
+    giorni_analizzati: int = 0
+
+
+class _Sveglia:
+    """Handler watchdog: qualsiasi evento nella cartella sveglia il ciclo principale"""
+
+    def __init__(self, evento: threading.Event):
+        self.evento = evento
+
+    def dispatch(self, event):
+        self.evento.set()
+
+
+class WatchFolder:
+    def __init__(self, db: Database, inbox, processed=None, failed=None,
+                 quiet_seconds=30.0, poll_seconds=5.0, analyze=True, workers=1):
+        """
+        inbox          -> cartella monitorata (solo il primo livello)
+        processed      -> destinazione dei file importati (default inbox/processed)
+        failed         -> destinazione dei file non riconosciuti o in errore (default inbox/failed)
+        quiet_seconds  -> secondi senza nuovi file o modifiche prima di elaborare il batch
+        poll_seconds   -> intervallo di rilettura quando le notifiche non sono disponibili
+        analyze        -> esegue l'Analyzer dopo ogni batch importato
+        """
+        self.db = db
+        self.inbox = Path(inbox)
+        self.processed = Path(processed) if processed else self.inbox / "processed"
+        self.failed = Path(failed) if failed else self.inbox / "failed"
+        self.quiet_seconds = quiet_seconds
+        self.poll_seconds = poll_seconds
+        self.analyze = analyze
+        self.workers = workers
+        # path -> ((dimensione, mtime), ultimo cambiamento visto)
+        self._pending: Dict[Path, Tuple[Tuple[int, float], float]] = {}
+        self._evento = threading.Event()
+        self._stop = False
+
+    # --- Debounce ---
+
+    def _file_in_ingresso(self) -> List[Path]:
+        try:
+            voci = list(self.inbox.iterdir())
+        except FileNotFoundError:
+            return []
+        # '~$' = file di lock di Excel aperto sul file
+        return [p for p in voci if p.is_file() and p.suffix.lower() in ESTENSIONI
+                and not p.name.startswith('~$')]
+
+    def scan(self, now: Optional[float] = None) -> int:
+        """Aggiorna i file in attesa; un file nuovo o cambiato riapre la finestra di quiete."""
+        now = time.monotonic() if now is None else now
+        visti = {}
+        for path in self._file_in_ingresso():
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            firma = (st.st_size, st.st_mtime)
+            precedente = self._pending.get(path)
+            visti[path] = precedente if precedente and precedente[0] == firma else (firma, now)
+        self._pending = visti
+        return len(visti)
+
+    def ready_batch(self, now: Optional[float] = None) -> List[Path]:
+        """File in attesa se la cartella è ferma da quiet_seconds, altrimenti lista vuota."""
+        if not self._pending:
+            return []
+        now = time.monotonic() if now is None else now
+        ultimo = max(cambiato for _, cambiato in self._pending.values())
+        if now - ultimo < self.quiet_seconds:
+            return []
+        return sorted(self._pending)
+
+    def _attesa(self, now: float, notifiche: bool) -> float:
+        """Secondi da dormire prima del prossimo controllo."""
+        if not notifiche:
+            return self.poll_seconds
+        if not self._pending:
+            # Solo un controllo di sicurezza: i nuovi file svegliano il ciclo
+            return max(self.poll_seconds, 60.0)
+        ultimo = max(cambiato for _, cambiato in self._pending.values())
+        return max(0.1, ultimo + self.quiet_seconds - now)
+
+    # --- Elaborazione ---
+
+    def _sposta(self, path: Path, cartella: Path) -> Path:
+        cartella.mkdir(parents=True, exist_ok=True)
+        dest = cartella / path.name
+        if dest.exists():
+            dest = cartella / f"{path.stem}_{datetime.now():%Y%m%d-%H%M%S}{path.suffix}"
+        shutil.move(str(path), str(dest))
+        return dest
+
+    def process_batch(self, paths: List[Path], progress_callback=None) -> EsitoBatch:
+        """Classifica, importa, analizza e sposta un batch di file."""
+        esito = EsitoBatch()
+        # La classificazione la fa l'importatore, una volta per file
+        importer = DataImporter(self.db, workers=self.workers)
+        importer.import_files([str(p) for p in paths], progress_callback=progress_callback)
+        sconosciuti = set(importer.sconosciuti)
+        # Importati o già presenti (duplicati); i file in errore non hanno statistiche
+        riusciti = {s['file'] for s in importer.import_stats}
+
+        # Anche un batch di soli duplicati viene rianalizzato: l'analisi precedente può essere fallita
+        if self.analyze and riusciti:
+            esito.giorni_analizzati = len(Analyzer(self.db, workers=self.workers).run_analysis(
+                progress_callback=progress_callback, solo_modificati=True))
+
+        for path in paths:
+            if str(path) in sconosciuti or path.name not in riusciti:
+                self._sposta(path, self.failed)
+                esito.falliti.append(path.name)
+            else:
+                self._sposta(path, self.processed)
+                esito.processati.append(path.name)
+            self._pending.pop(path, None)
+        return esito
+
+    def run_once(self, now: Optional[float] = None, progress_callback=None) -> Optional[EsitoBatch]:
+        """Un controllo: elabora il batch se pronto. Restituisce l'esito o None."""
+        self.scan(now)
+        batch = self.ready_batch(now)
+        if not batch:
+            return None
+        return self.process_batch(batch, progress_callback=progress_callback)
+
+    # --- Ciclo daemon ---
+
+    def _avvia_notifiche(self):
+        if Observer is None:
+            return None
+        try:
+            observer = Observer()
+            observer.schedule(_Sveglia(self._evento), str(self.inbox), recursive=False)
+            observer.start()
+            return observer
+        except OSError as e:
+            # es. limite inotify raggiunto: si torna al polling
+            print(f"File notifications unavailable ({e}), polling every {self.poll_seconds}s.")
+            return None
+
+    def run(self, progress_callback=None):
+        """Ciclo principale fino a stop() (o Ctrl+C)."""
+        self.inbox.mkdir(parents=True, exist_ok=True)
+        observer = self._avvia_notifiche()
+        modo = "notifiche OS" if observer else f"polling ogni {self.poll_seconds}s"
+        print(f"In ascolto su {self.inbox} ({modo}, quiete {self.quiet_seconds}s)")
+        try:
+            while not self._stop:
+                try:
+                    esito = self.run_once(progress_callback=progress_callback)
+                except Exception as e:
+                    # Un batch fallito non ferma il daemon: i file restano in attesa
+                    print(f"Errore elaborazione batch: {e}")
+                    esito = None
+                if esito:
+                    print(f"[{datetime.now():%H:%M:%S}] Batch: {len(esito.processati)} processati, "
+                          f"{len(esito.falliti)} falliti, {esito.giorni_analizzati} giorni analizzati")
+                self._evento.wait(self._attesa(time.monotonic(), observer is not None))
+                self._evento.clear()
+        finally:
+            if observer:
+                observer.stop()
+                observer.join()
+
+    def stop(self):
+        self._stop = True
+        self._evento.set()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Importazione automatica da cartella di ingresso")
+    parser.add_argument("--inbox", default=os.environ.get('CALOR_INBOX'), required='CALOR_INBOX' not in os.environ,
+                        help="cartella monitorata (default: $CALOR_INBOX)")
+    parser.add_argument("--processed", help="file importati (default: <inbox>/processed)")
+    parser.add_argument("--failed", help="file in errore (default: <inbox>/failed)")
+    parser.add_argument("--quiet", type=float, default=30.0, help="secondi di quiete prima del batch")
+    parser.add_argument("--poll", type=float, default=5.0, help="intervallo di polling senza notifiche")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processi di parsing e di analisi")
+    parser.add_argument("--no-analyze", action="store_true", help="solo importazione, senza analisi")
+    args = parser.parse_args()
+
+    db = Database(Path(__file__).resolve().parents[2])
+    if not db.db_path.exists() and not db.initialize():
+        raise SystemExit("Errore inizializzazione database")
+
+    watcher = WatchFolder(db, args.inbox, args.processed, args.failed, quiet_seconds=args.quiet,
+                          poll_seconds=args.poll, analyze=not args.no_analyze, workers=args.workers)
+    try:
+        watcher.run(progress_callback=lambda cur, tot, msg: print(f"  {msg}"))
+    except KeyboardInterrupt:
+        print("Arresto.")
@@ -0,0 +1,49 @@
+"""
+Benchmark importatore: righe/sec del percorso bulk (colonnare) vs per-riga.
+Uso: python bench_import.py [--rows 20000] [--workers 4]
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+
+from core.importer import DataImporter
+from test_importer import crea_db_temporaneo, crea_file_sorgenti
+
+
+def esegui(files, bulk, workers=1):
+    root, db = crea_db_temporaneo()
+    try:
+        importer = DataImporter(db, bulk=bulk, workers=workers)
+        start = time.perf_counter()
+        importer.import_files(files)
+        return importer.import_stats, time.perf_counter() - start
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=20000, help="righe per file sorgente (pari)")
+    parser.add_argument("--workers", type=int, default=1, help="processi di parsing in modalità bulk")
+    args = parser.parse_args()
+
+    cartella = tempfile.mkdtemp(prefix="calor_bench_")
+    try:
+        files = crea_file_sorgenti(cartella, n=args.rows - args.rows % 2)
+        risultati = {'row': esegui(files, bulk=False), 'bulk': esegui(files, bulk=True, workers=args.workers)}
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+
+    (stats_row, wall_row), (stats_bulk, wall_bulk) = risultati['row'], risultati['bulk']
+    print(f"\n{'Fonte':<10} {'Righe':>8} {'per-riga r/s':>14} {'bulk r/s':>12} {'speedup':>8}")
+    for row_stat, bulk_stat in zip(stats_row, stats_bulk):
+        speedup = row_stat['secondi'] / bulk_stat['secondi'] if bulk_stat['secondi'] else 0
+        print(f"{bulk_stat['tipo']:<10} {bulk_stat['righe']:>8} "
+              f"{row_stat['righe_sec'] or 0:>14.0f} {bulk_stat['righe_sec'] or 0:>12.0f} {speedup:>7.1f}x")
+    print(f"\nTotale: per-riga {wall_row:.2f}s, bulk ({args.workers} worker) {wall_bulk:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
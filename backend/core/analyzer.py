@@ -1,84 +1,313 @@
 
+import bisect
+import hashlib
+import json
 import sqlite3
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
 import pandas as pd
 from core.database import Database
-from core.reconciliation import riconcilia_giornata, riconcilia_contanti_multi_giorno
+from core.reconciliation import (
+    riconcilia_giornata, riconcilia_contanti_multi_giorno, stato_globale, CATEGORIE_GIORNATA, TOLLERANZE,
+    ENGINE_VERSION, _totale,
+)
+
+# Days before/after a Fortech day where its AS400 deposits are searched (pass 1)
+FINESTRA_AS400 = 5
+
+
+def versione_algoritmo():
+    """ENGINE_VERSION + hash of the current TOLLERANZE, stored in report_riconciliazioni.versione_algoritmo."""
+    tolleranze = json.dumps(TOLLERANZE, sort_keys=True)
+    return f"{ENGINE_VERSION}+{hashlib.sha1(tolleranze.encode()).hexdigest()[:12]}"
+
+
+def impronta_giornata(categorie, fortech_data, as400_records, numia_records, ip_carte, ip_buoni,
+                      satispay_records, crediti_records):
+    """
+    Hash of everything the pass 1 of a day reads: the Fortech row, the AS400 deposits
+    (only when its contanti are computed day by day), the totals of the other sources
+    and the categories computed. Same hash and same versione_algoritmo -> same result.
+    """
+    dati = [
+        list(categorie),
+        [fortech_data[c] for c in PrefetchAnalisi.COLONNE_FORTECH],
+        [[r['data_registrazione'], r['importo_versato']] for r in as400_records],
+        [round(_totale(fonte, campo), 6) for fonte, campo in (
+            (numia_records, 'importo'), (ip_carte, 'importo'), (ip_buoni, 'importo'),
+            (satispay_records, 'importo_totale'), (crediti_records, 'importo_erogazione'))],
+    ]
+    return hashlib.sha1(json.dumps(dati, default=str).encode()).hexdigest()
+
+
+class PrefetchAnalisi:
+    """
+    Tutte le fonti lette una sola volta per l'intero range di analisi e
+    raggruppate per (impianto, giorno). Fortech e AS400 come record (solo le
+    colonne usate dalla riconciliazione, nello stesso ordine rowid dei _fetch_*
+    per-giorno di Analyzer); Numia, iP, Satispay e crediti come totale e numero
+    di righe, aggregati in SQL. Stessa semantica delle query per-giorno:
+    LIKE 'data%' per Numia/iP/Satispay, finestra date(±5 giorni) per AS400,
+    uguaglianza per Fortech e crediti.
+    """
+
+    COLONNE_FORTECH = (
+        'data_contabile', 'incasso_contanti_teorico', 'incasso_carte_bancarie_teorico',
+        'fatture_postpagate_totale', 'fatture_prepagate_totale',
+        'incasso_satispay_teorico', 'incasso_credito_finemese_teorico',
+    )
+    FINESTRA_AS400 = FINESTRA_AS400
+
+    def __init__(self, conn, tasks, as400=True):
+        """as400=False -> versamenti non letti (contanti della giornata non calcolati)."""
+        date = sorted({t['data_contabile'] for t in tasks if t['data_contabile'] is not None})
+        impianti = sorted({t['impianto_id'] for t in tasks})
+        self.query = 0
+
+        # Fortech: prima riga (rowid più basso) per (giorno, impianto), come fetchone()
+        self.fortech = {}
+        giorni_json = json.dumps(date)
+        filtro = f"impianto_id IN ({', '.join('?' * len(impianti))})"
+        for row in self._leggi(conn, f"""
+            SELECT id, impianto_id, {', '.join(self.COLONNE_FORTECH)}
+            FROM import_fortech_master
+            WHERE data_contabile IN (SELECT value FROM json_each(?)) AND {filtro}
+            ORDER BY id
+        """, (giorni_json, *impianti)):
+            if row['data_contabile'] is not None:   # "= NULL" non trova nulla
+                self.fortech.setdefault((row['data_contabile'], row['impianto_id']), row)
+
+        # Limiti della finestra AS400 calcolati da SQLite stesso, in una query per tutte le date
+        self.finestre = {d: (lo, hi) for d, lo, hi in self._leggi(conn, f"""
+            SELECT value, date(value, '-{self.FINESTRA_AS400} days'), date(value, '+{self.FINESTRA_AS400} days')
+            FROM json_each(?)
+        """, (giorni_json,), righe=False)}
+        limiti = [b for lo_hi in self.finestre.values() for b in lo_hi if b is not None] if as400 else []
+        # impianto -> righe ordinate per data_registrazione (+ chiavi per bisect)
+        self.as400, self._chiavi_as400 = defaultdict(list), {}
+        if limiti:
+            for row in self._leggi(conn, f"""
+                SELECT id, impianto_id, data_registrazione, importo_versato
+                FROM verifica_contanti_as400
+                WHERE data_registrazione BETWEEN ? AND ? AND {filtro}
+                ORDER BY impianto_id, data_registrazione, id
+            """, (min(limiti), max(limiti), *impianti)):
+                if isinstance(row['data_registrazione'], str):
+                    self.as400[row['impianto_id']].append(row)
+            self._chiavi_as400 = {imp: [r['data_registrazione'] for r in righe]
+                                  for imp, righe in self.as400.items()}
+
+        # Numia / iP / Satispay / crediti: la riconciliazione usa solo la somma del giorno,
+        # calcolata da SQLite con un GROUP BY per fonte -> (totale, numero righe)
+        self.totali = {
+            'numia': self._somme_per_prefisso(
+                conn, 'verifica_numia', 'data_ora_transazione', 'importo', impianti, date),
+            'ip': self._somme_per_prefisso(
+                conn, 'verifica_ip_portal', 'data_operazione', 'importo', impianti, date,
+                per_tipo=True),
+            'satispay': self._somme_per_prefisso(
+                conn, 'verifica_satispay', 'data_transazione', 'importo_totale', impianti, date),
+            'crediti': {
+                (imp, giorno): (totale, n) for imp, giorno, totale, n in self._leggi(conn, f"""
+                    SELECT impianto_id, data_erogazione, TOTAL(importo_erogazione), COUNT(*)
+                    FROM verifica_credito_clienti
+                    WHERE {filtro} AND data_erogazione IN (SELECT value FROM json_each(?))
+                    GROUP BY impianto_id, data_erogazione
+                """, (*impianti, giorni_json), righe=False)
+            },
+        }
+
+        self.nomi = {row['id']: row['nome_impianto']
+                     for row in self._leggi(conn, "SELECT id, nome_impianto FROM impianti")}
+
+    def _leggi(self, conn, sql, params=(), righe=True):
+        self.query += 1
+        cur = conn.execute(sql, params)
+        return [dict(r) for r in cur] if righe else [tuple(r) for r in cur]
+
+    def _somme_per_prefisso(self, conn, tabella, colonna_data, importo, impianti, date, per_tipo=False):
+        """
+        (impianto, prefisso[, tipo]) -> (totale, n) con prefisso = i primi len(data) caratteri
+        in minuscolo: gli stessi gruppi di LIKE 'data%' (case-insensitive solo ASCII, come lower()).
+        Solo i prefissi delle date analizzate.
+        """
+        tipo = ", tipo_transazione" if per_tipo else ""
+        somme = {}
+        for n in sorted({len(d) for d in date}):
+            prefissi = json.dumps([d.lower() for d in date if len(d) == n])
+            for row in self._leggi(conn, f"""
+                SELECT impianto_id, lower(substr({colonna_data}, 1, {n})) AS prefisso{tipo},
+                       TOTAL({importo}), COUNT(*)
+                FROM {tabella}
+                WHERE impianto_id IN ({', '.join('?' * len(impianti))})
+                  AND prefisso IN (SELECT value FROM json_each(?))
+                GROUP BY 1, 2{', 3' if per_tipo else ''}
+            """, (*impianti, prefissi), righe=False):
+                somme[row[:-2]] = row[-2:]
+        return somme
+
+    def _as400(self, date_str, impianto_id):
+        lo, hi = self.finestre.get(date_str, (None, None))
+        if lo is None or hi is None:
+            return []
+        chiavi = self._chiavi_as400.get(impianto_id, [])
+        # Confronto tra stringhe come BETWEEN: '2026-01-16T00:00' > '2026-01-16', l'ultimo giorno vale solo se identico
+        righe = self.as400[impianto_id][bisect.bisect_left(chiavi, lo):bisect.bisect_right(chiavi, hi)]
+        return [{k: v for k, v in r.items() if k != 'id'} for r in sorted(righe, key=lambda r: r['id'])]
+
+    def giornata(self, date_str, impianto_id):
+        """
+        (fortech, as400, numia, ip_carte, ip_buoni, satispay, crediti) per riconcilia_giornata:
+        record per Fortech e AS400, totali del giorno per le altre fonti.
+        """
+        prefisso = (impianto_id, str(date_str).lower())
+        vuoto = (0.0, 0)
+        return (
+            dict(self.fortech.get((date_str, impianto_id), {})),
+            self._as400(date_str, impianto_id),
+            self.totali['numia'].get(prefisso, vuoto)[0],
+            self.totali['ip'].get(prefisso + ('CARTA_PETROLIFERA',), vuoto)[0],
+            self.totali['ip'].get(prefisso + ('BUONO',), vuoto)[0],
+            self.totali['satispay'].get(prefisso, vuoto)[0],
+            self.totali['crediti'].get((impianto_id, date_str), vuoto)[0],
+        )
+
 
 class Analyzer:
-    def __init__(self, db_instance: Database):
+    # Report rows buffered before one DELETE + executemany + commit (see righe_per_commit)
+    RIGHE_PER_COMMIT = 5000
+
+    def __init__(self, db_instance: Database, prefetch=True, workers=1, categorie=None,
+                 contanti_multi_giorno=True, righe_per_commit=None, salta_invariati=True):
+        """
+        prefetch=True  -> ogni fonte letta una volta per tutto il range (PrefetchAnalisi)
+        prefetch=False -> query per ogni (giorno, impianto), come in origine
+        workers        -> processi di analisi: gli impianti sono indipendenti, ognuno è
+                          analizzato da un worker su una connessione in sola lettura e
+                          il processo chiamante scrive i risultati (1 = tutto in locale)
+        categorie      -> categorie di CATEGORIE_GIORNATA da riconciliare (default tutte)
+        contanti_multi_giorno=True  -> i contanti sono calcolati solo dal matching
+                          multi-giorno (Pass 2): il controllo legacy per singolo giorno
+                          e la sua finestra AS400 vengono saltati
+        contanti_multi_giorno=False -> contanti della Pass 1, niente Pass 2
+        righe_per_commit -> righe di report tenute in memoria prima di scriverle e fare
+                          commit (default RIGHE_PER_COMMIT; 0 = un solo commit a fine analisi)
+        salta_invariati=True -> i giorni con impronta degli input (impronta_giornata) e
+                          versione_algoritmo uguali a quelle salvate non vengono ricalcolati
+        """
         self.db = db_instance
+        self.prefetch = prefetch
+        self.workers = max(1, workers or 1)
+        self.righe_per_commit = self.RIGHE_PER_COMMIT if righe_per_commit is None else righe_per_commit
+        self.salta_invariati = salta_invariati
+        self.versione = versione_algoritmo()
+        # (impianto, giorno) Fortech esaminati dall'ultimo run_analysis, ricalcolati o no
+        self.giorni_esaminati = 0
+        self.categorie = tuple(CATEGORIE_GIORNATA if categorie is None else categorie)
+        self.contanti_multi_giorno = contanti_multi_giorno and 'contanti' in self.categorie
+        # Categories computed day by day in Pass 1
+        self.categorie_giorno = tuple(c for c in self.categorie
+                                      if not (c == 'contanti' and self.contanti_multi_giorno))
 
-    def run_analysis(self, progress_callback=None):
+    def _opzioni(self):
+        """Constructor arguments for the analyzers of the worker processes."""
+        return dict(prefetch=self.prefetch, categorie=self.categorie,
+                    contanti_multi_giorno=self.contanti_multi_giorno, salta_invariati=self.salta_invariati)
+
+    def run_analysis(self, progress_callback=None, solo_modificati=False):
         """
         Runs analysis for all dates found in Fortech Master data.
         
         Two-pass approach:
         1. Standard per-day reconciliation for all categories
         2. Multi-day contanti reconciliation per impianto (overrides contanti results)
+        
+        solo_modificati=True -> only the (impianto, giorno) keys marked by the
+        importer in analisi_da_ricalcolare, plus the days stored by another
+        versione_algoritmo, with pass 2 limited to the cash windows around them.
+        Either way the keys found are cleared at the end.
+        
+        Days whose inputs and algorithm did not change since they were stored are
+        skipped (see salta_invariati) and are not in the returned results;
+        giorni_esaminati counts them too.
         """
         conn = self.db.get_connection()
         conn.row_factory = sqlite3.Row
         
         try:
             cur = conn.cursor()
+            # analisi_da_ricalcolare and the report unique key on older databases
+            self.db.migrate(conn)
+            da_ricalcolare = [tuple(r) for r in cur.execute(
+                "SELECT impianto_id, giorno FROM analisi_da_ricalcolare")]
+            if solo_modificati:
+                # Days computed with another engine version or other TOLLERANZE
+                da_ricalcolare += [tuple(r) for r in cur.execute("""
+                    SELECT DISTINCT r.impianto_id, r.data_riferimento
+                    FROM report_riconciliazioni r
+                    WHERE r.versione_algoritmo IS NOT ?
+                    AND EXISTS (SELECT 1 FROM import_fortech_master f
+                                WHERE f.impianto_id = r.impianto_id
+                                AND substr(f.data_contabile, 1, 10) = r.data_riferimento)
+                """, (self.versione,))]
             
             # 1. Identify what to analyze based on Fortech Master Data
-            cur.execute("""
-                SELECT DISTINCT data_contabile, impianto_id 
-                FROM import_fortech_master 
-                ORDER BY data_contabile DESC, impianto_id
-            """)
+            if solo_modificati:
+                cur.execute("""
+                    SELECT DISTINCT data_contabile, impianto_id
+                    FROM import_fortech_master
+                    WHERE (impianto_id, substr(data_contabile, 1, 10)) IN (SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?))
+                    ORDER BY data_contabile DESC, impianto_id
+                """, (json.dumps(da_ricalcolare),))
+            else:
+                cur.execute("""
+                    SELECT DISTINCT data_contabile, impianto_id 
+                    FROM import_fortech_master 
+                    ORDER BY data_contabile DESC, impianto_id
+                """)
             tasks = cur.fetchall()
-            
-            total_tasks = len(tasks)
-            results = []
-            
-            # ── Pass 1: Standard per-day reconciliation ──
+            total_tasks = self.giorni_esaminati = len(tasks)
+
+            giorni = None
+            if solo_modificati:
+                giorni = defaultdict(list)
+                for impianto_id, giorno in da_ricalcolare:
+                    giorni[impianto_id].append(giorno)
+
+            # One shard per impianto: its days for pass 1, its cash windows for pass 2
+            shards = {}
             for index, task in enumerate(tasks):
-                date_str = task['data_contabile']
-                impianto_id = task['impianto_id']
-                
-                if progress_callback:
-                    cur.execute("SELECT nome_impianto FROM impianti WHERE id = ?", (impianto_id,))
-                    plant_row = cur.fetchone()
-                    plant_name = plant_row['nome_impianto'] if plant_row else f"ID {impianto_id}"
-                    progress_callback(index, total_tasks, f"Riconciliazione {date_str} - {plant_name}...")
-                
-                # Fetch data
-                fortech_data = self._fetch_fortech(conn, date_str, impianto_id)
-                if not fortech_data:
-                    continue
+                shards.setdefault(task['impianto_id'], []).append((index, task['data_contabile']))
+            for (impianto_id,) in cur.execute("SELECT DISTINCT impianto_id FROM import_fortech_master").fetchall():
+                if self.contanti_multi_giorno and (giorni is None or impianto_id in giorni):
+                    shards.setdefault(impianto_id, [])
 
-                as400_records = self._fetch_as400(conn, date_str, impianto_id)
-                numia_records = self._fetch_numia(conn, date_str, impianto_id)
-                ip_carte, ip_buoni = self._fetch_ip(conn, date_str, impianto_id)
-                satispay_records = self._fetch_satispay(conn, date_str, impianto_id)
-                crediti_records = self._fetch_crediti(conn, date_str, impianto_id)
-                
-                # Run logic
-                res_dict = riconcilia_giornata(
-                    fortech_data,
-                    as400_records,
-                    numia_records,
-                    ip_carte,
-                    ip_buoni,
-                    satispay_records,
-                    crediti_records
-                )
-                
-                # Save to DB and commit immediately to release locks
-                self._save_result(conn, res_dict, impianto_id)
-                conn.commit()
-                results.append(res_dict)
-
-            # ── Pass 2: Multi-day contanti reconciliation per impianto ──
-            self._run_contanti_multi_giorno(conn, progress_callback)
+            # Single writer: shards are buffered and written righe_per_commit rows at a time
+            results = {}
+            scrittura = _ScritturaReport(cur, self.righe_per_commit)
+            for impianto_id, (risultati, contanti) in self._analizza_shards(
+                    conn, shards, giorni, progress_callback, total_tasks):
+                for index, res_dict, (fortech_master_id, impronta) in risultati:
+                    self._save_result(scrittura, res_dict, impianto_id, fortech_master_id, impronta)
+                    results[index] = res_dict
+                self._scrivi_contanti(scrittura, impianto_id, contanti)
+                if scrittura.piena():
+                    scrittura.flush()
+                    conn.commit()
+
+            # Last batch and the keys read, in the same transaction.
+            # Keys marked by imports that ran meanwhile stay for the next run
+            scrittura.flush()
+            cur.executemany("DELETE FROM analisi_da_ricalcolare WHERE impianto_id = ? AND giorno = ?",
+                            da_ricalcolare)
             conn.commit()
             
             if progress_callback:
                 progress_callback(total_tasks, total_tasks, "Analisi completata.")
             
-            return results
+            # Same order as the tasks (most recent day first)
+            return [results[index] for index in sorted(results)]
 
         except Exception as e:
             print(f"Errore durante l'analisi: {e}")
@@ -87,81 +316,244 @@ class Analyzer:
         finally:
             conn.close()
 
-    def _run_contanti_multi_giorno(self, conn, progress_callback=None):
+    def _start_pool(self, n_shards):
+        """Process pool for the shards, or None to analyze in the calling process."""
+        if self.workers < 2 or n_shards < 2:
+            return None
+        try:
+            return ProcessPoolExecutor(max_workers=min(self.workers, n_shards))
+        except (OSError, NotImplementedError) as e:
+            # e.g. serverless runtimes without /dev/shm: analyze sequentially
+            print(f"Process pool unavailable ({e}), analyzing sequentially.")
+            return None
+
+    def _analizza_shards(self, conn, shards, giorni, progress_callback, total_tasks):
+        """Yields (impianto_id, (risultati, contanti)) per shard, as each one completes."""
+        pool = self._start_pool(len(shards))
+        if pool is None:
+            fatti = 0
+            for impianto_id, tasks in shards.items():
+                yield impianto_id, self._analizza_impianto(
+                    conn, impianto_id, tasks, giorni and giorni.get(impianto_id),
+                    progress_callback, fatti, total_tasks)
+                fatti += len(tasks)
+            return
+
+        with pool:
+            futures = {
+                pool.submit(_analizza_shard, str(self.db.root_path), self._opzioni(),
+                            impianto_id, tasks, giorni and giorni.get(impianto_id)): impianto_id
+                for impianto_id, tasks in shards.items()
+            }
+            fatti = 0
+            for future in as_completed(futures):
+                impianto_id = futures[future]
+                fatti += len(shards[impianto_id])
+                if progress_callback:
+                    progress_callback(fatti, total_tasks, f"Analisi impianto {impianto_id} completata")
+                yield impianto_id, future.result()
+
+    def _analizza_impianto(self, conn, impianto_id, tasks, giorni=None,
+                           progress_callback=None, fatti=0, total_tasks=0):
         """
-        Esegue la riconciliazione contanti multi-giorno per ogni impianto.
-        Raggruppa tutti i giorni Fortech per impianto e li confronta con
-        tutti i versamenti AS400 del periodo, sovrascrivendo i risultati
-        contanti prodotti dalla Pass 1.
+        Pass 1 and pass 2 of one impianto, without writing anything.
+        tasks: [(indice, data_contabile)]; giorni: modified days (None = whole pass 2).
+        Returns ([(indice, risultato giornata, (fortech_master_id, impronta))],
+        [righe contanti multi-giorno]); unchanged days are left out (salta_invariati).
         """
         cur = conn.cursor()
+        risultati = []
+        contanti_giorno = 'contanti' in self.categorie_giorno
+        # Fixed number of queries, whatever the number of days
+        dati = None
+        if self.prefetch and tasks:
+            dati = PrefetchAnalisi(conn, [{'data_contabile': d, 'impianto_id': impianto_id} for _, d in tasks],
+                                   as400=contanti_giorno)
+        salvate = self._impronte_salvate(cur, impianto_id, tasks) if self.salta_invariati else {}
         
-        # Trova tutti gli impianti con dati Fortech
-        cur.execute("SELECT DISTINCT impianto_id FROM import_fortech_master")
-        impianti = [row['impianto_id'] for row in cur.fetchall()]
-        
-        for impianto_id in impianti:
-            # Fetch tutti i giorni Fortech per questo impianto
-            cur.execute("""
-                SELECT data_contabile, incasso_contanti_teorico 
-                FROM import_fortech_master 
-                WHERE impianto_id = ?
-                ORDER BY data_contabile
-            """, (impianto_id,))
-            fortech_rows = [dict(r) for r in cur.fetchall()]
+        # ── Pass 1: Standard per-day reconciliation ──
+        for n, (index, date_str) in enumerate(tasks):
+            if progress_callback:
+                if dati:
+                    plant_name = dati.nomi.get(impianto_id) or f"ID {impianto_id}"
+                else:
+                    cur.execute("SELECT nome_impianto FROM impianti WHERE id = ?", (impianto_id,))
+                    plant_row = cur.fetchone()
+                    plant_name = plant_row['nome_impianto'] if plant_row else f"ID {impianto_id}"
+                progress_callback(fatti + n, total_tasks, f"Riconciliazione {date_str} - {plant_name}...")
             
-            if not fortech_rows:
-                continue
+            # Fetch data
+            if dati:
+                (fortech_data, as400_records, numia_records, ip_carte, ip_buoni,
+                 satispay_records, crediti_records) = dati.giornata(date_str, impianto_id)
+                if not fortech_data:
+                    continue
+            else:
+                fortech_data = self._fetch_fortech(conn, date_str, impianto_id)
+                if not fortech_data:
+                    continue
+
+                as400_records = self._fetch_as400(conn, date_str, impianto_id) if contanti_giorno else []
+                numia_records = self._fetch_numia(conn, date_str, impianto_id)
+                ip_carte, ip_buoni = self._fetch_ip(conn, date_str, impianto_id)
+                satispay_records = self._fetch_satispay(conn, date_str, impianto_id)
+                crediti_records = self._fetch_crediti(conn, date_str, impianto_id)
             
-            # Determina il range date
-            date_fortech = [r['data_contabile'] for r in fortech_rows if r['data_contabile']]
-            if not date_fortech:
+            impronta = impronta_giornata(self.categorie_giorno, fortech_data, as400_records, numia_records,
+                                         ip_carte, ip_buoni, satispay_records, crediti_records)
+            salvata = salvate.get(date_str[:10], {})
+            if self.categorie_giorno and all(salvata.get(c) == (impronta, self.versione)
+                                             for c in self.categorie_giorno):
                 continue
-            data_min = min(date_fortech)
-            data_max = max(date_fortech)
-            
-            # Fetch tutti i versamenti AS400 nel periodo allargato
-            cur.execute("""
-                SELECT * FROM verifica_contanti_as400 
-                WHERE impianto_id = ?
-                AND data_registrazione BETWEEN date(?, '-2 days') AND date(?, '+7 days')
-                ORDER BY data_registrazione
-            """, (impianto_id, data_min, data_max))
-            as400_all = [dict(r) for r in cur.fetchall()]
-            
-            # Esegui riconciliazione multi-giorno
-            risultati_multi = riconcilia_contanti_multi_giorno(
-                fortech_rows, as400_all, impianto_id=str(impianto_id)
+
+            # Run logic
+            res_dict = riconcilia_giornata(
+                fortech_data,
+                as400_records,
+                numia_records,
+                ip_carte,
+                ip_buoni,
+                satispay_records,
+                crediti_records,
+                categorie=self.categorie_giorno
             )
-            
-            # Sovrascrivi i risultati contanti nella tabella report
-            for ris in risultati_multi:
-                cur.execute("""
-                    DELETE FROM report_riconciliazioni 
-                    WHERE impianto_id = ? AND data_riferimento = ? AND categoria = 'contanti'
-                """, (impianto_id, ris.data))
-                
-                pct = 0.0
-                if ris.valore_teorico != 0:
-                    pct = (ris.differenza / ris.valore_teorico) * 100
-                
-                cur.execute("""
-                    INSERT INTO report_riconciliazioni (
-                        impianto_id, data_riferimento, categoria,
-                        valore_fortech, valore_reale, differenza, percentuale_scostamento,
-                        stato, tipo_anomalia, note, risolto
-                    ) VALUES (?, ?, 'contanti', ?, ?, ?, ?, ?, ?, ?, 0)
-                """, (
-                    impianto_id, ris.data,
-                    ris.valore_teorico, ris.valore_reale, ris.differenza,
-                    round(pct, 2), ris.stato.value,
-                    ris.match_info.get('tipo_match', '') if ris.match_info else None,
-                    ris.note
-                ))
-            
-            # Release DB lock after finishing an implant
-            conn.commit()
+            risultati.append((index, res_dict, (fortech_data.get('id'), impronta)))
+
+        if not self.contanti_multi_giorno:
+            return risultati, []
 
+        # ── Pass 2: Multi-day contanti reconciliation ──
+        finestre = [(None, None, None, None)] if giorni is None else self._finestre_contanti(giorni)
+        contanti = [riga for finestra in finestre
+                    for riga in self._contanti_multi_giorno_impianto(cur, impianto_id, *finestra)]
+
+        # The contanti of the Pass 1 days go into their day result (and are saved with it),
+        # only the other days of the windows are written on their own
+        per_giorno = defaultdict(list)
+        for _, res_dict, _ in risultati:
+            per_giorno[res_dict['data']].append(res_dict)
+        altri = []
+        for riga in contanti:
+            giorni_pass1 = per_giorno.get(riga[0])
+            if not giorni_pass1:
+                altri.append(riga)
+                continue
+            data, teorico, reale, differenza, _, stato, tipo_match, note, _ = riga
+            for res_dict in giorni_pass1:
+                res_dict['risultati'] = {
+                    'contanti': {'stato': stato, 'teorico': teorico, 'reale': reale,
+                                 'differenza': differenza, 'note': note, 'tipo_anomalia': tipo_match},
+                    **res_dict['risultati'],
+                }
+                res_dict['stato_globale'] = stato_globale(d['stato'] for d in res_dict['risultati'].values())
+        return risultati, altri
+
+    def _impronte_salvate(self, cur, impianto_id, tasks):
+        """giorno -> {categoria: (impronta_input, versione_algoritmo)} stored for the days of tasks."""
+        cur.execute("""
+            SELECT data_riferimento, categoria, impronta_input, versione_algoritmo
+            FROM report_riconciliazioni
+            WHERE impianto_id = ? AND data_riferimento IN (SELECT value FROM json_each(?))
+        """, (impianto_id, json.dumps(sorted({d[:10] for _, d in tasks if d}))))
+        salvate = defaultdict(dict)
+        for giorno, categoria, impronta, versione in cur.fetchall():
+            salvate[giorno][categoria] = (impronta, versione)
+        return salvate
+
+    # Incremental pass 2: a deposit covers Fortech days up to giorni_elastici before it, a
+    # cumulative one up to max_giorni_cumulativi days: the contanti results within this
+    # many days of a modified day are rewritten, matched with as many days of context
+    # on each side (the greedy matching only couples nearby days).
+    MARGINE_CONTANTI = (TOLLERANZE['contanti']['giorni_elastici']
+                        + TOLLERANZE['contanti']['max_giorni_cumulativi'])
+
+    @classmethod
+    def _finestre_contanti(cls, giorni):
+        """
+        Modified days -> [(inizio, fine, scrivi_da, scrivi_a)]: Fortech days read
+        and contanti results rewritten, merging windows that overlap.
+        """
+        margine = timedelta(days=cls.MARGINE_CONTANTI)
+        gruppi = []
+        for g in sorted({date.fromisoformat(g) for g in giorni}):
+            if gruppi and g - gruppi[-1][1] <= 4 * margine:
+                gruppi[-1][1] = g
+            else:
+                gruppi.append([g, g])
+        return [((primo - 2 * margine).isoformat(), (ultimo + 2 * margine).isoformat(),
+                 (primo - margine).isoformat(), (ultimo + margine).isoformat())
+                for primo, ultimo in gruppi]
+
+    def _contanti_multi_giorno_impianto(self, cur, impianto_id, inizio=None, fine=None,
+                                        scrivi_da=None, scrivi_a=None):
+        """
+        Riconciliazione contanti multi-giorno di un impianto: tutti i giorni Fortech
+        (o quelli in [inizio, fine]) contro i versamenti AS400 del periodo.
+        Restituisce le righe contanti da riscrivere (solo [scrivi_da, scrivi_a] se indicati).
+        """
+        # Fetch tutti i giorni Fortech per questo impianto
+        cur.execute("""
+            SELECT id, data_contabile, incasso_contanti_teorico 
+            FROM import_fortech_master 
+            WHERE impianto_id = ?
+            AND (? IS NULL OR substr(data_contabile, 1, 10) BETWEEN ? AND ?)
+            ORDER BY data_contabile
+        """, (impianto_id, inizio, inizio, fine))
+        fortech_rows = [dict(r) for r in cur.fetchall()]
+        
+        if not fortech_rows:
+            return []
+        
+        # Determina il range date
+        date_fortech = [r['data_contabile'] for r in fortech_rows if r['data_contabile']]
+        if not date_fortech:
+            return []
+        data_min = min(date_fortech)
+        data_max = max(date_fortech)
+        
+        # Fetch tutti i versamenti AS400 nel periodo allargato
+        cur.execute("""
+            SELECT * FROM verifica_contanti_as400 
+            WHERE impianto_id = ?
+            AND data_registrazione BETWEEN date(?, '-2 days') AND date(?, '+7 days')
+            ORDER BY data_registrazione
+        """, (impianto_id, data_min, data_max))
+        as400_all = [dict(r) for r in cur.fetchall()]
+        
+        # Esegui riconciliazione multi-giorno
+        risultati_multi = riconcilia_contanti_multi_giorno(
+            fortech_rows, as400_all, impianto_id=str(impianto_id)
+        )
+        
+        # Fortech row of each day (the first one, as in pass 1)
+        fortech_ids = {}
+        for r in fortech_rows:
+            if r['data_contabile']:
+                fortech_ids.setdefault(r['data_contabile'][:10], r['id'])
+
+        righe = []
+        for ris in risultati_multi:
+            # Giorni di solo contesto: il loro risultato resta quello del run precedente
+            if scrivi_da and not (scrivi_da <= ris.data <= scrivi_a):
+                continue
+            pct = 0.0
+            if ris.valore_teorico != 0:
+                pct = (ris.differenza / ris.valore_teorico) * 100
+            righe.append((
+                ris.data,
+                ris.valore_teorico, ris.valore_reale, ris.differenza,
+                round(pct, 2), ris.stato.value,
+                ris.match_info.get('tipo_match', '') if ris.match_info else None,
+                ris.note,
+                fortech_ids.get(ris.data)
+            ))
+        return righe
+
+    def _scrivi_contanti(self, scrittura, impianto_id, righe):
+        """Sovrascrive i risultati contanti della Pass 1 con quelli multi-giorno."""
+        for data, *valori in righe:
+            scrittura.aggiungi(impianto_id, data, [(impianto_id, data, 'contanti', *valori, self.versione, None)],
+                               solo_contanti=True)
 
     def _fetch_fortech(self, conn, date_str, impianto_id):
         cur = conn.cursor()
@@ -174,9 +566,9 @@ class Analyzer:
         cur = conn.cursor()
         cur.execute("""
             SELECT * FROM verifica_contanti_as400 
-            WHERE data_registrazione BETWEEN date(?, '-5 days') AND date(?, '+5 days')
+            WHERE data_registrazione BETWEEN date(?, ?) AND date(?, ?)
             AND impianto_id = ?
-        """, (date_str, date_str, impianto_id))
+        """, (date_str, f'-{FINESTRA_AS400} days', date_str, f'+{FINESTRA_AS400} days', impianto_id))
         return [dict(row) for row in cur.fetchall()]
 
     def _fetch_numia(self, conn, date_str, impianto_id):
@@ -221,25 +613,13 @@ class Analyzer:
         """, (date_str, impianto_id))
         return [dict(row) for row in cur.fetchall()]
 
-    def _save_result(self, conn, res, impianto_id):
+    def _save_result(self, scrittura, res, impianto_id, fortech_master_id=None, impronta=None):
         """
-        Saves the reconciliation result dictionary to 'report_riconciliazioni'.
-        Deletes existing records for that day/plant first to ensure clean state.
+        Queues the reconciliation result dictionary for 'report_riconciliazioni'.
+        Categories of that day/plant that are no longer computed are deleted.
+        The pass 1 categories carry the input fingerprint of the day (impronta).
         """
-        cur = conn.cursor()
-        data_rif = res['data']
-        
-        # Clean old results for this day/plant
-        cur.execute("DELETE FROM report_riconciliazioni WHERE data_riferimento = ? AND impianto_id = ?", (data_rif, impianto_id))
-        
-        insert_sql = """
-            INSERT INTO report_riconciliazioni (
-                impianto_id, data_riferimento, categoria, 
-                valore_fortech, valore_reale, differenza, percentuale_scostamento,
-                stato, tipo_anomalia, note, risolto
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
-        """
-        
+        righe = []
         for cat, details in res['risultati'].items():
             # Calculate pct deviation if needed, else 0
             val_teorico = details['teorico']
@@ -248,15 +628,107 @@ class Analyzer:
             if val_teorico != 0:
                 pct = (val_diff / val_teorico) * 100
             
-            cur.execute(insert_sql, (
+            righe.append((
                 impianto_id,
-                data_rif,
+                res['data'],
                 cat,
                 val_teorico,
                 details['reale'],
                 val_diff,
                 round(pct, 2),
                 details['stato'],
-                None, # Tipo anomalia (optional detail)
-                details['note']
+                details.get('tipo_anomalia'),  # Set by the multi-day contanti match
+                details['note'],
+                fortech_master_id,
+                self.versione,
+                impronta if cat in self.categorie_giorno else None
             ))
+        scrittura.aggiungi(impianto_id, res['data'], righe)
+
+
+class _ScritturaReport:
+    """
+    Report rows buffered in memory and upserted with one executemany per flush on the
+    (impianto_id, data_riferimento, categoria) key: a row is rewritten only if a computed
+    value changed, and the operator verification (risolto, verificato_da, data_verifica)
+    is never touched. Once a row is verified its stato and note (possibly set by the
+    operator, see /api/contanti-conferma) change only together with the amounts.
+    One DELETE per impianto drops the categories a rewritten day no longer has.
+    The caller decides when to commit.
+    """
+
+    # The computed amounts of the stored row differ from the new ones
+    _IMPORTI_CAMBIATI = """
+        (valore_fortech, valore_reale, differenza, percentuale_scostamento, tipo_anomalia)
+        IS NOT (excluded.valore_fortech, excluded.valore_reale, excluded.differenza,
+                excluded.percentuale_scostamento, excluded.tipo_anomalia)
+    """
+
+    # Only fingerprint/version changed (e.g. another category of the same day moved):
+    # on a verified row stato and note stay those left by the operator
+    UPSERT_SQL = f"""
+        INSERT INTO report_riconciliazioni (
+            impianto_id, data_riferimento, categoria,
+            valore_fortech, valore_reale, differenza, percentuale_scostamento,
+            stato, tipo_anomalia, note, fortech_master_id, versione_algoritmo, impronta_input, risolto
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+        ON CONFLICT (impianto_id, data_riferimento, categoria) DO UPDATE SET
+            valore_fortech = excluded.valore_fortech,
+            valore_reale = excluded.valore_reale,
+            differenza = excluded.differenza,
+            percentuale_scostamento = excluded.percentuale_scostamento,
+            stato = CASE WHEN verificato_da IS NOT NULL AND NOT {_IMPORTI_CAMBIATI}
+                         THEN stato ELSE excluded.stato END,
+            tipo_anomalia = excluded.tipo_anomalia,
+            note = CASE WHEN verificato_da IS NOT NULL AND NOT {_IMPORTI_CAMBIATI}
+                        THEN note ELSE excluded.note END,
+            fortech_master_id = excluded.fortech_master_id,
+            versione_algoritmo = excluded.versione_algoritmo,
+            impronta_input = excluded.impronta_input,
+            data_elaborazione = CURRENT_TIMESTAMP
+        WHERE {_IMPORTI_CAMBIATI}
+           OR (fortech_master_id, versione_algoritmo, impronta_input)
+              IS NOT (excluded.fortech_master_id, excluded.versione_algoritmo, excluded.impronta_input)
+           OR (verificato_da IS NULL AND (stato, note) IS NOT (excluded.stato, excluded.note))
+    """
+
+    def __init__(self, cur, righe_per_commit):
+        self.cur = cur
+        self.righe_per_commit = righe_per_commit
+        self.righe = []
+        # impianto_id -> giorni riscritti per intero (i giorni con solo i contanti non perdono categorie)
+        self.giorni = defaultdict(list)
+
+    def aggiungi(self, impianto_id, data, righe, solo_contanti=False):
+        if not solo_contanti:
+            self.giorni[impianto_id].append(data)
+        self.righe.extend(righe)
+
+    def piena(self):
+        return 0 < self.righe_per_commit <= len(self.righe)
+
+    def flush(self):
+        chiavi = defaultdict(list)
+        for impianto_id, data, categoria, *_ in self.righe:
+            chiavi[impianto_id].append((data, categoria))
+        for impianto_id, giorni in self.giorni.items():
+            self.cur.execute("""
+                DELETE FROM report_riconciliazioni
+                WHERE impianto_id = ?
+                AND data_riferimento IN (SELECT value FROM json_each(?))
+                AND (data_riferimento, categoria) NOT IN (SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?))
+            """, (impianto_id, json.dumps(giorni), json.dumps(chiavi[impianto_id])))
+        self.cur.executemany(self.UPSERT_SQL, self.righe)
+        self.righe = []
+        self.giorni.clear()
+
+
+def _analizza_shard(root_path, opzioni, impianto_id, tasks, giorni):
+    """Process-pool worker: one impianto analyzed on a read-only connection (see Analyzer.workers)."""
+    analyzer = Analyzer(Database(root_path), **opzioni)
+    conn = analyzer.db.get_readonly_connection()
+    conn.row_factory = sqlite3.Row
+    try:
+        return analyzer._analizza_impianto(conn, impianto_id, tasks, giorni)
+    finally:
+        conn.close()
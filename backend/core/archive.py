@@ -0,0 +1,74 @@
+"""
+Archivi ZIP caricati al posto dei singoli file Excel.
+
+I membri Excel vengono estratti uno alla volta, a blocchi (mai l'intero
+archivio in memoria), e restituiti appena scritti su disco: passato a
+DataImporter.import_files, expand_uploads() fa partire classificazione e
+parsing del primo file mentre l'estrazione dei successivi prosegue.
+"""
+
+import os
+import shutil
+import zipfile
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+# Limite sul totale estratto per archivio (protezione da zip bomb)
+MAX_EXTRACT_MB = int(os.environ.get('CALOR_ZIP_MAX_MB', 1024))
+
+
+def is_zip(path):
+    return str(path).lower().endswith('.zip') and zipfile.is_zipfile(path)
+
+
+def excel_members(zf):
+    """Excel members of an open archive, skipping folders, lock files and macOS metadata."""
+    members = []
+    for info in zf.infolist():
+        name = os.path.basename(info.filename)
+        if (info.is_dir() or '__MACOSX' in info.filename or name.startswith(('~$', '.'))
+                or not name.lower().endswith(EXCEL_EXTENSIONS)):
+            continue
+        members.append(info)
+    return members
+
+
+def zip_member_names(zip_path):
+    """Names of the Excel files in an archive, without extracting it."""
+    with zipfile.ZipFile(zip_path) as zf:
+        return [os.path.basename(info.filename) for info in excel_members(zf)]
+
+
+def _unique_path(dest_dir, name):
+    # Same name in different archive folders: keep both
+    base, ext = os.path.splitext(name)
+    path = os.path.join(dest_dir, name)
+    n = 1
+    while os.path.exists(path):
+        path = os.path.join(dest_dir, f"{base}_{n}{ext}")
+        n += 1
+    return path
+
+
+def iter_zip_members(zip_path, dest_dir, max_mb=None):
+    """Extracts the Excel members into dest_dir one by one, yielding each path once written."""
+    limit = (max_mb if max_mb is not None else MAX_EXTRACT_MB) * 1024 * 1024
+    estratti = 0
+    with zipfile.ZipFile(zip_path) as zf:
+        for info in excel_members(zf):
+            estratti += info.file_size
+            if estratti > limit:
+                raise ValueError(f"{os.path.basename(zip_path)}: more than {limit // 1024 // 1024} MB to extract")
+            # Only the basename: member paths like ../../x.xlsx never leave dest_dir
+            dest = _unique_path(dest_dir, os.path.basename(info.filename))
+            with zf.open(info) as src, open(dest, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+            yield dest
+
+
+def expand_uploads(paths, dest_dir, max_mb=None):
+    """Yields plain files as they are and the Excel members of every ZIP as they are extracted."""
+    for path in paths:
+        if is_zip(path):
+            yield from iter_zip_members(path, dest_dir, max_mb)
+        else:
+            yield path
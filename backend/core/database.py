@@ -1,5 +1,6 @@
 
 import sqlite3
+from contextlib import contextmanager
 from pathlib import Path
 import pandas as pd
 
@@ -21,6 +22,145 @@ class Database:
         conn.execute('PRAGMA journal_mode=WAL;')
         return conn
 
+    def get_readonly_connection(self):
+        """Connection that cannot write (analysis workers): reads the WAL snapshot of the writer."""
+        return sqlite3.connect(f"{self.db_path.resolve().as_uri()}?mode=ro", uri=True, timeout=30.0)
+
+    # Bulk-load profile, applied only while an import runs (see bulk_load()).
+    # In WAL mode synchronous=NORMAL syncs at checkpoints instead of every commit
+    # and still cannot corrupt the database on power loss.
+    BULK_PRAGMAS = {
+        'synchronous': 'NORMAL',
+        'cache_size': -65536,       # 64 MiB page cache
+        'temp_store': 'MEMORY',
+    }
+
+    @contextmanager
+    def bulk_load(self, conn):
+        """Applies BULK_PRAGMAS to conn and restores the previous values on exit."""
+        previous = {name: conn.execute(f"PRAGMA {name}").fetchone()[0] for name in self.BULK_PRAGMAS}
+        for name, value in self.BULK_PRAGMAS.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        try:
+            yield conn
+        finally:
+            for name, value in previous.items():
+                conn.execute(f"PRAGMA {name}={value}")
+
+    # Columns added to log_importazioni after the first schema release
+    LOG_IMPORT_COLUMNS = {
+        'hash_file': 'VARCHAR(64)',
+        'dimensione_byte': 'INTEGER',
+        'durata_secondi': 'REAL',
+        'righe_duplicate': 'INTEGER',
+    }
+
+    # Columns added to report_riconciliazioni after the first schema release
+    REPORT_COLUMNS = {
+        'impronta_input': 'VARCHAR(40)',
+    }
+
+    # Natural keys: (unique index, columns). Verification rows are inserted with
+    # INSERT OR IGNORE, so overlapping files add only new rows; report rows are
+    # upserted by the Analyzer, so operator verification survives re-analysis.
+    NATURAL_KEYS = {
+        'verifica_contanti_as400': ('uq_as400_registrazione', ('numero_registrazione', 'data_registrazione')),
+        'verifica_numia': ('uq_numia_transazione', ('id_transazione_numia',)),
+        'verifica_satispay': ('uq_satispay_transazione', ('id_transazione',)),
+        'report_riconciliazioni': ('uq_report_giorno_categoria', ('impianto_id', 'data_riferimento', 'categoria')),
+    }
+
+    # (impianto, giorno) keys touched by imports and not re-analyzed yet (see Analyzer.run_analysis)
+    DA_RICALCOLARE_SQL = """
+        CREATE TABLE IF NOT EXISTS analisi_da_ricalcolare (
+            impianto_id INTEGER NOT NULL,
+            giorno DATE NOT NULL,
+            PRIMARY KEY (impianto_id, giorno)
+        ) WITHOUT ROWID
+    """
+
+    def migrate(self, conn):
+        """Applies the schema additions that initialize() only creates on fresh databases."""
+        self.ensure_log_importazioni(conn)
+        self.ensure_report_riconciliazioni(conn)
+        self.ensure_natural_keys(conn)
+        self.ensure_analisi_da_ricalcolare(conn)
+
+    def ensure_log_importazioni(self, conn):
+        """Brings log_importazioni of databases created with an older schema up to date."""
+        esistenti = {row[1] for row in conn.execute("PRAGMA table_info(log_importazioni)")}
+        if not esistenti:
+            return
+        for nome, tipo in self.LOG_IMPORT_COLUMNS.items():
+            if nome not in esistenti:
+                conn.execute(f"ALTER TABLE log_importazioni ADD COLUMN {nome} {tipo}")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_log_hash ON log_importazioni(hash_file)")
+        conn.commit()
+
+    def ensure_report_riconciliazioni(self, conn):
+        """Brings report_riconciliazioni of databases created with an older schema up to date."""
+        esistenti = {row[1] for row in conn.execute("PRAGMA table_info(report_riconciliazioni)")}
+        if not esistenti:
+            return
+        for nome, tipo in self.REPORT_COLUMNS.items():
+            if nome not in esistenti:
+                conn.execute(f"ALTER TABLE report_riconciliazioni ADD COLUMN {nome} {tipo}")
+        conn.commit()
+
+    def ensure_natural_keys(self, conn):
+        """Creates the natural-key unique indexes, first dropping the duplicates already stored."""
+        for table, (index, columns) in self.NATURAL_KEYS.items():
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index,)
+            ).fetchone()
+            if exists:
+                continue
+            cols = ', '.join(columns)
+            # NULL keys are distinct for a unique index, so they are left alone
+            not_null = ' AND '.join(f"{c} IS NOT NULL" for c in columns)
+            conn.execute(f"""
+                DELETE FROM {table}
+                WHERE {not_null}
+                  AND id NOT IN (SELECT MIN(id) FROM {table} WHERE {not_null} GROUP BY {cols})
+            """)
+            conn.execute(f"CREATE UNIQUE INDEX {index} ON {table}({cols})")
+        conn.commit()
+
+    def ensure_analisi_da_ricalcolare(self, conn):
+        """
+        Creates the dirty-day table. On a database that already holds data every
+        Fortech day is marked, so the first incremental analysis covers it all.
+        """
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'analisi_da_ricalcolare'"
+        ).fetchone()
+        if exists:
+            return
+        conn.execute(self.DA_RICALCOLARE_SQL)
+        conn.execute("""
+            INSERT OR IGNORE INTO analisi_da_ricalcolare (impianto_id, giorno)
+            SELECT DISTINCT impianto_id, date(substr(data_contabile, 1, 10))
+            FROM import_fortech_master
+            WHERE impianto_id IS NOT NULL AND date(substr(data_contabile, 1, 10)) IS NOT NULL
+        """)
+        conn.commit()
+
+    @staticmethod
+    def mark_dirty_days(conn, table, day_column, after_id, offsets=(0,)):
+        """
+        Marks the (impianto, giorno) keys of the rows of `table` with id > after_id,
+        each day shifted by every value in `offsets` (e.g. -5..+5 for AS400 deposits).
+        """
+        offsets_json = '[' + ', '.join(str(int(o)) for o in offsets) + ']'
+        conn.execute(f"""
+            INSERT OR IGNORE INTO analisi_da_ricalcolare (impianto_id, giorno)
+            SELECT DISTINCT impianto_id, giorno FROM (
+                SELECT t.impianto_id, date(substr(t.{day_column}, 1, 10), o.value || ' days') AS giorno
+                FROM {table} t, json_each(?) o
+                WHERE t.id > ? AND t.impianto_id IS NOT NULL
+            ) WHERE giorno IS NOT NULL
+        """, (offsets_json, after_id))
+
     def initialize(self):
         if not self.schema_path.exists():
             print(f"Schema file not found at {self.schema_path}")
@@ -1,41 +1,87 @@
-
 import os
+from dataclasses import dataclass
+from itertools import islice
+
+import openpyxl
+
+from core.sources import SOURCES, source_from_filename
+
+
+@dataclass
+class Classification:
+    source: str          # SOURCES key or "UNKNOWN"
+    header_row: int      # 0-based, as header= of pd.read_excel
+    score: float         # Fraction of the source signature found in the header row
+    by: str              # "content", "filename" or "none"
+
 
 class FileClassifier:
+    # Rows inspected for a header: the known sources put it within the first 3
+    HEADER_ROWS = 10
+    # Below this signature score the content is not trusted and the filename decides
+    MIN_SCORE = 0.5
+
     @staticmethod
-    def classify_files(file_paths):
+    def read_header_rows(path, max_rows=HEADER_ROWS):
+        """First max_rows rows of the first sheet, read-only (no full workbook load)."""
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            return list(islice(wb.worksheets[0].iter_rows(values_only=True), max_rows))
+        finally:
+            wb.close()
+
+    @classmethod
+    def classify_file(cls, path):
+        """
+        Source and header offset of one file from its header signature.
+        The filename keywords break ties and decide when the content is
+        unreadable (.xls, corrupt file) or matches no signature.
         """
-        Classifies files based on keywords in their names.
+        by_name = source_from_filename(os.path.basename(path))
+        try:
+            rows = cls.read_header_rows(path)
+        except Exception:
+            rows = []
+
+        # Best (score, row) per source; the topmost row wins on equal score
+        best = {}
+        for idx, row in enumerate(rows):
+            values = {str(v).strip() for v in row if v is not None}
+            for name, schema in SOURCES.items():
+                if not schema.signature:
+                    continue
+                score = sum(1 for col in schema.signature if col in values) / len(schema.signature)
+                if score > best.get(name, (0.0, 0))[0]:
+                    best[name] = (score, idx)
+
+        if best:
+            top = max(score for score, _ in best.values())
+            if top >= cls.MIN_SCORE:
+                tied = [name for name, (score, _) in best.items() if score == top]
+                source = by_name if by_name in tied else tied[0]
+                return Classification(source, best[source][1], top, "content")
+
+        if by_name:
+            return Classification(by_name, SOURCES[by_name].header_row, 0.0, "filename")
+        return Classification("UNKNOWN", 0, 0.0, "none")
+
+    @classmethod
+    def classify_files(cls, file_paths, details=None):
+        """
+        Classifies files from their header rows (core.sources signatures),
+        with the filename keywords as tiebreaker and fallback.
         Returns a dictionary mapping file types to lists of file paths.
+        details: optional dict filled with path -> Classification.
         """
-        classified = {
-            "FORTECH": [],
-            "AS400": [],
-            "NUMIA": [],
-            "IP_CARTE": [],
-            "IP_BUONI": [],
-            "SATISPAY": [],
-            "UNKNOWN": []
-        }
+        classified = {name: [] for name in SOURCES}
+        classified["UNKNOWN"] = []
 
         for path in file_paths:
-            filename = os.path.basename(path).upper()
-            
-            if "FORTECH" in filename:
-                classified["FORTECH"].append(path)
-            elif "AS400" in filename:
-                classified["AS400"].append(path)
-            elif "NUMIA" in filename:
-                classified["NUMIA"].append(path)
-            elif "IPORTAL" in filename and "BUONI" in filename:
-                classified["IP_BUONI"].append(path)
-            elif "IPORTAL" in filename: # Assuming other IPORTAL is cards
-                classified["IP_CARTE"].append(path)
-            elif "SATISPAY" in filename:
-                classified["SATISPAY"].append(path)
-            else:
-                classified["UNKNOWN"].append(path)
-        
+            result = cls.classify_file(path)
+            classified[result.source].append(path)
+            if details is not None:
+                details[path] = result
+
         return classified
 
     @staticmethod
@@ -44,11 +90,11 @@ class FileClassifier:
         Checks if all required files are present.
         Returns a list of missing types and a boolean valid status.
         """
-        required_types = ["FORTECH", "AS400", "NUMIA", "IP_CARTE", "IP_BUONI", "SATISPAY"]
+        required_types = list(SOURCES)
         missing = []
-        
+
         for r_type in required_types:
             if not classified_files[r_type]:
                 missing.append(r_type)
-        
+
         return missing, len(missing) == 0
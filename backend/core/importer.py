@@ -1,13 +1,214 @@
 import pandas as pd
+import openpyxl
 import re
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from functools import partial
 from datetime import datetime
+from typing import List, Optional
+from core.analyzer import FINESTRA_AS400
 from core.database import Database
 from core.file_classifier import FileClassifier
+from core.parse_cache import ParseCache, file_hash
+from core.sources import SOURCES, FORTECH_INCASSI
+
+
+@dataclass
+class ParsedSheet:
+    """A mapped source sheet, still columnar (this is what the parse cache stores)."""
+    table: str
+    frame: pd.DataFrame
+    codici: Optional[pd.Series] = None  # Raw plant code per row...
+    codice_fisso: Optional[str] = None  # ...or one plant for the whole file
+
+
+@dataclass
+class RowBatch:
+    """A parsed source file, normalized to plain rows and ready for the writer."""
+    tipo: str
+    file_path: str
+    table: str
+    columns: List[str]                  # Without impianto_id (added by the writer)
+    rows: List[tuple]
+    codici: Optional[List] = None       # Raw plant code per row...
+    codice_fisso: Optional[str] = None  # ...or one plant for the whole file
+    secondi_parse: float = 0.0
+
+
+def iter_excel_chunks(file_path, header=0, chunk_size=5000, sheet=0):
+    """
+    Streams a sheet as DataFrames of at most `chunk_size` rows using openpyxl
+    read-only mode, so memory stays bounded whatever the file size.
+    `header` is the 0-based header row, as in pd.read_excel(header=...).
+    """
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[sheet]
+        rows = ws.iter_rows(values_only=True)
+        for _ in range(header):
+            next(rows, None)
+
+        columns = []
+        for idx, name in enumerate(next(rows, None) or ()):
+            name = f"Unnamed: {idx}" if name is None else name
+            # Same de-duplication as pandas: "Col", "Col.1", ...
+            base, n = name, 1
+            while name in columns:
+                name = f"{base}.{n}"
+                n += 1
+            columns.append(name)
+        width = len(columns)
+
+        chunk = []
+        for row in rows:
+            if not any(v is not None for v in row):
+                continue
+            chunk.append(tuple(row[:width]) + (None,) * (width - len(row)))
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame.from_records(chunk, columns=columns)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame.from_records(chunk, columns=columns)
+    finally:
+        wb.close()
+
+
+def _parse_file(tipo, file_path, cache=None, digest=None, header_row=None):
+    """
+    Process-pool entry point: parses one file without touching the DB.
+    With a cache, the mapped sheet is reused when the same content was
+    already parsed by the same parser version (the header row detected
+    by FileClassifier depends on the content only).
+    """
+    start = time.perf_counter()
+    sheet = cache.load(digest, tipo, DataImporter.PARSER_VERSION) if cache else None
+    if sheet is None:
+        sheet = DataImporter.PARSERS[tipo](file_path, header_row)
+        if cache:
+            cache.save(digest, tipo, DataImporter.PARSER_VERSION, sheet)
+    else:
+        # Same content may arrive under another name
+        sheet.frame['file_origine'] = os.path.basename(file_path)
+    batch = DataImporter._to_batch(tipo, file_path, sheet)
+    batch.secondi_parse = time.perf_counter() - start
+    return batch
+
+
+def _esito(parse, *args):
+    """Result of a parse, or the exception it raised."""
+    try:
+        return parse(*args)
+    except Exception as e:
+        return e
+
+
+class ImpiantoResolver:
+    """
+    In-memory codice_pv_fortech → impianti.id map for one import run.
+    The map is preloaded with a single SELECT; unknown codes get the id that
+    AUTOINCREMENT would assign and are created in one batch by flush().
+    """
+
+    def __init__(self):
+        self._ids = None
+        self._pending = {}
+        self._next_id = None
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+
+    def preload(self, conn):
+        self._ids = {str(codice): id_ for codice, id_ in conn.execute(
+            "SELECT codice_pv_fortech, id FROM impianti WHERE codice_pv_fortech IS NOT NULL"
+        )}
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM impianti").fetchone()[0]
+        seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'impianti'").fetchone()
+        self._next_id = max(max_id, seq[0] if seq else 0) + 1
+        self._pending.clear()
+
+    def resolve(self, conn, codice):
+        if self._ids is None:
+            self.preload(conn)
+        impianto_id = self._ids.get(codice)
+        if impianto_id is not None:
+            self.hits += 1
+            return impianto_id
+
+        self.misses += 1
+        impianto_id = self._next_id
+        self._next_id += 1
+        self._ids[codice] = impianto_id
+        self._pending[codice] = impianto_id
+        return impianto_id
+
+    def flush(self, conn):
+        """Creates the plants first seen since the last flush, in one executemany."""
+        if not self._pending:
+            return 0
+        conn.executemany("""
+            INSERT INTO impianti (id, nome_impianto, codice_pv_fortech, tipo_gestione)
+            VALUES (?, ?, ?, 'PRESIDIATO')
+        """, [(id_, f"Impianto {codice}", codice) for codice, id_ in self._pending.items()])
+        created = len(self._pending)
+        self.created += created
+        self._pending.clear()
+        return created
+
+    def discard_pending(self):
+        """Forgets reservations made by a file that was rolled back."""
+        self._pending.clear()
+        # Reload on next resolve: the map must match what the rollback left in the table
+        self._ids = None
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'created': self.created}
+
 
 class DataImporter:
-    def __init__(self, db_instance: Database):
+    # Bump when a parser/mapper changes its output: cached sheets of older versions are ignored
+    PARSER_VERSION = 2
+
+    # Table and day column written by each source: the days of the new rows are
+    # marked for re-analysis (Analyzer.run_analysis(solo_modificati=True))
+    TABELLE_GIORNO = {
+        "FORTECH": ('import_fortech_master', 'data_contabile'),
+        "AS400": ('verifica_contanti_as400', 'data_registrazione'),
+        "NUMIA": ('verifica_numia', 'data_ora_transazione'),
+        "IP_CARTE": ('verifica_ip_portal', 'data_operazione'),
+        "IP_BUONI": ('verifica_ip_portal', 'data_operazione'),
+        "SATISPAY": ('verifica_satispay', 'data_transazione'),
+    }
+
+    def __init__(self, db_instance: Database, bulk=True, workers=1, streaming=False, chunk_size=5000,
+                 cache=True):
+        """
+        bulk=True  -> columnar import: one normalization pass per DataFrame
+                      and a single executemany per file.
+        bulk=False -> legacy per-row import (iterrows + one execute per row).
+        workers    -> bulk mode only: processes used to parse files in parallel
+                      (1 = parse in the calling process).
+        streaming  -> bulk mode only: read single-sheet sources with openpyxl
+                      read-only mode and insert every `chunk_size` rows, so peak
+                      memory does not grow with the file. Disables `workers`.
+        cache      -> bulk mode only: ParseCache reused for files already parsed
+                      (True = db/parse_cache next to the database, None = off).
+                      Streamed files are not cached.
+        """
         self.db = db_instance
+        self.bulk = bulk
+        self.workers = max(1, workers or 1)
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        if cache is True:
+            cache = ParseCache(Path(self.db.root_path) / "db" / "parse_cache")
+        self.cache = cache or None
+        self.import_stats = []
+        # Files of the last import_files that matched no source (not imported)
+        self.sconosciuti = []
+        self.resolver = ImpiantoResolver()
 
     @staticmethod
     def _safe_val(val):
@@ -23,55 +224,310 @@ class DataImporter:
             return val.isoformat()
         return val
 
+    @staticmethod
+    def _chiave(val):
+        """Natural-key value as text, so 148193 and 148193.0 (float column with blanks) match."""
+        if val is None or pd.isna(val):
+            return None
+        return re.sub(r'\.0$', '', str(val).strip())
+
+    @staticmethod
+    def _col(df, name, default=None):
+        """Column `name` of `df`, or a constant Series when the export lacks it."""
+        if name in df.columns:
+            return df[name]
+        return pd.Series(default, index=df.index, dtype=object)
+
+    @staticmethod
+    def _frame_to_rows(frame):
+        """
+        Column-wise equivalent of _safe_val over a whole DataFrame:
+        Timestamp -> ISO text, NaN/NaT -> None. Returns plain tuples for executemany.
+        """
+        out = {}
+        for col in frame.columns:
+            s = frame[col]
+            if pd.api.types.is_datetime64_any_dtype(s):
+                text = s.dt.strftime('%Y-%m-%dT%H:%M:%S')
+                frac = s.dt.microsecond.fillna(0).ne(0)
+                if frac.any():
+                    text = text.where(~frac, s.dt.strftime('%Y-%m-%dT%H:%M:%S.%f'))
+                s = text
+            elif s.dtype == object:
+                s = s.map(lambda v: v.isoformat() if isinstance(v, pd.Timestamp) else v)
+            out[col] = s
+        norm = pd.DataFrame(out, index=frame.index).astype(object)
+        norm = norm.where(norm.notna(), None)
+        return list(norm.itertuples(index=False, name=None))
+
+    @classmethod
+    def _to_batch(cls, tipo, file_path, sheet):
+        """Packs a ParsedSheet into a RowBatch of normalized tuples."""
+        return RowBatch(
+            tipo=tipo,
+            file_path=file_path,
+            table=sheet.table,
+            columns=list(sheet.frame.columns),
+            rows=cls._frame_to_rows(sheet.frame),
+            codici=sheet.codici.tolist() if sheet.codici is not None else None,
+            codice_fisso=sheet.codice_fisso,
+        )
+
+    def _write_batch(self, conn, batch):
+        """
+        Single-writer side of the bulk import: resolves impianto_id once per
+        distinct plant code, drops rows without a plant (as the per-row path
+        does) and writes the file with one executemany.
+        """
+        if batch.codice_fisso is not None:
+            impianto_id = self._ottieni_impianto_id(conn, batch.codice_fisso)
+            rows = [(impianto_id,) + r for r in batch.rows]
+        else:
+            mapping = {c: self._ottieni_impianto_id(conn, c) for c in dict.fromkeys(batch.codici)}
+            rows = [(mapping[c],) + r for c, r in zip(batch.codici, batch.rows)
+                    if mapping[c] is not None]
+
+        if rows:
+            columns = ['impianto_id'] + batch.columns
+            placeholders = ', '.join('?' * len(columns))
+            # Tables with a natural key skip rows already imported from overlapping files
+            verb = "INSERT OR IGNORE" if batch.table in Database.NATURAL_KEYS else "INSERT"
+            conn.executemany(
+                f"{verb} INTO {batch.table} ({', '.join(columns)}) VALUES ({placeholders})", rows
+            )
+        return len(rows)
+
+    def _stream_file(self, conn, f_type, path, header_row=None):
+        """Streaming bulk import of one single-sheet file, chunk by chunk. Returns (read, imported)."""
+        mapper = self.MAPPERS[f_type]
+        lette = importate = 0
+        schema = SOURCES[f_type]
+        header = schema.header_row if header_row is None else header_row
+        for chunk in iter_excel_chunks(path, header=header, chunk_size=self.chunk_size):
+            batch = self._to_batch(f_type, path, mapper(schema.coerce(chunk), path))
+            lette += len(batch.rows)
+            importate += self._write_batch(conn, batch)
+        return lette, importate
+
+    def _start_pool(self, n_jobs=None):
+        """Process pool for parsing, or None when running sequentially (n_jobs None = unknown yet)."""
+        if not self.bulk or self.streaming or self.workers < 2 or (n_jobs is not None and n_jobs < 2):
+            return None
+        try:
+            return ProcessPoolExecutor(max_workers=min(self.workers, n_jobs or self.workers))
+        except (OSError, NotImplementedError) as e:
+            # e.g. serverless runtimes without /dev/shm: parse sequentially
+            print(f"Process pool unavailable ({e}), parsing sequentially.")
+            return None
+
     def import_files(self, file_paths, progress_callback=None):
         """
         Imports a list of files.
         progress_callback: function(current, total, message)
+        Files whose content hash is already in log_importazioni are skipped.
+        The batch is committed once at the end; a file that fails is rolled
+        back to its savepoint and logged, the other files are kept.
+        Bulk files are all parsed before the write lock is taken (streaming and
+        per-row imports read while writing), so other writers wait only for the writes.
+        file_paths may also be an iterator (e.g. core.archive.expand_uploads):
+        each file is classified and sent to the parse pool as soon as it is
+        yielded. Returns the list of files received; those that matched no
+        source are left out of the import and listed in self.sconosciuti.
         """
         conn = self.db.get_connection()
-        classified = FileClassifier.classify_files(file_paths)
-        total_files = len(file_paths)
+        self.db.migrate(conn)
+        self.resolver = ImpiantoResolver()
+        # Early snapshot, only to avoid parsing files already imported: plants and
+        # the import log are read again under the write lock before writing
+        importati = self._load_import_log(conn)
+        streamed = not isinstance(file_paths, (list, tuple))
         processed = 0
+        self.sconosciuti = []
+
+        # Per-row fallback functions (bulk mode goes through PARSERS + _write_batch)
+        import_functions = {
+            "FORTECH": self._import_fortech,
+            "AS400": self._import_as400,
+            "NUMIA": self._import_numia,
+            "IP_CARTE": self._import_ip_carte,
+            "IP_BUONI": self._import_ip_buoni,
+            "SATISPAY": self._import_satispay
+        }
+
+        paths, jobs, hashes, futures, da_parsare = [], [], {}, {}, []
+        # Header row found by FileClassifier: files with a shifted header are read at it
+        intestazioni = {}
+        in_coda = set()   # hashes sent to the parse stage
+        pool = None
+        pool_started = False
 
         try:
-            # Map types to import functions
-            import_functions = {
-                "FORTECH": self._import_fortech,
-                "AS400": self._import_as400,
-                "NUMIA": self._import_numia,
-                "IP_CARTE": self._import_ip_carte,
-                "IP_BUONI": self._import_ip_buoni,
-                "SATISPAY": self._import_satispay
-            }
-
-            for f_type, paths in classified.items():
-                if f_type == "UNKNOWN":
-                    processed += len(paths)
+            # Parse stage: files are submitted as they arrive, results are applied in order
+            for path in file_paths:
+                paths.append(path)
+                if streamed and progress_callback:
+                    progress_callback(0, 0, f"Received {os.path.basename(path)}")
+                classificazione = FileClassifier.classify_file(path)
+                f_type = classificazione.source
+                # UNKNOWN files are skipped and reported in self.sconosciuti
+                if f_type not in import_functions:
+                    self.sconosciuti.append(path)
                     continue
-                
-                if f_type in import_functions:
-                    func = import_functions[f_type]
-                    for path in paths:
-                        if progress_callback:
-                            progress_callback(processed, total_files, f"Importing {f_type}: {os.path.basename(path)}")
-                        
-                        try:
-                            # Pass 'conn' to keep transaction open or manage inside? 
-                            # Used passed conn for batch commit capability if needed, or simple commit per file.
-                            # The original functions committed internally.
-                            func(conn, path)
-                        except Exception as e:
-                            print(f"Error importing {path}: {e}")
-                            if progress_callback:
-                                progress_callback(processed, total_files, f"Error: {e}")
-                        
+                # Hash before parsing so re-uploaded files never reach the parsers
+                hashes[path] = file_hash(path)
+                intestazioni[path] = classificazione.header_row
+                jobs.append((f_type, path))
+                # Already imported, or the same content earlier in this upload
+                if hashes[path] in importati or hashes[path] in in_coda:
+                    continue
+                in_coda.add(hashes[path])
+                if not pool_started:
+                    pool = self._start_pool(None if streamed else len(file_paths))
+                    pool_started = True
+                if pool:
+                    futures[path] = pool.submit(_parse_file, f_type, path, self.cache, hashes[path],
+                                                intestazioni[path])
+                elif self.bulk and not (self.streaming and f_type in self.MAPPERS):
+                    da_parsare.append((f_type, path))
+
+            # Parse results (or errors, raised again by their file in the write stage)
+            parsed = {path: _esito(future.result) for path, future in futures.items()}
+            for f_type, path in da_parsare:
+                parsed[path] = _esito(_parse_file, f_type, path, self.cache, hashes[path], intestazioni[path])
+
+            # Write stage in source order (FORTECH first), arrival order within a source
+            ordine = {name: i for i, name in enumerate(import_functions)}
+            jobs.sort(key=lambda job: ordine[job[0]])
+            total_files = len(paths)
+
+            # The whole batch is one transaction with a savepoint per file:
+            # a bad file rolls back alone, an interrupted batch leaves nothing behind
+            with self.db.bulk_load(conn):
+                conn.isolation_level = None   # explicit BEGIN / SAVEPOINT / COMMIT
+                # IMMEDIATE: the write lock is taken now (waiting on the busy timeout),
+                # so a writer committing meanwhile cannot invalidate the batch snapshot
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self.resolver.preload(conn)
+                    importati = self._load_import_log(conn)
+                    for f_type, path in jobs:
+                        self._import_job(conn, f_type, path, hashes[path], importati, parsed,
+                                         import_functions, processed, total_files, progress_callback,
+                                         intestazioni[path])
                         processed += 1
-            
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+
             if progress_callback:
                 progress_callback(total_files, total_files, "Import complete.")
+            return paths
 
         finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
             conn.close()
+            if self.cache:
+                self.cache.evict()
+
+    def _import_job(self, conn, f_type, path, hash_file, importati, parsed, import_functions,
+                    processed, total_files, progress_callback, header_row=None):
+        """Imports one file inside the batch transaction, under its own savepoint."""
+        nome = os.path.basename(path)
+        if hash_file in importati:
+            self._record_stats(f_type, path, 0, 0.0, modalita='duplicato')
+            if progress_callback:
+                progress_callback(processed, total_files, f"Skipped {f_type}: {nome} (already imported)")
+            return
+
+        if progress_callback:
+            progress_callback(processed, total_files, f"Importing {f_type}: {nome}")
+
+        start = time.perf_counter()
+        modifiche = conn.total_changes
+        tabella, colonna_giorno = self.TABELLE_GIORNO[f_type]
+        ultimo_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {tabella}").fetchone()[0]
+        conn.execute("SAVEPOINT import_file")
+        try:
+            if not self.bulk:
+                righe = import_functions[f_type](conn, path, header_row)
+                lette = righe
+                secondi = time.perf_counter() - start
+            elif self.streaming and f_type in self.MAPPERS:
+                lette, righe = self._stream_file(conn, f_type, path, header_row)
+                secondi = time.perf_counter() - start
+            else:
+                batch = parsed.get(path)
+                if batch is None:   # same content as a file of this batch that failed
+                    batch = _parse_file(f_type, path, self.cache, hash_file, header_row)
+                if isinstance(batch, Exception):
+                    raise batch
+                start = time.perf_counter()
+                righe = self._write_batch(conn, batch)
+                lette = len(batch.rows)
+                secondi = batch.secondi_parse + time.perf_counter() - start
+            # Rows ignored by a natural-key conflict are duplicates of earlier files
+            nuove = conn.total_changes - modifiche
+            # A deposit can match the Fortech days within the AS400 window around it
+            scarti = range(-FINESTRA_AS400, FINESTRA_AS400 + 1) if f_type == "AS400" else (0,)
+            self.db.mark_dirty_days(conn, tabella, colonna_giorno, ultimo_id, scarti)
+            duplicate = righe - nuove
+            # Log row and data are released together
+            self._log_import(conn, f_type, path, hash_file, lette, nuove, secondi, duplicate=duplicate)
+            self._commit_file(conn)
+        except Exception as e:
+            print(f"Error importing {path}: {e}")
+            # Drop the partial file, including plants reserved for it
+            conn.execute("ROLLBACK TO import_file")
+            conn.execute("RELEASE import_file")
+            self.resolver.discard_pending()
+            # Failed imports are logged but not marked as seen, so they can be retried
+            self._log_import(conn, f_type, path, hash_file, None, 0,
+                             time.perf_counter() - start, errori=str(e))
+            if progress_callback:
+                progress_callback(processed, total_files, f"Error: {e}")
+            return
+
+        importati.add(hash_file)
+        self._record_stats(f_type, path, nuove, secondi, duplicate=duplicate)
+        if duplicate and progress_callback:
+            progress_callback(processed, total_files,
+                              f"{nome}: {nuove} new rows, {duplicate} duplicates skipped")
+
+    def _record_stats(self, f_type, path, righe, secondi, modalita=None, duplicate=0):
+        """Keeps per-file throughput so bulk and per-row modes can be compared."""
+        self.import_stats.append({
+            'file': os.path.basename(path),
+            'tipo': f_type,
+            'modalita': modalita or ('bulk' if self.bulk else 'row'),
+            'righe': righe,
+            'duplicate': duplicate,
+            'secondi': round(secondi, 4),
+            'righe_sec': round(righe / secondi, 1) if secondi > 0 else None,
+        })
+
+    # --- Import log (log_importazioni) ---
+
+    def _load_import_log(self, conn):
+        """Hashes of the files already imported successfully (set -> O(1) lookup)."""
+        rows = conn.execute(
+            "SELECT hash_file FROM log_importazioni WHERE hash_file IS NOT NULL AND errori IS NULL"
+        )
+        return {h for (h,) in rows}
+
+    def _log_import(self, conn, f_type, path, hash_file, lette, importate, secondi, duplicate=0, errori=None):
+        conn.execute("""
+            INSERT INTO log_importazioni (
+                nome_file, percorso_file, tipo_file, hash_file, dimensione_byte,
+                righe_lette, righe_importate, righe_duplicate, righe_errore, durata_secondi, errori
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            os.path.basename(path), path, f_type, hash_file, os.path.getsize(path),
+            lette, importate, duplicate,
+            (lette - importate - duplicate) if lette is not None else None,
+            round(secondi, 4), errori
+        ))
 
     # --- Helper Methods from original script ---
     
@@ -85,84 +541,95 @@ class DataImporter:
         codice = self._estrai_codice_pv(codice_pv)
         if not codice:
             return None
-        
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM impianti WHERE codice_pv_fortech = ?", (codice,))
-        result = cur.fetchone()
-        
-        if result:
-            return result[0]
-        else:
-            cur.execute("""
-                INSERT INTO impianti (nome_impianto, codice_pv_fortech, tipo_gestione)
-                VALUES (?, ?, 'PRESIDIATO')
-            """, (f"Impianto {codice}", codice))
-            conn.commit()
-            return cur.lastrowid
+        # Unknown codes are created in batch by _commit_file() at the end of the file
+        return self.resolver.resolve(conn, codice)
+
+    def _commit_file(self, conn):
+        """End of file: create the plants it introduced, then release its savepoint."""
+        self.resolver.flush(conn)
+        conn.execute("RELEASE import_file")
 
     # --- Import Functions (Adapted) ---
 
-    def _import_fortech(self, conn, file_path):
+    @staticmethod
+    def _read_fortech(file_path, header_row=None):
+        """Returns (df_vendite, df_incassi) from a Fortech master file (header_row: of the first sheet)."""
         # ── Read both sheets from the Fortech Excel ──
         xls = pd.ExcelFile(file_path)
-        sheet_names = [s.lower() for s in xls.sheet_names]
         
         # Sheet "Vendite" (or first sheet) = corrispettivi, volumi, fatture
-        df_vendite = pd.read_excel(xls, sheet_name=0)
+        df_vendite = SOURCES['FORTECH'].read(xls, sheet_name=0, header_row=header_row)
         df_vendite = df_vendite.where(pd.notna(df_vendite), None)
         
         # Sheet "Incassi" = suddivisione per metodo di pagamento
         df_incassi = None
-        incassi_map = {}  # key: (codice_pv, data_contabile) → incassi row
         
         if len(xls.sheet_names) > 1:
             for idx, sn in enumerate(xls.sheet_names):
                 if sn.lower() in ('incassi', 'incasso', 'pagamenti'):
-                    df_incassi = pd.read_excel(xls, sheet_name=idx)
+                    df_incassi = FORTECH_INCASSI.read(xls, sheet_name=idx)
                     df_incassi = df_incassi.where(pd.notna(df_incassi), None)
                     break
             if df_incassi is None:
                 # Fallback: try second sheet
-                df_incassi = pd.read_excel(xls, sheet_name=1)
+                df_incassi = FORTECH_INCASSI.read(xls, sheet_name=1)
                 df_incassi = df_incassi.where(pd.notna(df_incassi), None)
-        
-        # Build lookup map from Incassi sheet
-        if df_incassi is not None:
-            for _, row in df_incassi.iterrows():
-                key = (str(row.get('CodicePV', '')), str(row.get('DataContabile', '')))
-                
-                # Carte bancarie = somma di tutti i pagamenti elettronici bancari
-                carte_bancarie = sum(filter(None, [
-                    row.get('CARTA CREDITO GENERICA', 0) or 0,
-                    row.get('PAGOBANCOMAT', 0) or 0,
-                    row.get('AMEX', 0) or 0,
-                    row.get('BANCOMAT GESTORE', 0) or 0,
-                    row.get('CARTA CREDITO GESTORE', 0) or 0,
-                ]))
-                
-                # Carte petrolifere = somma di tutti i network petroliferi
-                carte_petrolifere = sum(filter(None, [
-                    row.get('CARTAPETROLIFERA', 0) or 0,
-                    row.get('DKV', 0) or 0,
-                    row.get('UTA', 0) or 0,
-                    row.get('CARTAMAXIMA', 0) or 0,
-                ]))
-                
-                incassi_map[key] = {
-                    'contanti': row.get('CONTANTI', 0) or 0,
-                    'carte_bancarie': carte_bancarie,
-                    'carte_petrolifere': carte_petrolifere,
-                    'satispay': row.get('PAGAMENTIINNOVATIVI', 0) or 0,
-                    'credito_finemese': row.get('CLIENTI CON FATTURA FINE MESE', 0) or 0,
-                    'buoni': row.get('BUONI', 0) or 0,
-                }
+        return df_vendite, df_incassi
+
+    # Incassi columns summed into each teorico
+    INCASSI_COLONNE = {
+        'contanti': ['CONTANTI'],
+        # Carte bancarie = somma di tutti i pagamenti elettronici bancari
+        'carte_bancarie': ['CARTA CREDITO GENERICA', 'PAGOBANCOMAT', 'AMEX',
+                           'BANCOMAT GESTORE', 'CARTA CREDITO GESTORE'],
+        # Carte petrolifere = somma di tutti i network petroliferi
+        'carte_petrolifere': ['CARTAPETROLIFERA', 'DKV', 'UTA', 'CARTAMAXIMA'],
+        'satispay': ['PAGAMENTIINNOVATIVI'],
+        'credito_finemese': ['CLIENTI CON FATTURA FINE MESE'],
+        'buoni': ['BUONI'],
+    }
+
+    @classmethod
+    def _fortech_keys(cls, df):
+        """
+        Join key (codice_pv, data) of a Fortech sheet. Dates are normalized to
+        YYYY-MM-DD so Timestamp, ISO and dd/mm/yyyy values of the same day match.
+        """
+        pv = cls._col(df, 'CodicePV').map(cls._chiave)
+        raw = cls._col(df, 'DataContabile')
+        date = pd.to_datetime(raw, errors='coerce', format='mixed', dayfirst=True)
+        # Unparseable dates keep their text, so they only match themselves
+        testo = raw.map(lambda v: None if v is None or pd.isna(v) else str(v))
+        return pv, date.dt.strftime('%Y-%m-%d').where(date.notna(), testo)
+
+    @classmethod
+    def _aggregate_incassi(cls, df_incassi):
+        """
+        Incassi teorici per metodo di pagamento, one row per (_pv, _data).
+        Rows repeated for the same plant and day are summed.
+        """
+        columns = ['_pv', '_data'] + list(cls.INCASSI_COLONNE)
+        if df_incassi is None:
+            return pd.DataFrame(columns=columns)
+
+        pv, data = cls._fortech_keys(df_incassi)
+        agg = pd.DataFrame({'_pv': pv, '_data': data}, index=df_incassi.index)
+        for nome, sorgenti in cls.INCASSI_COLONNE.items():
+            agg[nome] = sum(pd.to_numeric(cls._col(df_incassi, c, 0), errors='coerce').fillna(0)
+                            for c in sorgenti)
+        agg = agg[agg['_pv'].notna() & agg['_data'].notna()]
+        return agg.groupby(['_pv', '_data'], as_index=False, sort=False).sum()[columns]
+
+    def _import_fortech(self, conn, file_path, header_row=None):
+        df_vendite, df_incassi = self._read_fortech(file_path, header_row)
+        incassi_map = self._aggregate_incassi(df_incassi).set_index(['_pv', '_data']).to_dict('index')
+        chiavi_pv, chiavi_data = self._fortech_keys(df_vendite)
         
         # ── Import rows ──
         righe_importate = 0
         cur = conn.cursor()
         
-        for _, row in df_vendite.iterrows():
-            codice_pv = str(row.get('CodicePV', ''))
+        for (_, row), codice_pv, data_contabile in zip(df_vendite.iterrows(), chiavi_pv, chiavi_data):
             impianto_id = self._ottieni_impianto_id(conn, codice_pv)
             if not impianto_id: continue
                 
@@ -173,9 +640,7 @@ class DataImporter:
             buoni_tot = row.get('Buoni Totale', 0) or 0
             
             # Valori teorici dal foglio Incassi (se disponibile)
-            data_contabile = str(row.get('DataContabile', ''))
-            key = (codice_pv, data_contabile)
-            inc = incassi_map.get(key, {})
+            inc = incassi_map.get((codice_pv, data_contabile), {})
             
             incasso_contanti = inc.get('contanti', 0)
             incasso_carte_bancarie = inc.get('carte_bancarie', 0)
@@ -215,10 +680,10 @@ class DataImporter:
                 os.path.basename(file_path)
             ))
             righe_importate += 1
-        conn.commit()
+        return righe_importate
 
-    def _import_as400(self, conn, file_path):
-        df = pd.read_excel(file_path)
+    def _import_as400(self, conn, file_path, header_row=None):
+        df = SOURCES['AS400'].read(file_path, header_row=header_row)
         df = df.where(pd.notna(df), None)
         righe_importate = 0
         # Default to Milano Repubblica (43809) if not specified, matching original script behavior
@@ -234,7 +699,7 @@ class DataImporter:
                 continue
             
             cur.execute("""
-                INSERT INTO verifica_contanti_as400 (
+                INSERT OR IGNORE INTO verifica_contanti_as400 (
                     impianto_id, data_registrazione, data_documento, data_scadenza,
                     tipo_documento, numero_documento, tipo_registrazione, numero_registrazione,
                     importo_versato, segno, descrizione, centro_costo, stato, partita,
@@ -248,7 +713,7 @@ class DataImporter:
                 self._safe_val(row.get('Documento//Tipo')),
                 self._safe_val(row.get('Documento//Numero')),
                 self._safe_val(row.get('Registrazione//Tipo')),
-                self._safe_val(row.get('Registrazione//Numero')),
+                self._chiave(row.get('Registrazione//Numero')),
                 importo,
                 self._safe_val(row.get('Segno')),
                 self._safe_val(row.get('Descrizione')),
@@ -258,11 +723,10 @@ class DataImporter:
                 os.path.basename(file_path)
             ))
             righe_importate += 1
-        conn.commit()
+        return righe_importate
 
-    def _import_numia(self, conn, file_path):
-        # Numia file: row 0 = empty, row 1 = title text, row 2 = actual headers
-        df = pd.read_excel(file_path, header=2)
+    def _import_numia(self, conn, file_path, header_row=None):
+        df = SOURCES['NUMIA'].read(file_path, header_row=header_row)
         df = df.where(pd.notna(df), None)
         righe_importate = 0
         impianto_id = self._ottieni_impianto_id(conn, "43809")
@@ -273,7 +737,7 @@ class DataImporter:
             if pd.isna(importo): continue
 
             cur.execute("""
-                INSERT INTO verifica_numia (
+                INSERT OR IGNORE INTO verifica_numia (
                     impianto_id, data_ora_transazione, importo,
                     codice_autorizzazione, numero_carta, circuito,
                     tipo_transazione, stato_operazione, punto_vendita,
@@ -294,22 +758,23 @@ class DataImporter:
                 self._safe_val(row.get('MID')),
                 self._safe_val(row.get('ID Terminale / TML')),
                 self._safe_val(row.get('Alias Terminale')),
-                self._safe_val(row.get('ID Transazione')),
+                self._chiave(row.get('ID Transazione')),
                 os.path.basename(file_path)
             ))
             righe_importate += 1
-        conn.commit()
+        return righe_importate
 
-    def _import_ip_carte(self, conn, file_path):
-        df = pd.read_excel(file_path, header=1)
+    def _import_ip_carte(self, conn, file_path, header_row=None):
+        df = SOURCES['IP_CARTE'].read(file_path, header_row=header_row)
         df = df.where(pd.notna(df), None)
+        righe_importate = 0
         
         cur = conn.cursor()
         for _, row in df.iterrows():
             pv = row.get('PV')
             if pd.isna(pv): continue
             
-            pv_code = str(pv).strip()
+            pv_code = re.sub(r'\.0$', '', str(pv).strip())
 
             impianto_id = self._ottieni_impianto_id(conn, pv_code)
             if not impianto_id: continue
@@ -331,11 +796,13 @@ class DataImporter:
                 self._safe_val(quantita), self._safe_val(row.get('Prezzo')), self._safe_val(row.get('Importo')), self._safe_val(row.get('Segno')),
                 self._safe_val(row.get('Numero Fattura')), self._safe_val(row.get('Data Fattura')), os.path.basename(file_path)
             ))
-        conn.commit()
+            righe_importate += 1
+        return righe_importate
 
-    def _import_ip_buoni(self, conn, file_path):
-        df = pd.read_excel(file_path, header=1)
+    def _import_ip_buoni(self, conn, file_path, header_row=None):
+        df = SOURCES['IP_BUONI'].read(file_path, header_row=header_row)
         df = df.where(pd.notna(df), None)
+        righe_importate = 0
         
         cur = conn.cursor()
         for _, row in df.iterrows():
@@ -361,11 +828,13 @@ class DataImporter:
                 self._safe_val(row.get('Serial number')), self._safe_val(row.get('Terminale')), self._safe_val(row.get('Auth code')),
                 self._safe_val(row.get('Flusso')), os.path.basename(file_path)
             ))
-        conn.commit()
+            righe_importate += 1
+        return righe_importate
 
-    def _import_satispay(self, conn, file_path):
-        df = pd.read_excel(file_path)
+    def _import_satispay(self, conn, file_path, header_row=None):
+        df = SOURCES['SATISPAY'].read(file_path, header_row=header_row)
         df = df.where(pd.notna(df), None)
+        righe_importate = 0
         cur = conn.cursor()
         
         for _, row in df.iterrows():
@@ -380,16 +849,225 @@ class DataImporter:
             commissioni = row.get('totale commissioni', 0) or 0
 
             cur.execute("""
-                INSERT INTO verifica_satispay (
+                INSERT OR IGNORE INTO verifica_satispay (
                     impianto_id, id_transazione, data_transazione,
                     negozio, codice_negozio, importo_totale, totale_commissioni,
                     importo_netto, tipo_transazione, codice_transazione, id_gruppo,
                     file_origine
                 ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
-                impianto_id, self._safe_val(row.get('id transazione')), self._safe_val(row.get('data transazione')),
+                impianto_id, self._chiave(row.get('id transazione')), self._safe_val(row.get('data transazione')),
                 self._safe_val(row.get('negozio')), self._safe_val(codice_negozio), importo_totale, commissioni,
                 importo_totale - commissioni, self._safe_val(row.get('tipo transazione')),
                 self._safe_val(row.get('codice transazione')), self._safe_val(row.get('id gruppo')), os.path.basename(file_path)
             ))
-        conn.commit()
+            righe_importate += 1
+        return righe_importate
+
+    # --- Bulk (columnar) Parsers ---
+    # Same column mapping as the per-row functions above, but each file is
+    # normalized column-wise in one pass into a ParsedSheet. Parsers never touch
+    # the DB, so they can run in worker processes; _write_batch applies them.
+    # Single-sheet sources are split in _map_* (DataFrame -> ParsedSheet) so the
+    # same mapping serves whole-file reads and streamed chunks.
+
+    @classmethod
+    def _parse_sheet(cls, f_type, file_path, header_row=None):
+        return cls.MAPPERS[f_type](SOURCES[f_type].read(file_path, header_row=header_row), file_path)
+
+    @classmethod
+    def _parse_fortech(cls, file_path, header_row=None):
+        df_vendite, df_incassi = cls._read_fortech(file_path, header_row)
+        col = lambda name, default=None: cls._col(df_vendite, name, default)
+        codice_pv, data_key = cls._fortech_keys(df_vendite)
+
+        # Join teorici from the Incassi sheet on (codice_pv, data_contabile)
+        keys = pd.DataFrame({'_pv': codice_pv.values, '_data': data_key.values})
+        inc = keys.merge(cls._aggregate_incassi(df_incassi), how='left', on=['_pv', '_data'], indicator=True)
+        inc.index = df_vendite.index
+        has_inc = inc['_merge'] == 'both'
+
+        corrispettivo_totale = pd.to_numeric(col('Corrispettivo Totale', 0), errors='coerce').fillna(0)
+        fatture_post = pd.to_numeric(col('Fatture Postpagate Totale', 0), errors='coerce').fillna(0)
+        fatture_pre = pd.to_numeric(col('Fatture Prepagate Totale', 0), errors='coerce').fillna(0)
+        buoni_tot = pd.to_numeric(col('Buoni Totale', 0), errors='coerce').fillna(0)
+
+        # Se il foglio Incassi non è disponibile, fallback al calcolo
+        contanti = inc['contanti'].where(has_inc, 0)
+        fallback = ~has_inc & (corrispettivo_totale > 0)
+        contanti = contanti.where(~fallback, corrispettivo_totale - fatture_post - fatture_pre - buoni_tot)
+
+        frame = pd.DataFrame({
+            'codice_pv': codice_pv,
+            'data_contabile': col('DataContabile'),
+            'data_inizio': col('DataInizio'),
+            'data_fine': col('DataFine'),
+            'stato_giornata': col('StatoGiornata'),
+            'corrispettivo_totale': corrispettivo_totale,
+            'corrispettivo_verde': col('CorrispettivoVerde', 0),
+            'corrispettivo_diesel': col('CorrispettivoDiesel', 0),
+            'volume_verde_prepay': col('VolumeVerdePrepay', 0),
+            'importo_verde_prepay': col('ImportoVerdePrepay', 0),
+            'prezzo_verde_prepay': col('PrezzoVerdePrepay', 0),
+            'volume_diesel_prepay': col('VolumeDieselPrepay', 0),
+            'importo_diesel_prepay': col('ImportoDieselPrepay', 0),
+            'prezzo_diesel_prepay': col('PrezzoDieselPrepay', 0),
+            'fatture_postpagate_totale': fatture_post,
+            'fatture_prepagate_totale': fatture_pre,
+            'fatture_immediate_totale': col('Fatture Immediate Totale', 0),
+            'fatture_differite_totale': col('Fatture Differite Totale', 0),
+            'buoni_totale': buoni_tot,
+            'incasso_carte_bancarie_teorico': inc['carte_bancarie'].where(has_inc, 0),
+            'incasso_carte_petrolifere_teorico': inc['carte_petrolifere'].where(has_inc, None),
+            'incasso_satispay_teorico': inc['satispay'].where(has_inc, 0),
+            'incasso_credito_finemese_teorico': inc['credito_finemese'].where(has_inc, 0),
+            'incasso_contanti_teorico': contanti,
+            'file_origine': os.path.basename(file_path),
+        }, index=df_vendite.index)
+
+        return ParsedSheet('import_fortech_master', frame, codici=codice_pv)
+
+    @classmethod
+    def _map_as400(cls, df, file_path):
+        # Skip empty rows or detail lines (which have no Registration Date)
+        df = df[cls._col(df, 'Importo').notna() & cls._col(df, 'Registrazione//Data').notna()]
+        col = lambda name: cls._col(df, name)
+
+        frame = pd.DataFrame({
+            'data_registrazione': col('Registrazione//Data'),
+            'data_documento': col('Documento//Data'),
+            'data_scadenza': col('Scadenza'),
+            'tipo_documento': col('Documento//Tipo'),
+            'numero_documento': col('Documento//Numero'),
+            'tipo_registrazione': col('Registrazione//Tipo'),
+            'numero_registrazione': col('Registrazione//Numero').map(cls._chiave),
+            'importo_versato': col('Importo'),
+            'segno': col('Segno'),
+            'descrizione': col('Descrizione'),
+            'centro_costo': col('Centro di Costo'),
+            'stato': col('Stato'),
+            'partita': col('Partita'),
+            'file_origine': os.path.basename(file_path),
+        }, index=df.index)
+
+        # Default to Milano Repubblica (43809), as the per-row path does
+        return ParsedSheet('verifica_contanti_as400', frame, codice_fisso="43809")
+
+    @classmethod
+    def _map_numia(cls, df, file_path):
+        df = df[cls._col(df, 'Importo').notna()]
+        col = lambda name: cls._col(df, name)
+
+        frame = pd.DataFrame({
+            'data_ora_transazione': col('Data e ora'),
+            'importo': col('Importo'),
+            'codice_autorizzazione': col('Codice autorizzazione'),
+            'numero_carta': col('Numero carta'),
+            'circuito': col('Circuito'),
+            'tipo_transazione': col('Tipo transazione'),
+            'stato_operazione': col('Stato operazione'),
+            'punto_vendita': col('Punto vendita'),
+            'id_punto_vendita': col('ID Punto vendita'),
+            'mid': col('MID'),
+            'id_terminale': col('ID Terminale / TML'),
+            'alias_terminale': col('Alias Terminale'),
+            'id_transazione_numia': col('ID Transazione').map(cls._chiave),
+            'file_origine': os.path.basename(file_path),
+        }, index=df.index)
+
+        return ParsedSheet('verifica_numia', frame, codice_fisso="43809")
+
+    @classmethod
+    def _map_ip_carte(cls, df, file_path):
+        df = df[cls._col(df, 'PV').notna()]
+        col = lambda name: cls._col(df, name)
+
+        # "43809.0" when blanks make pandas read the column as float
+        pv_code = col('PV').astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+        quantita = col('Quantità') if 'Quantità' in df.columns else col('QuantitÓ')
+
+        frame = pd.DataFrame({
+            'tipo_transazione': 'CARTA_PETROLIFERA',
+            'codice_gestore': col('Gestore'),
+            'codice_pv': pv_code,
+            'data_operazione': col('Data\noperazione'),
+            'ora_operazione': col('Ora\noperazione'),
+            'circuito': col('Circuito'),
+            'codice_prodotto': col('Cod. Prod.'),
+            'prodotto': col('Prodotto'),
+            'riferimento_scontrino': col('Riferimento\nScontrino'),
+            'quantita': quantita,
+            'prezzo': col('Prezzo'),
+            'importo': col('Importo'),
+            'segno': col('Segno'),
+            'numero_fattura': col('Numero Fattura'),
+            'data_fattura': col('Data Fattura'),
+            'file_origine': os.path.basename(file_path),
+        }, index=df.index)
+
+        return ParsedSheet('verifica_ip_portal', frame, codici=pv_code)
+
+    @classmethod
+    def _map_ip_buoni(cls, df, file_path):
+        df = df[cls._col(df, 'Esercente').notna()]
+        col = lambda name: cls._col(df, name)
+
+        frame = pd.DataFrame({
+            'tipo_transazione': 'BUONO',
+            'codice_gestore': col('Gestore'),
+            'codice_esercente': col('Esercente'),
+            'descrizione_esercente': col('Descrizione esercente'),
+            'codice_pv': col('Punto vendita'),
+            'data_operazione': col('Data operazione'),
+            'ora_operazione': col('Ora operazione'),
+            'prodotto': col('Prodotto'),
+            'quantita': col('Quantita'),
+            'prezzo': col('Prezzo unit.'),
+            'importo': col('Importo'),
+            'pan': col('Pan'),
+            'serial_number': col('Serial number'),
+            'terminale': col('Terminale'),
+            'auth_code': col('Auth code'),
+            'flusso': col('Flusso'),
+            'file_origine': os.path.basename(file_path),
+        }, index=df.index)
+
+        return ParsedSheet('verifica_ip_portal', frame, codici=col('Esercente'))
+
+    @classmethod
+    def _map_satispay(cls, df, file_path):
+        df = df[cls._col(df, 'codice negozio').notna()]
+        col = lambda name: cls._col(df, name)
+
+        importo_totale = pd.to_numeric(cls._col(df, 'importo totale', 0), errors='coerce').fillna(0)
+        commissioni = pd.to_numeric(cls._col(df, 'totale commissioni', 0), errors='coerce').fillna(0)
+
+        frame = pd.DataFrame({
+            'id_transazione': col('id transazione').map(cls._chiave),
+            'data_transazione': col('data transazione'),
+            'negozio': col('negozio'),
+            'codice_negozio': col('codice negozio'),
+            'importo_totale': importo_totale,
+            'totale_commissioni': commissioni,
+            'importo_netto': importo_totale - commissioni,
+            'tipo_transazione': col('tipo transazione'),
+            'codice_transazione': col('codice transazione'),
+            'id_gruppo': col('id gruppo'),
+            'file_origine': os.path.basename(file_path),
+        }, index=df.index)
+
+        return ParsedSheet('verifica_satispay', frame, codici=col('codice negozio'))
+
+
+DataImporter.MAPPERS = {
+    "AS400": DataImporter._map_as400,
+    "NUMIA": DataImporter._map_numia,
+    "IP_CARTE": DataImporter._map_ip_carte,
+    "IP_BUONI": DataImporter._map_ip_buoni,
+    "SATISPAY": DataImporter._map_satispay,
+}
+
+DataImporter.PARSERS = {
+    "FORTECH": DataImporter._parse_fortech,
+    **{f_type: partial(DataImporter._parse_sheet, f_type) for f_type in DataImporter.MAPPERS},
+}
@@ -0,0 +1,325 @@
+"""
+Coda dei job di importazione + analisi.
+
+/api/upload salva i file in una cartella del job e restituisce subito l'id;
+un pool limitato di thread esegue i job in background. Stato, fase,
+avanzamento, throughput e log sono salvati in un SQLite separato
+(db/calor_jobs.db): gli aggiornamenti di stato non aspettano la lunga
+transazione di import sul DB principale e sono leggibili da qualsiasi
+worker gunicorn. I job in coda o interrotti da un riavvio vengono ripresi
+(l'import è idempotente grazie alla deduplica per hash).
+"""
+
+import json
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from core.analyzer import Analyzer
+from core.archive import expand_uploads
+from core.database import Database
+from core.importer import DataImporter
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_elaborazione (
+    id VARCHAR(32) PRIMARY KEY,
+    stato VARCHAR(20) NOT NULL,         -- in_coda / in_corso / completato / errore
+    fase VARCHAR(50),
+    progresso REAL DEFAULT 0,           -- 0..1
+    messaggio TEXT,
+    file_json TEXT NOT NULL,            -- percorsi dei file caricati
+    cartella TEXT,                      -- rimossa a fine job
+    righe INTEGER DEFAULT 0,
+    righe_sec REAL,
+    log_json TEXT DEFAULT '[]',
+    log_scartati INTEGER DEFAULT 0,     -- righe di log eliminate in testa (MAX_LOG)
+    risultato_json TEXT,
+    errori TEXT,
+    data_creazione TIMESTAMP,
+    data_inizio TIMESTAMP,
+    data_aggiornamento TIMESTAMP,
+    data_fine TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_job_stato ON job_elaborazione(stato, data_creazione);
+"""
+
+IN_CODA, IN_CORSO, COMPLETATO, ERRORE = 'in_coda', 'in_corso', 'completato', 'errore'
+MAX_LOG = 500
+
+
+def _adesso():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+class JobQueue:
+    # Seconds between two progress writes of the same job (phase changes are always written)
+    INTERVALLO_STATO = 0.5
+    # A running job not updated for this long belonged to a dead process: it is queued again
+    JOB_ORFANO = timedelta(minutes=15)
+    # Seconds between two heartbeats of a running job: a single long step (a large file,
+    # one analysis shard) reports no progress but the job must not look orphaned
+    INTERVALLO_HEARTBEAT = 60.0
+
+    def __init__(self, db: Database, jobs_dir=None, workers=1, importer_kwargs=None, poll_seconds=2.0):
+        """
+        jobs_dir        -> calor_jobs.db e cartelle dei file caricati (default: db/jobs accanto al DB)
+        workers         -> thread che eseguono job in parallelo (l'import resta serializzato da SQLite)
+        importer_kwargs -> argomenti per DataImporter (workers, streaming, cache); workers vale anche per l'Analyzer
+        """
+        self.db = db
+        self.jobs_dir = Path(jobs_dir) if jobs_dir else Path(db.root_path) / "db" / "jobs"
+        self.db_path = self.jobs_dir / "calor_jobs.db"
+        self.workers = max(1, workers or 1)
+        self.importer_kwargs = importer_kwargs or {}
+        self.poll_seconds = poll_seconds
+        self._threads = []
+        self._sveglia = threading.Event()
+        self._stop = threading.Event()
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        conn = self._connetti()
+        try:
+            conn.executescript(SCHEMA)
+            # calor_jobs.db created before log_scartati
+            if 'log_scartati' not in {row[1] for row in conn.execute("PRAGMA table_info(job_elaborazione)")}:
+                conn.execute("ALTER TABLE job_elaborazione ADD COLUMN log_scartati INTEGER DEFAULT 0")
+                conn.commit()
+        finally:
+            conn.close()
+
+    def _connetti(self):
+        conn = sqlite3.connect(self.db_path, timeout=30.0)
+        conn.execute('PRAGMA journal_mode=WAL;')
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # --- Client side ---
+
+    def nuova_cartella(self):
+        """Cartella dove salvare i file di un nuovo job."""
+        return tempfile.mkdtemp(prefix="upload_", dir=self.jobs_dir)
+
+    def submit(self, file_paths, cartella=None):
+        """Accoda un job e restituisce il suo id."""
+        job_id = uuid.uuid4().hex
+        conn = self._connetti()
+        try:
+            conn.execute("""
+                INSERT INTO job_elaborazione (id, stato, fase, file_json, cartella, data_creazione, data_aggiornamento)
+                VALUES (?, ?, 'In coda', ?, ?, ?, ?)
+            """, (job_id, IN_CODA, json.dumps([str(p) for p in file_paths]),
+                  str(cartella) if cartella else None, _adesso(), _adesso()))
+            conn.commit()
+        finally:
+            conn.close()
+        self._sveglia.set()
+        return job_id
+
+    def stato(self, job_id):
+        """Stato del job come dict (None se non esiste)."""
+        conn = self._connetti()
+        try:
+            row = conn.execute("SELECT * FROM job_elaborazione WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return {
+            'id': row['id'],
+            'stato': row['stato'],
+            'fase': row['fase'],
+            'progresso': round(row['progresso'] or 0, 3),
+            'messaggio': row['messaggio'],
+            'righe': row['righe'],
+            'righe_sec': row['righe_sec'],
+            'logs': json.loads(row['log_json'] or '[]'),
+            # Position of logs[0] in the whole job log: lines are trimmed from the front
+            'log_inizio': row['log_scartati'] or 0,
+            'risultato': json.loads(row['risultato_json']) if row['risultato_json'] else None,
+            'errori': row['errori'],
+            'data_creazione': row['data_creazione'],
+            'data_inizio': row['data_inizio'],
+            'data_fine': row['data_fine'],
+        }
+
+    # --- Worker side ---
+
+    def start(self):
+        """Avvia il pool di thread (idempotente)."""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._ciclo, name=f"calor-job-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._sveglia.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def _ciclo(self):
+        while not self._stop.is_set():
+            try:
+                job_id = self._prendi_job()
+            except sqlite3.Error as e:
+                print(f"Job queue error: {e}")
+                job_id = None
+            if job_id is None:
+                self._sveglia.wait(self.poll_seconds)
+                self._sveglia.clear()
+                continue
+            self.esegui(job_id)
+
+    def _prendi_job(self):
+        """Segna come in_corso il job in coda più vecchio (anche di altri processi). Restituisce l'id."""
+        conn = self._connetti()
+        try:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            orfani = (datetime.now() - self.JOB_ORFANO).isoformat(timespec='seconds')
+            row = conn.execute("""
+                SELECT id FROM job_elaborazione
+                WHERE stato = ? OR (stato = ? AND data_aggiornamento < ?)
+                ORDER BY data_creazione LIMIT 1
+            """, (IN_CODA, IN_CORSO, orfani)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute("""
+                UPDATE job_elaborazione SET stato = ?, data_inizio = ?, data_aggiornamento = ?
+                WHERE id = ?
+            """, (IN_CORSO, _adesso(), _adesso(), row['id']))
+            conn.execute("COMMIT")
+            return row['id']
+        finally:
+            conn.close()
+
+    def esegui(self, job_id):
+        """Import + analisi di un job (nel thread chiamante). Restituisce lo stato finale."""
+        conn = self._connetti()
+        try:
+            row = conn.execute("SELECT file_json, cartella FROM job_elaborazione WHERE id = ?",
+                               (job_id,)).fetchone()
+            conn.execute("UPDATE job_elaborazione SET stato = ?, data_inizio = COALESCE(data_inizio, ?) WHERE id = ?",
+                         (IN_CORSO, _adesso(), job_id))
+            conn.commit()
+            file_paths = json.loads(row['file_json'])
+            cartella = row['cartella']
+            report = _Avanzamento(conn, job_id, self.INTERVALLO_STATO)
+            fine = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, fine),
+                                         name=f"calor-heartbeat-{job_id[:8]}", daemon=True)
+            heartbeat.start()
+
+            try:
+                risultato = self._importa_e_analizza(file_paths, cartella, report)
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                report.log(f"ERRORE: {e}")
+                report.chiudi(ERRORE, errori=str(e))
+            else:
+                report.chiudi(COMPLETATO, risultato=risultato)
+            finally:
+                fine.set()
+                heartbeat.join()
+                if cartella:
+                    shutil.rmtree(cartella, ignore_errors=True)
+        finally:
+            conn.close()
+        return self.stato(job_id)
+
+    def _heartbeat(self, job_id, fine):
+        """Refreshes data_aggiornamento of a running job until `fine` is set (see JOB_ORFANO)."""
+        while not fine.wait(self.INTERVALLO_HEARTBEAT):
+            try:
+                conn = self._connetti()
+                try:
+                    conn.execute("UPDATE job_elaborazione SET data_aggiornamento = ? WHERE id = ? AND stato = ?",
+                                 (_adesso(), job_id, IN_CORSO))
+                    conn.commit()
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                print(f"Job heartbeat error: {e}")
+
+    def _importa_e_analizza(self, file_paths, cartella, report):
+        importer = DataImporter(self.db, **self.importer_kwargs)
+        inizio = time.perf_counter()
+
+        def progress_import(cur, tot, msg):
+            righe = sum(s['righe'] for s in importer.import_stats)
+            secondi = time.perf_counter() - inizio
+            report.aggiorna('Importazione', 0.6 * cur / tot if tot else 0.0, msg,
+                            righe=righe, righe_sec=round(righe / secondi, 1) if secondi > 0 else None)
+
+        def progress_analisi(cur, tot, msg):
+            report.aggiorna('Analisi', 0.6 + 0.4 * cur / tot if tot else 0.6, msg)
+
+        # ZIP archives are extracted member by member while earlier members are parsed
+        estratti = tempfile.mkdtemp(prefix="zip_", dir=cartella)
+        try:
+            importati = importer.import_files(expand_uploads(file_paths, estratti),
+                                              progress_callback=progress_import)
+        finally:
+            shutil.rmtree(estratti, ignore_errors=True)
+        progress_import(1, 1, f"Importati {len(importati)} file.")
+
+        # Only the days touched by this upload (and by earlier unanalyzed ones)
+        analyzer = Analyzer(self.db, workers=self.importer_kwargs.get('workers', 1))
+        results = analyzer.run_analysis(progress_callback=progress_analisi, solo_modificati=True)
+        return {
+            "message": "Elaborazione completata",
+            "files_imported": len(importati),
+            "days_analyzed": len(results),
+            # Days with inputs unchanged since the last analysis (salta_invariati)
+            "days_skipped": analyzer.giorni_esaminati - len(results),
+        }
+
+
+class _Avanzamento:
+    """Scrive fase/progresso/log di un job, al massimo ogni `intervallo` secondi."""
+
+    def __init__(self, conn, job_id, intervallo):
+        self.conn = conn
+        self.job_id = job_id
+        self.intervallo = intervallo
+        self.logs = []
+        self.scartati = 0
+        self.stato = {'fase': None, 'progresso': 0.0, 'messaggio': None, 'righe': 0, 'righe_sec': None}
+        self._ultima_scrittura = 0.0
+
+    def log(self, msg):
+        self.logs.append(msg)
+        eccesso = len(self.logs) - MAX_LOG
+        if eccesso > 0:
+            del self.logs[:eccesso]
+            self.scartati += eccesso
+
+    def aggiorna(self, fase, progresso, messaggio, **extra):
+        nuova_fase = fase != self.stato['fase']
+        self.stato.update(fase=fase, progresso=progresso, messaggio=messaggio, **extra)
+        self.log(messaggio)
+        if nuova_fase or time.monotonic() - self._ultima_scrittura >= self.intervallo:
+            self._scrivi()
+
+    def _scrivi(self, **fine):
+        campi = dict(self.stato, log_json=json.dumps(self.logs), log_scartati=self.scartati, data_aggiornamento=_adesso(), **fine)
+        self.conn.execute(
+            f"UPDATE job_elaborazione SET {', '.join(f'{k} = ?' for k in campi)} WHERE id = ?",
+            (*campi.values(), self.job_id))
+        self.conn.commit()
+        self._ultima_scrittura = time.monotonic()
+
+    def chiudi(self, stato, risultato=None, errori=None):
+        if stato == COMPLETATO:
+            self.stato.update(fase='Completato', progresso=1.0)
+        self._scrivi(stato=stato, errori=errori, data_fine=_adesso(),
+                     risultato_json=json.dumps(risultato) if risultato is not None else None)
@@ -0,0 +1,120 @@
+"""
+Cache locale dei fogli Excel già parsati e normalizzati.
+
+Ogni voce è un file pickle (i DataFrame restano a blocchi colonnari) con
+chiave hash contenuto + fonte + versione del parser: rileggere lo stesso
+XLSX dopo una correzione delle anagrafiche costa millisecondi invece di
+un nuovo parsing openpyxl. Cambiare la versione del parser invalida le
+voci vecchie, che escono poi con l'eviction per dimensione (LRU su mtime).
+"""
+
+import hashlib
+import os
+import pickle
+from pathlib import Path
+
+DEFAULT_DIR = Path(__file__).resolve().parents[2] / "db" / "parse_cache"
+DEFAULT_MAX_MB = 512
+
+
+def file_hash(file_path, block_size=1 << 20):
+    """SHA-256 of the file content, used to recognise re-uploaded files."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """
+    Best-effort cache: read or write errors (corrupt entry, read-only disk)
+    count as a miss and never stop an import.
+    """
+
+    SUFFIX = ".pkl"
+
+    def __init__(self, cache_dir=None, max_mb=None):
+        self.cache_dir = Path(cache_dir or os.environ.get('CALOR_PARSE_CACHE_DIR') or DEFAULT_DIR)
+        self.max_bytes = int(max_mb if max_mb is not None
+                             else os.environ.get('CALOR_PARSE_CACHE_MB', DEFAULT_MAX_MB)) * 1024 * 1024
+
+    def _path(self, digest, fonte, versione):
+        return self.cache_dir / f"{fonte}-v{versione}-{digest}{self.SUFFIX}"
+
+    def load(self, digest, fonte, versione):
+        """Cached value, or None on a miss."""
+        path = self._path(digest, fonte, versione)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path)  # Recently used -> evicted last
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Truncated or unreadable entry: drop it and parse again
+            path.unlink(missing_ok=True)
+            return None
+
+    def save(self, digest, fonte, versione, value):
+        path = self._path(digest, fonte, versione)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            # Atomic: parallel workers never see a half-written entry
+            os.replace(tmp, path)
+            return True
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            return False
+
+    def _entries(self):
+        try:
+            return [p for p in self.cache_dir.iterdir() if p.name.endswith(self.SUFFIX)]
+        except FileNotFoundError:
+            return []
+
+    def size(self):
+        """Total bytes used by the cache."""
+        return sum(p.stat().st_size for p in self._entries())
+
+    def evict(self):
+        """Deletes the least recently used entries until the cache fits max_mb. Returns how many."""
+        entries = sorted(((p.stat(), p) for p in self._entries()), key=lambda e: e[0].st_mtime)
+        total = sum(st.st_size for st, _ in entries)
+        removed = 0
+        for st, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= st.st_size
+            removed += 1
+        return removed
+
+    def clear(self):
+        """Empties the cache. Returns the number of entries removed."""
+        entries = self._entries()
+        for path in entries:
+            path.unlink(missing_ok=True)
+        for tmp in self.cache_dir.glob("*.tmp") if self.cache_dir.exists() else []:
+            tmp.unlink(missing_ok=True)
+        return len(entries)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cache dei fogli Excel parsati")
+    parser.add_argument("--dir", help="cartella della cache (default: db/parse_cache)")
+    parser.add_argument("--clear", action="store_true", help="svuota la cache")
+    args = parser.parse_args()
+
+    cache = ParseCache(args.dir)
+    if args.clear:
+        print(f"Rimosse {cache.clear()} voci da {cache.cache_dir}")
+    else:
+        print(f"{cache.cache_dir}: {len(cache._entries())} voci, {cache.size() / 1024 / 1024:.1f} MB "
+              f"(limite {cache.max_bytes // 1024 // 1024} MB)")
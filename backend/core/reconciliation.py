@@ -3,7 +3,7 @@ CALOR SYSTEMS - Modulo Riconciliazione
 Logiche automatiche per confronto dati Fortech vs fonti reali
 """
 
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 from datetime import datetime, timedelta
 from dataclasses import dataclass, field
 from enum import Enum
@@ -48,6 +48,10 @@ class MatchContanti:
 # CONFIGURAZIONE TOLLERANZE
 # ============================================================================
 
+# Incrementare quando cambia la logica di riconciliazione: i risultati salvati con
+# un'altra versione (o con TOLLERANZE diverse) vengono ricalcolati dall'Analyzer
+ENGINE_VERSION = 1
+
 TOLLERANZE = {
     'contanti': {
         'arrotondamento': 5.0,      # €5 di tolleranza per arrotondamenti gestore
@@ -684,14 +688,83 @@ def riconcilia_satispay(
 # RICONCILIAZIONE COMPLETA GIORNATA
 # ============================================================================
 
+# Record di una fonte, oppure il loro totale già aggregato (es. GROUP BY in SQL)
+RecordOTotale = Union[List[Dict], float]
+
+
+def _totale(fonte: Optional[RecordOTotale], campo: str) -> float:
+    """Somma di `campo` sui record; un numero è già il totale e viene usato così com'è."""
+    if isinstance(fonte, (int, float)):
+        return fonte
+    return sum(r.get(campo, 0) or 0 for r in (fonte or []))
+
+
+def _giornata_contanti(fortech_data: Dict, fonti: Dict, data: str) -> RisultatoRiconciliazione:
+    # 🟡 Contanti (AS400) — la più critica
+    return riconcilia_contanti(fortech_data, fonti['as400'], data)
+
+
+def _giornata_carte_bancarie(fortech_data: Dict, fonti: Dict, data: str) -> RisultatoRiconciliazione:
+    # 🟢 Carte bancarie (Numia) — confronto diretto al centesimo
+    carte_bancarie_teorico = fortech_data.get('incasso_carte_bancarie_teorico', 0) or 0
+    return riconcilia_carte_bancarie(carte_bancarie_teorico, _totale(fonti['numia'], 'importo'))
+
+
+def _giornata_carte_petrolifere(fortech_data: Dict, fonti: Dict, data: str) -> RisultatoRiconciliazione:
+    # 🔵🔴 Carte petrolifere + Buoni (iP Portal) — aggregazione PV + Esercente
+    fatture_tot = (fortech_data.get('fatture_postpagate_totale', 0) or 0) + \
+                  (fortech_data.get('fatture_prepagate_totale', 0) or 0)
+    return riconcilia_carte_petrolifere(
+        fatture_tot, _totale(fonti['ip_carte'], 'importo'), _totale(fonti['ip_buoni'], 'importo')
+    )
+
+
+def _giornata_satispay(fortech_data: Dict, fonti: Dict, data: str) -> RisultatoRiconciliazione:
+    # ⚫ Satispay — confronto diretto tramite codice negozio
+    satispay_teorico = fortech_data.get('incasso_satispay_teorico', 0) or 0
+    return riconcilia_satispay(satispay_teorico, _totale(fonti['satispay'], 'importo_totale'))
+
+
+def _giornata_crediti(fortech_data: Dict, fonti: Dict, data: str) -> RisultatoRiconciliazione:
+    # 🟣 Crediti Fine Mese (Fattura1Click) — somma erogazioni vs Fortech
+    credito_teorico = fortech_data.get('incasso_credito_finemese_teorico', 0) or 0
+    return riconcilia_crediti(credito_teorico, _totale(fonti['crediti'], 'importo_erogazione'))
+
+
+# Categorie di riconcilia_giornata, nell'ordine del report:
+# nome -> funzione(fortech_data, fonti, data) -> RisultatoRiconciliazione
+CATEGORIE_GIORNATA = {
+    'contanti': _giornata_contanti,
+    'carte_bancarie': _giornata_carte_bancarie,
+    'carte_petrolifere': _giornata_carte_petrolifere,
+    'satispay': _giornata_satispay,
+    'crediti': _giornata_crediti,
+}
+
+
+def stato_globale(stati) -> str:
+    """Stato complessivo della giornata dagli stati delle categorie (enum o valore)."""
+    stati = [s if isinstance(s, StatoRiconciliazione) else StatoRiconciliazione(s) for s in stati]
+    if StatoRiconciliazione.ANOMALIA_GRAVE in stati:
+        return 'ANOMALIA_GRAVE'
+    elif StatoRiconciliazione.ANOMALIA_LIEVE in stati:
+        return 'ANOMALIA_LIEVE'
+    elif StatoRiconciliazione.IN_ATTESA in stati:
+        return 'IN_ATTESA'
+    elif StatoRiconciliazione.NON_TROVATO in stati:
+        return 'INCOMPLETO'
+    return 'QUADRATO'
+
+
 def riconcilia_giornata(
     fortech_data: Dict,
     as400_records: List[Dict],
-    numia_records: List[Dict],
-    ip_carte_records: List[Dict],
-    ip_buoni_records: List[Dict],
-    satispay_records: List[Dict] = None,
-    fattura1click_records: List[Dict] = None
+    numia_records: RecordOTotale,
+    ip_carte_records: RecordOTotale,
+    ip_buoni_records: RecordOTotale,
+    satispay_records: RecordOTotale = None,
+    fattura1click_records: RecordOTotale = None,
+    categorie=None
 ) -> Dict:
     """
     Esegue riconciliazione completa per una giornata.
@@ -702,63 +775,33 @@ def riconcilia_giornata(
     - Satispay - ⚫
     - Crediti Fine Mese (Fattura1Click) - 🟣
     
+    Per Numia, iP, Satispay e crediti serve solo la somma degli importi:
+    si possono passare i record o direttamente il totale del giorno.
+    categorie: nomi di CATEGORIE_GIORNATA da calcolare (default tutte), es. senza
+    'contanti' quando se ne occupa riconcilia_contanti_multi_giorno.
+    
     Returns:
         Dict con risultati per ogni categoria e stato globale
     """
     data = fortech_data.get('data_contabile', '')[:10]
-    
-    # Calcola totali reali dalle fonti esterne
-    numia_totale = sum(r.get('importo', 0) or 0 for r in numia_records)
-    ip_carte_totale = sum(r.get('importo', 0) or 0 for r in ip_carte_records)
-    ip_buoni_totale = sum(r.get('importo', 0) or 0 for r in ip_buoni_records)
-    satispay_totale = sum(r.get('importo_totale', 0) or 0 for r in (satispay_records or []))
-    fattura1click_totale = sum(r.get('importo_erogazione', 0) or 0 for r in (fattura1click_records or []))
+    fonti = {
+        'as400': as400_records,
+        'numia': numia_records,
+        'ip_carte': ip_carte_records,
+        'ip_buoni': ip_buoni_records,
+        'satispay': satispay_records,
+        'crediti': fattura1click_records,
+    }
     
     # ── Esegui riconciliazioni ──
     risultati = {}
-    
-    # 🟡 Contanti (AS400) — la più critica
-    risultati['contanti'] = riconcilia_contanti(fortech_data, as400_records, data)
-    
-    # 🟢 Carte bancarie (Numia) — confronto diretto al centesimo
-    carte_bancarie_teorico = fortech_data.get('incasso_carte_bancarie_teorico', 0) or 0
-    risultati['carte_bancarie'] = riconcilia_carte_bancarie(carte_bancarie_teorico, numia_totale)
-    risultati['carte_bancarie'].data = data
-    
-    # 🔵🔴 Carte petrolifere + Buoni (iP Portal) — aggregazione PV + Esercente
-    fatture_tot = (fortech_data.get('fatture_postpagate_totale', 0) or 0) + \
-                  (fortech_data.get('fatture_prepagate_totale', 0) or 0)
-    risultati['carte_petrolifere'] = riconcilia_carte_petrolifere(
-        fatture_tot, ip_carte_totale, ip_buoni_totale
-    )
-    risultati['carte_petrolifere'].data = data
-    
-    # ⚫ Satispay — confronto diretto tramite codice negozio
-    satispay_teorico = fortech_data.get('incasso_satispay_teorico', 0) or 0
-    risultati['satispay'] = riconcilia_satispay(satispay_teorico, satispay_totale)
-    risultati['satispay'].data = data
-    
-    # 🟣 Crediti Fine Mese (Fattura1Click) — somma erogazioni vs Fortech
-    credito_teorico = fortech_data.get('incasso_credito_finemese_teorico', 0) or 0
-    risultati['crediti'] = riconcilia_crediti(credito_teorico, fattura1click_totale)
-    risultati['crediti'].data = data
-    
-    # ── Stato globale ──
-    stati = [r.stato for r in risultati.values()]
-    if StatoRiconciliazione.ANOMALIA_GRAVE in stati:
-        stato_globale = 'ANOMALIA_GRAVE'
-    elif StatoRiconciliazione.ANOMALIA_LIEVE in stati:
-        stato_globale = 'ANOMALIA_LIEVE'
-    elif StatoRiconciliazione.IN_ATTESA in stati:
-        stato_globale = 'IN_ATTESA'
-    elif StatoRiconciliazione.NON_TROVATO in stati:
-        stato_globale = 'INCOMPLETO'
-    else:
-        stato_globale = 'QUADRATO'
+    for nome in (CATEGORIE_GIORNATA if categorie is None else categorie):
+        risultati[nome] = CATEGORIE_GIORNATA[nome](fortech_data, fonti, data)
+        risultati[nome].data = data
     
     return {
         'data': data,
-        'stato_globale': stato_globale,
+        'stato_globale': stato_globale(r.stato for r in risultati.values()),
         'risultati': {k: {
             'stato': v.stato.value,
             'teorico': v.valore_teorico,
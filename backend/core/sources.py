@@ -0,0 +1,178 @@
+"""
+Registro delle fonti Excel: un'unica descrizione dichiarativa per fonte.
+
+Importer (core/importer.py), ingestione automatica (automation/data_ingestion.py)
+e FileClassifier leggono da qui riga di intestazione, colonne necessarie,
+dtype, colonne data/importo, firma di riconoscimento e parole chiave del
+nome file. Aggiungere una fonte = aggiungere una voce a SOURCES.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class SourceSchema:
+    name: str
+    header_row: int                                  # 0-based, come pd.read_excel(header=...)
+    columns: Tuple[str, ...]                         # Colonne lette (usecols): tutte quelle usate dai parser
+    signature: Tuple[str, ...] = ()                  # Colonne che identificano la fonte dal contenuto
+    filename_keywords: Tuple[str, ...] = ()          # Una qualsiasi nel nome file (maiuscolo)...
+    filename_exclude: Tuple[str, ...] = ()           # ...purché non compaia nessuna di queste
+    dtypes: Dict[str, str] = field(default_factory=dict)  # Codici/ID come testo: niente 43809.0
+    date_columns: Tuple[str, ...] = ()
+    amount_columns: Tuple[str, ...] = ()
+
+    def read_kwargs(self):
+        """Column projection and dtypes for pd.read_excel (missing columns are tolerated)."""
+        wanted = set(self.columns)
+        return {'usecols': lambda c: c in wanted, 'dtype': dict(self.dtypes)}
+
+    def read(self, file_path, sheet_name=0, header_row=None):
+        """header_row: offset detected by FileClassifier (default: the usual one of the source)."""
+        header = self.header_row if header_row is None else header_row
+        return pd.read_excel(file_path, sheet_name=sheet_name, header=header, **self.read_kwargs())
+
+    def coerce(self, df):
+        """Same projection and dtypes for frames not read by pd.read_excel (streamed chunks)."""
+        df = df[[c for c in df.columns if c in set(self.columns)]].copy()
+        for col, dtype in self.dtypes.items():
+            if col in df.columns and dtype == 'str':
+                df[col] = df[col].map(_as_text)
+        return df
+
+    def matches_filename(self, filename):
+        name = filename.upper()
+        return (any(k in name for k in self.filename_keywords)
+                and not any(k in name for k in self.filename_exclude))
+
+
+def _as_text(value):
+    # pd.read_excel(dtype=str) turns integral floats into "43809", not "43809.0"
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+SOURCES: Dict[str, SourceSchema] = {
+    'FORTECH': SourceSchema(
+        name='FORTECH',
+        header_row=0,
+        signature=('CodicePV', 'Corrispettivo Totale', 'DataContabile', 'StatoGiornata'),
+        filename_keywords=('FORTECH',),
+        columns=(
+            'CodicePV', 'DataContabile', 'DataInizio', 'DataFine', 'StatoGiornata',
+            'Corrispettivo Totale', 'CorrispettivoVerde', 'CorrispettivoDiesel',
+            'VolumeVerdePrepay', 'ImportoVerdePrepay', 'PrezzoVerdePrepay',
+            'VolumeDieselPrepay', 'ImportoDieselPrepay', 'PrezzoDieselPrepay',
+            'Fatture Postpagate Totale', 'Fatture Prepagate Totale',
+            'Fatture Immediate Totale', 'Fatture Differite Totale', 'Buoni Totale',
+            'Incasso Contanti',
+        ),
+        dtypes={'CodicePV': 'str'},
+        date_columns=('DataContabile', 'DataInizio', 'DataFine'),
+        amount_columns=(
+            'Corrispettivo Totale', 'Fatture Postpagate Totale', 'Fatture Prepagate Totale',
+            'Buoni Totale', 'Incasso Contanti',
+        ),
+    ),
+    'AS400': SourceSchema(
+        name='AS400',
+        header_row=0,
+        signature=('Registrazione//Data', 'Documento//Tipo', 'Importo', 'Segno'),
+        filename_keywords=('AS400', 'CONTANTI'),
+        columns=(
+            'Registrazione//Data', 'Documento//Data', 'Scadenza', 'Documento//Tipo',
+            'Documento//Numero', 'Registrazione//Tipo', 'Registrazione//Numero',
+            'Importo', 'Segno', 'Descrizione', 'Centro di Costo', 'Stato', 'Partita',
+        ),
+        dtypes={'Documento//Numero': 'str', 'Registrazione//Numero': 'str', 'Partita': 'str'},
+        date_columns=('Registrazione//Data', 'Documento//Data', 'Scadenza'),
+        amount_columns=('Importo',),
+    ),
+    'NUMIA': SourceSchema(
+        name='NUMIA',
+        header_row=2,  # row 0 = empty, row 1 = title text, row 2 = actual headers
+        signature=('Circuito', 'MID', 'ID Terminale / TML', 'Codice autorizzazione'),
+        filename_keywords=('NUMIA', 'BANCARIE'),
+        columns=(
+            'Data e ora', 'Importo', 'Codice autorizzazione', 'Numero carta', 'Circuito',
+            'Tipo transazione', 'Stato operazione', 'Punto vendita', 'ID Punto vendita',
+            'MID', 'ID Terminale / TML', 'Alias Terminale', 'ID Transazione',
+        ),
+        dtypes={'Codice autorizzazione': 'str', 'ID Punto vendita': 'str', 'MID': 'str',
+                'ID Terminale / TML': 'str', 'ID Transazione': 'str'},
+        date_columns=('Data e ora',),
+        amount_columns=('Importo',),
+    ),
+    'IP_CARTE': SourceSchema(
+        name='IP_CARTE',
+        header_row=1,
+        signature=('PV', 'Gestore', 'Circuito', 'Cod. Prod.'),
+        filename_keywords=('IPORTAL', 'PETROLIFERE', 'AZZURRO'),
+        filename_exclude=('BUONI', 'ROSSO'),
+        columns=(
+            'PV', 'Gestore', 'Data\noperazione', 'Data operazione', 'Ora\noperazione',
+            'Circuito', 'Cod. Prod.', 'Prodotto', 'Riferimento\nScontrino',
+            'Quantità', 'QuantitÓ', 'Prezzo', 'Importo', 'Segno',
+            'Numero Fattura', 'Data Fattura',
+        ),
+        dtypes={'PV': 'str', 'Gestore': 'str', 'Cod. Prod.': 'str'},
+        date_columns=('Data\noperazione', 'Data operazione', 'Data Fattura'),
+        amount_columns=('Importo',),
+    ),
+    'IP_BUONI': SourceSchema(
+        name='IP_BUONI',
+        header_row=1,
+        signature=('Esercente', 'Descrizione esercente', 'Pan', 'Serial number'),
+        filename_keywords=('BUONI', 'ROSSO'),
+        columns=(
+            'Gestore', 'Esercente', 'Descrizione esercente', 'Punto vendita',
+            'Data operazione', 'Ora operazione', 'Prodotto', 'Quantita', 'Prezzo unit.',
+            'Importo', 'Pan', 'Serial number', 'Terminale', 'Auth code', 'Flusso',
+        ),
+        dtypes={'Gestore': 'str', 'Punto vendita': 'str', 'Serial number': 'str', 'Auth code': 'str'},
+        date_columns=('Data operazione',),
+        amount_columns=('Importo',),
+    ),
+    'SATISPAY': SourceSchema(
+        name='SATISPAY',
+        header_row=0,
+        signature=('id transazione', 'codice negozio', 'totale commissioni'),
+        filename_keywords=('SATISPAY',),
+        columns=(
+            'id transazione', 'data transazione', 'negozio', 'codice negozio',
+            'importo totale', 'totale commissioni', 'tipo transazione',
+            'codice transazione', 'id gruppo',
+        ),
+        dtypes={'id transazione': 'str', 'codice negozio': 'str',
+                'codice transazione': 'str', 'id gruppo': 'str'},
+        date_columns=('data transazione',),
+        amount_columns=('importo totale', 'totale commissioni'),
+    ),
+}
+
+# Second sheet of the Fortech master file (not a source on its own)
+FORTECH_INCASSI = SourceSchema(
+    name='FORTECH_INCASSI',
+    header_row=0,
+    columns=(
+        'CodicePV', 'DataContabile', 'CONTANTI', 'CARTA CREDITO GENERICA', 'PAGOBANCOMAT',
+        'AMEX', 'BANCOMAT GESTORE', 'CARTA CREDITO GESTORE', 'CARTAPETROLIFERA', 'DKV',
+        'UTA', 'CARTAMAXIMA', 'PAGAMENTIINNOVATIVI', 'CLIENTI CON FATTURA FINE MESE', 'BUONI',
+    ),
+    dtypes={'CodicePV': 'str'},
+    date_columns=('DataContabile',),
+)
+
+
+def source_from_filename(filename) -> Optional[str]:
+    """First source (in SOURCES order) whose filename keywords match, else None."""
+    for name, schema in SOURCES.items():
+        if schema.matches_filename(filename):
+            return name
+    return None
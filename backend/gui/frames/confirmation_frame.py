@@ -1,6 +1,8 @@
 import customtkinter as ctk
 import os
+from core.archive import is_zip, zip_member_names
 from core.file_classifier import FileClassifier
+from core.sources import source_from_filename
 
 # Friendly labels and colours per type
 _TYPE_META = {
@@ -79,7 +81,11 @@ class ConfirmationFrame(ctk.CTkFrame):
             self.btn_go.configure(state="disabled")
             return
 
-        classified = FileClassifier.classify_files(files)
+        classified = FileClassifier.classify_files([f for f in files if not is_zip(f)])
+        # ZIP archives: members classified by name, without extracting them
+        for archive in filter(is_zip, files):
+            for name in zip_member_names(archive):
+                classified[source_from_filename(name) or "UNKNOWN"].append(os.path.join(archive, name))
         missing, is_valid = FileClassifier.validate_group(classified)
 
         self.subtitle.configure(
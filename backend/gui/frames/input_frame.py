@@ -4,7 +4,7 @@ import os
 
 
 class InputFrame(ctk.CTkFrame):
-    """File-selection screen: user picks one or more Excel files."""
+    """File-selection screen: user picks one or more Excel files or ZIP archives."""
 
     def __init__(self, parent, controller):
         super().__init__(parent)
@@ -77,7 +77,8 @@ class InputFrame(ctk.CTkFrame):
     def _add(self):
         paths = filedialog.askopenfilenames(
             title="Seleziona file Excel",
-            filetypes=[("Excel", "*.xlsx *.xls"), ("Tutti", "*.*")],
+            filetypes=[("Excel o ZIP", "*.xlsx *.xls *.zip"), ("Excel", "*.xlsx *.xls"),
+                       ("Archivi ZIP", "*.zip"), ("Tutti", "*.*")],
         )
         for p in paths:
             if p not in self.selected_files:
@@ -2,11 +2,18 @@ import customtkinter as ctk
 import threading
 import time
 import os
+import tempfile
 import traceback
+from core.archive import expand_uploads
 from core.database import Database
 from core.importer import DataImporter
 from core.analyzer import Analyzer
 
+# Parsing and analysis processes; opt-in, the pools are forked from the worker thread.
+# Same setting as the server, the analysis can be tuned on its own
+IMPORT_WORKERS = int(os.environ.get('CALOR_IMPORT_WORKERS', 1))
+ANALYSIS_WORKERS = int(os.environ.get('CALOR_ANALYSIS_WORKERS', IMPORT_WORKERS))
+
 
 class ProcessingFrame(ctk.CTkFrame):
     """Runs import + analysis on a background thread with live feedback."""
@@ -139,16 +146,20 @@ class ProcessingFrame(ctk.CTkFrame):
             self._set_phase(f"FASE 2/3 · Importazione {len(files)} file…")
             self._log(f"Importazione di {len(files)} file…")
 
-            importer = DataImporter(db)
-            importer.import_files(files, progress_callback=self._progress_cb)
-            self._log("✅  Importazione completata.")
+            # ZIP archives are extracted member by member while earlier members are parsed
+            importer = DataImporter(db, workers=IMPORT_WORKERS)
+            with tempfile.TemporaryDirectory(prefix="calor_zip_") as estratti:
+                importati = importer.import_files(expand_uploads(files, estratti),
+                                                  progress_callback=self._progress_cb)
+            self._log(f"✅  Importazione completata ({len(importati)} file).")
             self._set_progress(0.6)
 
             # Phase 3 — Analysis
             self._set_phase("FASE 3/3 · Analisi riconciliazione…")
             self._log("Avvio analisi riconciliazione…")
 
-            analyzer = Analyzer(db)
+            # Full run with every day returned: the results screen and the AI report read them
+            analyzer = Analyzer(db, workers=ANALYSIS_WORKERS, salta_invariati=False)
             results = analyzer.run_analysis(progress_callback=self._progress_cb)
             self._log(f"✅  Analisi completata — {len(results)} giornate elaborate.")
             self._set_progress(1.0)
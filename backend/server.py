@@ -10,20 +10,25 @@ import os
 import sys
 import webbrowser
 import threading
-import tempfile
 import shutil
 import time
+from contextlib import contextmanager
 from pathlib import Path
 from flask import Flask, render_template, jsonify, request
 from werkzeug.utils import secure_filename
 
+try:
+    import fcntl
+except ImportError:  # Windows: solo il lock tra thread
+    fcntl = None
+
 # Ensure we can find the project root
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(PROJECT_ROOT) # Ensure core can be imported
 
 from core.database import Database
-from core.importer import DataImporter
-from core.analyzer import Analyzer
+from core.jobs import JobQueue
+from core.parse_cache import ParseCache, file_hash
 from core.ai_report import generate_report, get_saved_api_key
 
 from dotenv import load_dotenv
@@ -33,6 +38,27 @@ load_dotenv()
 # ── Vercel Environment Detection ──
 IS_VERCEL = os.environ.get('VERCEL', '') == '1'
 
+# Processes used to parse uploaded Excel files (and analyze plants) in parallel.
+# Opt-in: the process pools are forked from the job threads and small instances
+# (Render free plan, 512 MB) cannot hold one copy per core
+IMPORT_WORKERS = int(os.environ.get('CALOR_IMPORT_WORKERS', 1))
+# Chunked read-only Excel import: bounded memory on small instances (default on Vercel)
+IMPORT_STREAMING = os.environ.get('CALOR_IMPORT_STREAMING', '1' if IS_VERCEL else '0') == '1'
+# Parsed-sheet cache: next to the DB locally, /tmp on Vercel (read-only project dir)
+PARSE_CACHE = ParseCache('/tmp/calor_parse_cache') if IS_VERCEL else True
+
+# Chunked uploads: staged by content hash until finalize (resumable across requests)
+UPLOAD_STAGING_DIR = '/tmp/calor_upload_staging' if IS_VERCEL else os.path.join(PROJECT_ROOT, "db", "upload_staging")
+UPLOAD_CHUNK_SIZE = int(os.environ.get('CALOR_UPLOAD_CHUNK_KB', 1024)) * 1024
+UPLOAD_STAGING_TTL = 24 * 3600
+_UPLOAD_LOCK = threading.Lock()
+
+# Import/analysis jobs run in background threads; on Vercel the function is frozen
+# after the response, so there the job runs inside the request (same API, already done)
+ASYNC_JOBS = os.environ.get('CALOR_ASYNC_JOBS', '0' if IS_VERCEL else '1') == '1'
+JOB_WORKERS = int(os.environ.get('CALOR_JOB_WORKERS', 1))
+_JOB_QUEUE = None
+
 if IS_VERCEL:
     # Vercel serverless: use /tmp for writable SQLite
     DB_PATH = "/tmp/calor_systems.db"
@@ -354,8 +380,9 @@ def api_upload():
     if not files or all(f.filename == '' for f in files):
         return jsonify({"error": "Nessun file selezionato"}), 400
 
-    # Create temp directory
-    temp_dir = tempfile.mkdtemp(prefix="calor_upload_")
+    # Job directory: the files stay there until the job has run
+    queue = _job_queue()
+    temp_dir = queue.nuova_cartella()
     saved_paths = []
 
     try:
@@ -368,46 +395,245 @@ def api_upload():
                 saved_paths.append(path)
         
         if not saved_paths:
+             shutil.rmtree(temp_dir, ignore_errors=True)
              return jsonify({"error": "Nessun file valido"}), 400
 
-        # 2. Init Core
-        # Use PROJECT_ROOT to ensure DB is found correctly
-        db_instance = Database(PROJECT_ROOT) 
-        
-        # Ensure DB init (safeguard) - ONLY IF NOT EXISTS
-        if not os.path.exists(DB_PATH):
-            if not db_instance.initialize():
-                 return jsonify({"error": "Errore inizializzazione database"}), 500
-
-        # Define a no-op progress callback since we can't stream progress easily in one HTTP request
-        # (Alternatively, we could use Server-Sent Events, but let's keep it simple for now)
-        logs = []
-        def progress_cb(cur, tot, msg):
-            logs.append(msg)
-            # print(f"[Processing] {msg}") 
-
-        # 3. Import
-        importer = DataImporter(db_instance)
-        importer.import_files(saved_paths, progress_callback=progress_cb)
-
-        # 4. Analyze
-        analyzer = Analyzer(db_instance)
-        results = analyzer.run_analysis(progress_callback=progress_cb)
-
-        return jsonify({
-            "message": "Elaborazione completata",
-            "files_imported": len(saved_paths),
-            "days_analyzed": len(results),
-            "logs": logs
-        })
+        return _accoda_job(saved_paths, temp_dir)
 
     except Exception as e:
         import traceback
         traceback.print_exc()
+        shutil.rmtree(temp_dir, ignore_errors=True)
         return jsonify({"error": str(e)}), 500
+
+
+def _job_queue():
+    """Job queue bound to the project database, created (and started) on first use."""
+    global _JOB_QUEUE
+    if _JOB_QUEUE is None:
+        _JOB_QUEUE = JobQueue(
+            Database(PROJECT_ROOT),
+            jobs_dir='/tmp/calor_jobs' if IS_VERCEL else None,
+            workers=JOB_WORKERS,
+            importer_kwargs=dict(workers=IMPORT_WORKERS, streaming=IMPORT_STREAMING, cache=PARSE_CACHE),
+        )
+        if ASYNC_JOBS:
+            _JOB_QUEUE.start()
+    return _JOB_QUEUE
+
+
+def _accoda_job(saved_paths, temp_dir):
+    """Queues import + analysis of files saved in temp_dir; the client polls /api/jobs/<id>."""
+    # Use PROJECT_ROOT to ensure DB is found correctly
+    db_instance = Database(PROJECT_ROOT) 
+    
+    # Ensure DB init (safeguard) - ONLY IF NOT EXISTS
+    if not os.path.exists(DB_PATH):
+        if not db_instance.initialize():
+             shutil.rmtree(temp_dir, ignore_errors=True)
+             return jsonify({"error": "Errore inizializzazione database"}), 500
+
+    queue = _job_queue()
+    job_id = queue.submit(saved_paths, temp_dir)
+    if not ASYNC_JOBS:
+        queue.esegui(job_id)
+
+    stato = queue.stato(job_id)
+    risposta = dict(stato, job_id=job_id, status_url=f"/api/jobs/{job_id}")
+    if stato['stato'] == 'completato':
+        # Same fields as the old synchronous response
+        risposta.update(stato['risultato'])
+        return jsonify(risposta)
+    if stato['stato'] == 'errore':
+        return jsonify(dict(risposta, error=stato['errori'])), 500
+    return jsonify(risposta), 202
+
+
+@app.route("/api/jobs/<job_id>")
+def api_job(job_id):
+    """Phase, progress, throughput and logs of an import/analysis job."""
+    stato = _job_queue().stato(job_id)
+    if stato is None:
+        return jsonify({"error": "Job non trovato"}), 404
+    return jsonify(stato)
+
+
+# ── Chunked upload (resumable) ──
+# 1. POST /api/upload/precheck  {files: [{name, size, hash}]} -> what the server already has
+# 2. PUT  /api/upload/chunk/<hash>?offset=N&size=TOTAL         -> appends one chunk, resumable
+# 3. POST /api/upload/finalize  {files: [{name, hash}]}        -> import + analysis
+# Files are staged by SHA-256: an interrupted upload resumes from the bytes already received.
+
+def _hash_valido(hash_file):
+    return len(hash_file) == 64 and all(c in "0123456789abcdef" for c in hash_file)
+
+
+def _staged(hash_file):
+    """(complete file, partial file) paths in the staging dir."""
+    base = os.path.join(UPLOAD_STAGING_DIR, hash_file)
+    return base, base + ".part"
+
+
+@contextmanager
+def _upload_lock():
+    """Staging lock shared by threads and server processes: flock on a file next to the staging dir."""
+    with _UPLOAD_LOCK:
+        if fcntl is None:
+            yield
+            return
+        with open(UPLOAD_STAGING_DIR + ".lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+
+def _pulisci_staging():
+    """Drops staged uploads not touched for UPLOAD_STAGING_TTL seconds."""
+    limite = time.time() - UPLOAD_STAGING_TTL
+    for nome in os.listdir(UPLOAD_STAGING_DIR):
+        path = os.path.join(UPLOAD_STAGING_DIR, nome)
+        try:
+            if os.path.getmtime(path) < limite:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _hash_importati(hashes):
+    """Hashes already imported successfully (log_importazioni)."""
+    if not hashes or not os.path.exists(DB_PATH):
+        return set()
+    conn = get_readonly_db()
+    try:
+        rows = conn.execute(f"""
+            SELECT DISTINCT hash_file FROM log_importazioni
+            WHERE errori IS NULL AND hash_file IN ({','.join('?' * len(hashes))})
+        """, list(hashes)).fetchall()
+        return {r[0] for r in rows}
+    except sqlite3.OperationalError:
+        # Database created before hash_file existed: nothing is known yet
+        return set()
     finally:
-        # Cleanup
+        conn.close()
+
+
+@app.route("/api/upload/precheck", methods=["POST"])
+def api_upload_precheck():
+    """For each file hash: imported / stored / partial (with offset) / missing."""
+    payload = request.get_json(silent=True) or {}
+    files = payload.get('files') or []
+    hashes = [str(f.get('hash', '')).lower() for f in files]
+    if not files or not all(_hash_valido(h) for h in hashes):
+        return jsonify({"error": "Hash file mancanti o non validi"}), 400
+
+    os.makedirs(UPLOAD_STAGING_DIR, exist_ok=True)
+    _pulisci_staging()
+    importati = _hash_importati(set(hashes))
+
+    risultato = []
+    for hash_file in hashes:
+        completo, parziale = _staged(hash_file)
+        if hash_file in importati:
+            stato, offset = 'imported', None
+        elif os.path.exists(completo):
+            stato, offset = 'stored', os.path.getsize(completo)
+        elif os.path.exists(parziale):
+            stato, offset = 'partial', os.path.getsize(parziale)
+        else:
+            stato, offset = 'missing', 0
+        risultato.append({"hash": hash_file, "status": stato, "offset": offset})
+
+    return jsonify({"files": risultato, "chunk_size": UPLOAD_CHUNK_SIZE})
+
+
+@app.route("/api/upload/chunk/<hash_file>", methods=["PUT"])
+def api_upload_chunk(hash_file):
+    """Appends the request body at ?offset=; the file is verified once ?size= bytes are in."""
+    hash_file = hash_file.lower()
+    offset = request.args.get('offset', type=int)
+    size = request.args.get('size', type=int)
+    if not _hash_valido(hash_file) or offset is None or size is None or offset < 0 or size <= 0:
+        return jsonify({"error": "Parametri chunk non validi"}), 400
+
+    completo, parziale = _staged(hash_file)
+    os.makedirs(UPLOAD_STAGING_DIR, exist_ok=True)
+    with _upload_lock():
+        if os.path.exists(completo):
+            return jsonify({"offset": os.path.getsize(completo), "complete": True})
+
+        ricevuti = os.path.getsize(parziale) if os.path.exists(parziale) else 0
+        if offset != ricevuti:
+            # Chunk lost or repeated: the client resumes from the server offset
+            return jsonify({"error": "Offset non allineato", "offset": ricevuti}), 409
+
+        dati = request.get_data(cache=False)
+        if ricevuti + len(dati) > size:
+            return jsonify({"error": "Chunk oltre la dimensione dichiarata", "offset": ricevuti}), 400
+        with open(parziale, 'ab') as f:
+            f.write(dati)
+        ricevuti += len(dati)
+
+        if ricevuti < size:
+            return jsonify({"offset": ricevuti, "complete": False})
+
+        if file_hash(parziale) != hash_file:
+            os.remove(parziale)
+            return jsonify({"error": "Hash non corrispondente, file da ricaricare", "offset": 0}), 422
+        os.replace(parziale, completo)
+        return jsonify({"offset": ricevuti, "complete": True})
+
+
+@app.route("/api/upload/finalize", methods=["POST"])
+def api_upload_finalize():
+    """Queues import + analysis of the staged files, then drops them from the staging dir."""
+    payload = request.get_json(silent=True) or {}
+    files = payload.get('files') or []
+    if not files or not all(_hash_valido(str(f.get('hash', '')).lower()) for f in files):
+        return jsonify({"error": "Nessun file da importare"}), 400
+
+    temp_dir = _job_queue().nuova_cartella()
+    try:
+        saved_paths, mancanti, staged = [], [], []
+        importati = _hash_importati({str(f['hash']).lower() for f in files})
+        for f in files:
+            hash_file = str(f['hash']).lower()
+            completo, _ = _staged(hash_file)
+            if not os.path.exists(completo):
+                # Already imported files are not uploaded again
+                if hash_file not in importati:
+                    mancanti.append(f.get('name') or hash_file)
+                continue
+            # Original name: the classifier uses it as tiebreaker
+            safe_name = secure_filename(f.get('name') or '') or hash_file
+            path = os.path.join(temp_dir, safe_name)
+            if os.path.exists(path):
+                path = os.path.join(temp_dir, f"{len(saved_paths)}_{safe_name}")
+            shutil.copyfile(completo, path)
+            saved_paths.append(path)
+            staged.append(completo)
+
+        if mancanti:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return jsonify({"error": "File non ancora caricati: " + ", ".join(mancanti),
+                            "missing": mancanti}), 409
+        if not saved_paths:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return jsonify({"message": "Tutti i file erano già importati", "stato": "completato",
+                            "files_imported": 0, "days_analyzed": 0, "days_skipped": 0,
+                            "logs": []})
+
+        # The job works on its own copies
+        for path in staged:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return _accoda_job(saved_paths, temp_dir)
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
         shutil.rmtree(temp_dir, ignore_errors=True)
+        return jsonify({"error": str(e)}), 500
 
 
 # ============================================================================
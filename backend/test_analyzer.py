@@ -0,0 +1,448 @@
+"""
+Test script per l'Analyzer (core.analyzer).
+Usa gli stessi file sintetici dei test dell'importatore.
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+from datetime import date, timedelta
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from core import analyzer
+from core.analyzer import Analyzer, versione_algoritmo
+from core.reconciliation import TOLLERANZE
+from core.importer import DataImporter
+from test_importer import crea_db_temporaneo, crea_file_sorgenti
+
+
+def dump_report(db):
+    """Risultati dell'analisi senza id/timestamp, in ordine stabile."""
+    conn = db.get_connection()
+    try:
+        return conn.execute("""
+            SELECT impianto_id, data_riferimento, categoria, valore_fortech, valore_reale,
+                   differenza, percentuale_scostamento, stato, tipo_anomalia, note
+            FROM report_riconciliazioni
+            ORDER BY impianto_id, data_riferimento, categoria
+        """).fetchall()
+    finally:
+        conn.close()
+
+
+def aggiungi_casi_limite(db):
+    """Righe con date allineate a Fortech, ai bordi della finestra AS400 e in formati diversi."""
+    conn = db.get_connection()
+    try:
+        giorno, impianto_id = conn.execute(
+            "SELECT data_contabile, impianto_id FROM import_fortech_master ORDER BY id LIMIT 1").fetchone()
+        d = giorno[:10]
+        lo, hi = conn.execute("SELECT date(?, '-5 days'), date(?, '+5 days')", (giorno, giorno)).fetchone()
+        conn.executemany(
+            "INSERT INTO verifica_contanti_as400 (impianto_id, data_registrazione, importo_versato) VALUES (?, ?, ?)",
+            [(impianto_id, lo, 100.0), (impianto_id, hi, 200.0), (impianto_id, hi + 'T00:00:00', 400.0),
+             (impianto_id, d + 'T00:00:00', 800.0), (impianto_id, None, 5.0)])
+        conn.executemany(
+            "INSERT INTO verifica_numia (impianto_id, data_ora_transazione, importo) VALUES (?, ?, ?)",
+            [(impianto_id, giorno + ' 10:00', 10.5), (impianto_id, giorno.lower(), 3.0), (impianto_id, d, 1.0)])
+        conn.executemany(
+            "INSERT INTO verifica_ip_portal (impianto_id, tipo_transazione, data_operazione, importo) VALUES (?, ?, ?, ?)",
+            [(impianto_id, 'CARTA_PETROLIFERA', giorno, 20.0), (impianto_id, 'BUONO', giorno + 'x', 7.0)])
+        conn.execute("INSERT INTO verifica_satispay (impianto_id, data_transazione, importo_totale) VALUES (?, ?, ?)",
+                     (impianto_id, giorno + '.5', 4.0))
+        conn.execute("INSERT INTO verifica_credito_clienti (impianto_id, data_erogazione, importo_erogazione) VALUES (?, ?, ?)",
+                     (impianto_id, giorno, 30.0))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def conta_query(db, tipi=('SELECT',)):
+    """Sostituisce get_connection con una versione che conta le SELECT (o gli statement `tipi`) eseguite."""
+    select = []
+    get_connection = db.get_connection
+
+    def get_connection_contata():
+        conn = get_connection()
+        conn.set_trace_callback(lambda sql: select.append(sql) if sql.lstrip().upper().startswith(tipi) else None)
+        return conn
+
+    db.get_connection = get_connection_contata
+    return select
+
+
+def test_prefetch_equivale_per_giorno():
+    """Prefetch in blocco e totali aggregati in SQL: stessi risultati delle query per giorno."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root, db = crea_db_temporaneo()
+    try:
+        DataImporter(db).import_files(crea_file_sorgenti(cartella))
+        aggiungi_casi_limite(db)
+
+        select = conta_query(db)
+        per_giorno = Analyzer(db, prefetch=False).run_analysis()
+        report_per_giorno = dump_report(db)
+        query_per_giorno = len(select)
+
+        select.clear()
+        prefetch = Analyzer(db, salta_invariati=False).run_analysis()
+        assert prefetch == per_giorno
+        assert dump_report(db) == report_per_giorno
+        assert len(select) < query_per_giorno, (len(select), query_per_giorno)
+        print(f"  PASS: Prefetch analisi - {len(per_giorno)} giorni, "
+              f"{len(select)} SELECT invece di {query_per_giorno}")
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def giorni_da_ricalcolare(db):
+    conn = db.get_connection()
+    try:
+        return set(conn.execute("SELECT impianto_id, giorno FROM analisi_da_ricalcolare"))
+    finally:
+        conn.close()
+
+
+def test_analisi_incrementale_import():
+    """Giorni marcati dall'importer (AS400 allargato di ±5 giorni); l'analisi incrementale dà il report completo."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root_ok, db_ok = crea_db_temporaneo()
+    root, db = crea_db_temporaneo()
+    try:
+        fortech, as400, numia, ip_carte, ip_buoni, satispay = crea_file_sorgenti(cartella)
+        DataImporter(db_ok).import_files([fortech, as400, numia, ip_carte, ip_buoni, satispay])
+        Analyzer(db_ok).run_analysis()
+
+        DataImporter(db).import_files([fortech, ip_carte, ip_buoni])
+        assert giorni_da_ricalcolare(db) == {(1, '2026-01-13'), (1, '2026-01-14'), (2, '2026-01-15')}
+        assert len(Analyzer(db).run_analysis(solo_modificati=True)) == 3
+        assert giorni_da_ricalcolare(db) == set()
+
+        # Satispay/Numia toccano un solo giorno: solo quello viene ricalcolato
+        DataImporter(db).import_files([satispay, numia])
+        assert giorni_da_ricalcolare(db) == {(1, '2026-01-15')}
+        assert Analyzer(db).run_analysis(solo_modificati=True) == []   # nessun Fortech dell'impianto 1 quel giorno
+
+        DataImporter(db).import_files([as400])
+        giorni = giorni_da_ricalcolare(db)
+        assert (1, '2026-01-13') in giorni and (1, '2026-01-06') in giorni and len(giorni) > 11
+        # Giorni selezionati, anche se i loro input della Pass 1 non sono cambiati
+        assert len(Analyzer(db, salta_invariati=False).run_analysis(solo_modificati=True)) == 2
+        assert dump_report(db) == dump_report(db_ok)
+        print("  PASS: Analisi incrementale - giorni marcati dall'importer")
+    finally:
+        for d in (cartella, root, root_ok):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def test_analisi_incrementale_finestra_contanti():
+    """Su 60 giorni un nuovo versamento ricalcola solo i giorni vicini, con lo stesso esito di un run completo."""
+    root, db = crea_db_temporaneo()
+    try:
+        conn = db.get_connection()
+        inizio = date(2025, 11, 1)
+        for i in range(60):
+            giorno = (inizio + timedelta(days=i)).isoformat()
+            conn.execute("""
+                INSERT INTO import_fortech_master (impianto_id, codice_pv, data_contabile,
+                    incasso_contanti_teorico, incasso_carte_bancarie_teorico)
+                VALUES (1, '43809', ?, ?, 100)
+            """, (giorno + 'T00:00:00', 500 + i))
+            if i % 7 == 5:        # weekend: versamento cumulativo di sabato e domenica il lunedì
+                continue
+            importo = 500 + i + (500 + i - 1 if i % 7 == 6 else 0)
+            if i == 30:           # versamento arrivato dopo
+                continue
+            conn.execute("""
+                INSERT INTO verifica_contanti_as400 (impianto_id, data_registrazione, importo_versato, numero_registrazione)
+                VALUES (1, ?, ?, ?)
+            """, ((inizio + timedelta(days=i + 1)).isoformat() + 'T00:00:00', importo, str(i)))
+        conn.commit()
+        conn.close()
+        Analyzer(db).run_analysis()
+
+        conn = db.get_connection()
+        ultimo_id = conn.execute("SELECT MAX(id) FROM verifica_contanti_as400").fetchone()[0]
+        conn.execute("""
+            INSERT INTO verifica_contanti_as400 (impianto_id, data_registrazione, importo_versato, numero_registrazione)
+            VALUES (1, ?, 530, '30')
+        """, ((inizio + timedelta(days=31)).isoformat() + 'T00:00:00',))
+        db.mark_dirty_days(conn, 'verifica_contanti_as400', 'data_registrazione', ultimo_id, range(-5, 6))
+        conn.commit()
+        conn.close()
+
+        ricalcolati = Analyzer(db, salta_invariati=False).run_analysis(solo_modificati=True)
+        assert len(ricalcolati) == 11, len(ricalcolati)
+        incrementale = dump_report(db)
+        Analyzer(db).run_analysis()
+        assert incrementale == dump_report(db)
+        print(f"  PASS: Analisi incrementale - {len(ricalcolati)} giorni su 60 ricalcolati")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_analisi_parallela_per_impianto():
+    """Un processo per impianto, connessioni in sola lettura e un solo writer: stesso report e stesso ordine."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root, db = crea_db_temporaneo()
+    try:
+        DataImporter(db).import_files(crea_file_sorgenti(cartella))
+        aggiungi_casi_limite(db)
+        conn = db.get_connection()
+        for i in range(10):   # più giorni per entrambi gli impianti
+            giorno = (date(2026, 2, 1) + timedelta(days=i)).isoformat() + 'T00:00:00'
+            for impianto_id in (1, 2):
+                conn.execute("""
+                    INSERT INTO import_fortech_master (impianto_id, codice_pv, data_contabile, incasso_contanti_teorico)
+                    VALUES (?, 'X', ?, ?)
+                """, (impianto_id, giorno, 100 * impianto_id + i))
+            conn.execute("""
+                INSERT INTO verifica_contanti_as400 (impianto_id, data_registrazione, importo_versato, numero_registrazione)
+                VALUES (1, ?, ?, ?)
+            """, (giorno, 100 + i, f"P{i}"))
+        conn.commit()
+        conn.close()
+
+        sequenziale = Analyzer(db).run_analysis()
+        report = dump_report(db)
+        progressi = []
+        parallelo = Analyzer(db, workers=2, salta_invariati=False).run_analysis(
+            progress_callback=lambda cur, tot, msg: progressi.append((cur, tot)))
+        assert parallelo == sequenziale
+        assert dump_report(db) == report
+        assert progressi[-1] == (len(sequenziale), len(sequenziale))
+        print(f"  PASS: Analisi parallela - {len(parallelo)} giorni su 2 impianti")
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_contanti_solo_multi_giorno():
+    """Con il matching multi-giorno niente controllo contanti per giorno (né finestra AS400); categorie configurabili."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root, db = crea_db_temporaneo()
+    try:
+        DataImporter(db).import_files(crea_file_sorgenti(cartella))
+        select = conta_query(db)
+
+        risultati = Analyzer(db, prefetch=False).run_analysis()
+        finestre_as400 = [q for q in select if 'verifica_contanti_as400' in q and "'-5 days'" in q]
+        assert finestre_as400 == [], finestre_as400
+        # I contanti restituiti sono quelli del multi-giorno, salvati nel report
+        contanti = {(r[1][:10], r[3]) for r in dump_report(db) if r[2] == 'contanti'}
+        assert all('contanti' in res['risultati'] for res in risultati)
+        assert {(res['data'], res['risultati']['contanti']['differenza']) for res in risultati} <= contanti
+
+        # Controllo legacy per singolo giorno, senza Pass 2
+        select.clear()
+        legacy = Analyzer(db, prefetch=False, contanti_multi_giorno=False).run_analysis()
+        assert len([q for q in select if 'verifica_contanti_as400' in q and "'-5 days'" in q]) == len(legacy)
+        assert all(res['risultati']['contanti'].get('tipo_anomalia') is None for res in legacy)
+
+        solo_carte = Analyzer(db, categorie=['carte_bancarie', 'satispay']).run_analysis()
+        assert all(list(res['risultati']) == ['carte_bancarie', 'satispay'] for res in solo_carte)
+        print("  PASS: Contanti solo dal multi-giorno - categorie configurabili")
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_scrittura_report_a_blocchi():
+    """Report scritto a blocchi: un DELETE per impianto e un commit ogni righe_per_commit righe."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root, db = crea_db_temporaneo()
+    try:
+        DataImporter(db).import_files(crea_file_sorgenti(cartella))
+        aggiungi_casi_limite(db)
+        conn = db.get_connection()
+        for i in range(20):
+            giorno = (date(2026, 2, 1) + timedelta(days=i)).isoformat() + 'T00:00:00'
+            for impianto_id in (1, 2):
+                conn.execute("""
+                    INSERT INTO import_fortech_master (impianto_id, codice_pv, data_contabile, incasso_contanti_teorico)
+                    VALUES (?, 'X', ?, ?)
+                """, (impianto_id, giorno, 100 * impianto_id + i))
+        conn.commit()
+        conn.close()
+        impianti = 2
+
+        Analyzer(db, righe_per_commit=1).run_analysis()
+        report = dump_report(db)
+        scritture = conta_query(db, ('DELETE FROM REPORT_RICONCILIAZIONI', 'COMMIT'))
+        risultati = Analyzer(db, salta_invariati=False).run_analysis()
+        assert dump_report(db) == report   # seconda esecuzione: righe sostituite, non duplicate
+        delete = [q for q in scritture if q.lstrip().upper().startswith('DELETE')]
+        commit = [q for q in scritture if q.lstrip().upper().startswith('COMMIT')]
+        assert len(delete) == impianti, len(delete)
+        assert len(commit) <= 2, commit   # migrazione + analisi
+
+        # Un commit per impianto quando il blocco si riempie a ogni shard
+        scritture.clear()
+        Analyzer(db, righe_per_commit=1, salta_invariati=False).run_analysis()
+        assert dump_report(db) == report
+        assert len([q for q in scritture if q.lstrip().upper().startswith('COMMIT')]) >= impianti + 1
+        print(f"  PASS: Scrittura a blocchi - {len(risultati)} giorni, {len(delete)} DELETE")
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_upsert_preserva_verifica():
+    """Rianalisi in UPSERT: giorni invariati non riscritti, verifica dell'operatore e id preservati."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root, db = crea_db_temporaneo()
+    try:
+        DataImporter(db).import_files(crea_file_sorgenti(cartella))
+        Analyzer(db).run_analysis()
+        report = dump_report(db)
+        conn = db.get_connection()
+        rec_id, impianto_id, giorno = conn.execute("""
+            SELECT id, impianto_id, data_riferimento FROM report_riconciliazioni
+            WHERE categoria = 'contanti' ORDER BY id LIMIT 1
+        """).fetchone()
+        # Come /api/contanti-conferma (azione "rifiuta")
+        conn.execute("""
+            UPDATE report_riconciliazioni
+            SET risolto = 1, verificato_da = 'Simona', data_verifica = '2026-03-01 10:00:00',
+                stato = 'ANOMALIA_GRAVE', note = note || ' | SEGNALATO da Simona'
+            WHERE id = ?
+        """, (rec_id,))
+        conn.execute("UPDATE report_riconciliazioni SET data_elaborazione = '2000-01-01'")
+        conn.commit()
+        verifica = "SELECT id, risolto, verificato_da, data_verifica, stato, note FROM report_riconciliazioni WHERE id = ?"
+        prima = conn.execute(verifica, (rec_id,)).fetchone()
+
+        Analyzer(db).run_analysis()
+        assert conn.execute(verifica, (rec_id,)).fetchone() == prima
+        riscritte = conn.execute(
+            "SELECT COUNT(*) FROM report_riconciliazioni WHERE data_elaborazione != '2000-01-01'").fetchone()[0]
+        assert riscritte == 0, riscritte
+        assert len(dump_report(db)) == len(report)
+
+        # Importi cambiati: valori e stato aggiornati, verifica dell'operatore intatta
+        conn.execute("""
+            UPDATE import_fortech_master SET incasso_contanti_teorico = incasso_contanti_teorico + 1000
+            WHERE impianto_id = ? AND substr(data_contabile, 1, 10) = ?
+        """, (impianto_id, giorno))
+        conn.commit()
+        Analyzer(db).run_analysis()
+        dopo = conn.execute(verifica + " AND data_elaborazione != '2000-01-01'", (rec_id,)).fetchone()
+        assert dopo is not None and dopo[:4] == prima[:4]
+        assert dopo[5] != prima[5]   # note ricalcolate insieme agli importi
+
+        # Categorie non più calcolate: rimosse solo per i giorni riscritti
+        Analyzer(db, categorie=['carte_bancarie']).run_analysis()
+        categorie = {r[0] for r in conn.execute("SELECT DISTINCT categoria FROM report_riconciliazioni")}
+        assert categorie == {'carte_bancarie'}, categorie
+        conn.close()
+        print(f"  PASS: UPSERT report - {len(report)} righe, verifica preservata")
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_impronte_salta_invariati():
+    """Giorni con input e versione invariati saltati; TOLLERANZE o ENGINE_VERSION diverse ricalcolano tutto."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root, db = crea_db_temporaneo()
+    lieve = TOLLERANZE['carte_bancarie']['lieve']
+    engine_version = analyzer.ENGINE_VERSION
+    try:
+        DataImporter(db).import_files(crea_file_sorgenti(cartella))
+        giorni = len(Analyzer(db).run_analysis())
+        conn = db.get_connection()
+        righe = conn.execute("""
+            SELECT r.categoria, r.versione_algoritmo, r.impronta_input, r.fortech_master_id, f.id
+            FROM report_riconciliazioni r
+            JOIN import_fortech_master f
+              ON f.impianto_id = r.impianto_id AND substr(f.data_contabile, 1, 10) = r.data_riferimento
+        """).fetchall()
+        assert righe and all(r[1] == versione_algoritmo() and r[3] == r[4] for r in righe)
+        assert all((r[2] is None) == (r[0] == 'contanti') for r in righe)   # contanti dal multi-giorno
+
+        conn.execute("UPDATE report_riconciliazioni SET data_elaborazione = '2000-01-01'")
+        conn.commit()
+        invariato = Analyzer(db)
+        assert invariato.run_analysis() == [] and invariato.giorni_esaminati == giorni
+        assert conn.execute(
+            "SELECT COUNT(*) FROM report_riconciliazioni WHERE data_elaborazione != '2000-01-01'").fetchone()[0] == 0
+
+        # Nuova transazione Numia: solo quel giorno cambia impronta
+        impianto_id, giorno = conn.execute(
+            "SELECT impianto_id, data_contabile FROM import_fortech_master ORDER BY id LIMIT 1").fetchone()
+        conn.execute("INSERT INTO verifica_numia (impianto_id, data_ora_transazione, importo) VALUES (?, ?, 12.5)",
+                     (impianto_id, giorno + ' 09:00'))
+        conn.commit()
+        assert [r['data'] for r in Analyzer(db).run_analysis()] == [giorno[:10]]
+
+        # Cambia un'altra categoria dello stesso giorno: la riga satispay verificata
+        # prende la nuova impronta ma conserva stato e note dell'operatore
+        conn.execute("""
+            UPDATE report_riconciliazioni
+            SET verificato_da = 'Simona', data_verifica = '2026-03-01 10:00:00',
+                stato = 'ANOMALIA_GRAVE', note = note || ' | SEGNALATO da Simona'
+            WHERE impianto_id = ? AND data_riferimento = ? AND categoria = 'satispay'
+        """, (impianto_id, giorno[:10]))
+        conn.execute("""
+            UPDATE import_fortech_master SET incasso_carte_bancarie_teorico = incasso_carte_bancarie_teorico + 50
+            WHERE impianto_id = ? AND data_contabile = ?
+        """, (impianto_id, giorno))
+        conn.commit()
+        satispay = """
+            SELECT stato, note, verificato_da, impronta_input FROM report_riconciliazioni
+            WHERE impianto_id = ? AND data_riferimento = ? AND categoria = ?
+        """
+        prima = conn.execute(satispay, (impianto_id, giorno[:10], 'satispay')).fetchone()
+        carte = conn.execute(satispay, (impianto_id, giorno[:10], 'carte_bancarie')).fetchone()
+        assert [r['data'] for r in Analyzer(db).run_analysis()] == [giorno[:10]]
+        dopo = conn.execute(satispay, (impianto_id, giorno[:10], 'satispay')).fetchone()
+        assert dopo[:3] == prima[:3] and dopo[3] != prima[3], (prima, dopo)
+        assert conn.execute(satispay, (impianto_id, giorno[:10], 'carte_bancarie')).fetchone() != carte
+
+        # Nessun giorno marcato dall'importer, ma versione diversa: l'analisi incrementale ricalcola tutto
+        TOLLERANZE['carte_bancarie']['lieve'] = lieve + 1
+        assert len(Analyzer(db).run_analysis(solo_modificati=True)) == giorni
+        assert Analyzer(db).run_analysis(solo_modificati=True) == []
+        analyzer.ENGINE_VERSION = engine_version + 1
+        assert len(Analyzer(db).run_analysis(solo_modificati=True)) == giorni
+        conn.close()
+        print(f"  PASS: Impronte input - {giorni} giorni, invariati saltati")
+    finally:
+        TOLLERANZE['carte_bancarie']['lieve'] = lieve
+        analyzer.ENGINE_VERSION = engine_version
+        shutil.rmtree(cartella, ignore_errors=True)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("  CALOR SYSTEMS - Test Analyzer")
+    print("=" * 60)
+
+    tests = [
+        test_prefetch_equivale_per_giorno,
+        test_analisi_incrementale_import,
+        test_analisi_incrementale_finestra_contanti,
+        test_analisi_parallela_per_impianto,
+        test_contanti_solo_multi_giorno,
+        test_scrittura_report_a_blocchi,
+        test_upsert_preserva_verifica,
+        test_impronte_salta_invariati,
+    ]
+    passed = 0
+    failed = 0
+
+    for test_fn in tests:
+        try:
+            test_fn()
+            passed += 1
+        except Exception as e:
+            print(f"  FAIL: {test_fn.__name__}: {e}")
+            failed += 1
+
+    print()
+    print("=" * 60)
+    print(f"  Risultati: {passed} passati, {failed} falliti su {len(tests)} test")
+    print("=" * 60)
@@ -0,0 +1,152 @@
+"""
+Test script per il modulo di ingestione automatica (automation.data_ingestion).
+Usa gli stessi file sintetici dei test dell'importatore.
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from automation import data_ingestion
+from automation.data_ingestion import (
+    processa_file_automatico, sniff_header,
+    normalizza_importo, normalizza_importi, normalizza_data, normalizza_date,
+    estrai_codice_pv, estrai_codici_pv,
+)
+from core.parse_cache import ParseCache
+from core.sources import SOURCES
+from test_importer import crea_file_sorgenti
+
+
+def test_cache_processa_file():
+    """Secondo passaggio sullo stesso contenuto: risultato dalla cache, senza leggere l'Excel."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    dir_cache = tempfile.mkdtemp(prefix="calor_cache_")
+    originale = data_ingestion.parse_excel_intelligente
+    try:
+        as400 = crea_file_sorgenti(cartella)[1]
+        cache = ParseCache(dir_cache)
+        prima = processa_file_automatico(as400, cache=cache)
+        assert prima['fonte'] == 'AS400' and prima['parsed_count'] > 0, prima['errors']
+
+        copia = os.path.join(cartella, "copia.xlsx")
+        shutil.copy(as400, copia)
+        data_ingestion.parse_excel_intelligente = None   # un miss fallirebbe
+        dopo = processa_file_automatico(copia, cache=cache)
+
+        assert dopo['file_name'] == "copia.xlsx"
+        assert dopo['parsed_data'] == prima['parsed_data']
+        print("  PASS: Cache processa_file_automatico")
+    finally:
+        data_ingestion.parse_excel_intelligente = originale
+        for d in (cartella, dir_cache):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def test_sniff_header_una_lettura():
+    """Intestazione trovata su qualsiasi riga iniziale e un solo pd.read_excel per file."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    read_excel = data_ingestion.pd.read_excel
+    letture = []
+
+    def read_excel_contato(*args, **kwargs):
+        letture.append(kwargs.get('header'))
+        return read_excel(*args, **kwargs)
+
+    try:
+        files = crea_file_sorgenti(cartella)
+        attesi = ['FORTECH', 'AS400', 'NUMIA', 'IP_CARTE', 'IP_BUONI', 'SATISPAY']
+        header = [0, 0, 2, 1, 1, 0]
+        assert [sniff_header(f)[::2] for f in files] == list(zip(attesi, header))
+
+        data_ingestion.pd.read_excel = read_excel_contato
+        for path, fonte, riga in zip(files, attesi, header):
+            letture.clear()
+            info = processa_file_automatico(path, cache=None)
+            assert info['fonte'] == fonte and not info['errors'], info['errors']
+            assert letture == [riga], (fonte, letture)
+            if fonte != 'SATISPAY':   # nessun parser dedicato
+                assert info['parsed_count'] > 0, fonte
+            # Solo le colonne del registro, ID come testo
+            assert set(info['columns']) <= set(SOURCES[fonte].columns), info['columns']
+            if fonte == 'NUMIA':
+                assert all(isinstance(r['ID Transazione'], str) for r in info['records'])
+        print("  PASS: Sniffing intestazione - 1 lettura completa per file")
+    finally:
+        data_ingestion.pd.read_excel = read_excel
+        shutil.rmtree(cartella, ignore_errors=True)
+
+
+def test_sniff_header_file_illeggibile():
+    """.xls o file corrotto: niente eccezione dallo sniffing, fonte dal nome file."""
+    cartella = tempfile.mkdtemp(prefix="calor_xls_")
+    read_excel = data_ingestion.pd.read_excel
+    try:
+        path = Path(cartella) / "fortech_marzo.xls"
+        path.write_bytes(b"\xd0\xcf\x11\xe0 non un workbook openpyxl")
+        assert sniff_header(path) == ('UNKNOWN', 0.0, 0)
+
+        # La lettura completa (xlrd per i veri .xls) parte dalla prima riga
+        data_ingestion.pd.read_excel = lambda *args, **kwargs: pd.DataFrame({'header': [kwargs.get('header')]})
+        result, df = data_ingestion._parse_excel(path)
+        assert not result['errors'], result['errors']
+        assert (result['fonte'], result['confidence'], result['header_row']) == ('FORTECH', 0.5, 0)
+        print("  PASS: Sniffing file illeggibile - fallback sul nome file")
+    finally:
+        data_ingestion.pd.read_excel = read_excel
+        shutil.rmtree(cartella, ignore_errors=True)
+
+
+def test_normalizzazione_vettoriale():
+    """Le versioni per colonna danno lo stesso risultato delle funzioni per singolo valore."""
+    importi = pd.Series(['1.234,56', '1,234.56', '12,5', '€ 7', None, np.nan, 0, 3, 2.5,
+                         'abc', '', ' 1 234,00 ', '-1.000', True,
+                         '1_000', 'nan', 'NaN', 'inf', '+5', '1e3', '1_000,5'], dtype=object)
+    # equals(): i NaN (da 'nan' testuale) nella stessa posizione sono uguali
+    assert normalizza_importi(importi).equals(pd.Series([normalizza_importo(v) for v in importi], dtype=float))
+    numerici = pd.Series([1.5, np.nan, 3])
+    assert normalizza_importi(numerici).tolist() == [normalizza_importo(v) for v in numerici]
+
+    date = pd.Series(['2026-01-15 10:00:00', '15/01/2026', '15-01-2026', '2026/01/15', '15.01.2026',
+                      'boh', '123456789012', None, pd.Timestamp('2026-02-01 10:00'), 45000,
+                      '31/02/2026', np.nan], dtype=object)
+    assert normalizza_date(date).tolist() == [normalizza_data(v) for v in date]
+    timestamp = pd.Series(pd.to_datetime(['2026-03-01 08:00', None]))
+    assert normalizza_date(timestamp).tolist() == [normalizza_data(v) for v in timestamp]
+
+    codici = pd.Series([43809, '43809 - STAZIONE', 'X1', None, np.nan, '  7'], dtype=object)
+    assert estrai_codici_pv(codici).tolist() == [estrai_codice_pv(v) for v in codici]
+    print("  PASS: Normalizzazione vettoriale = scalare")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("  CALOR SYSTEMS - Test Ingestione Dati")
+    print("=" * 60)
+
+    tests = [
+        test_cache_processa_file,
+        test_sniff_header_una_lettura,
+        test_sniff_header_file_illeggibile,
+        test_normalizzazione_vettoriale,
+    ]
+    passed = 0
+    failed = 0
+
+    for test_fn in tests:
+        try:
+            test_fn()
+            passed += 1
+        except Exception as e:
+            print(f"  FAIL: {test_fn.__name__}: {e}")
+            failed += 1
+
+    print()
+    print("=" * 60)
+    print(f"  Risultati: {passed} passati, {failed} falliti su {len(tests)} test")
+    print("=" * 60)
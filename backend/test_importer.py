@@ -0,0 +1,835 @@
+"""
+Test script per l'importatore Excel Calor Systems.
+Genera file sintetici per ogni fonte e verifica che il percorso bulk
+(colonnare, executemany) produca le stesse righe del percorso per-riga.
+"""
+
+import sys
+import os
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import openpyxl
+import pandas as pd
+
+from core.archive import expand_uploads, iter_zip_members
+from core.database import Database
+from core import importer as importer_module
+from core.importer import DataImporter, iter_excel_chunks, _parse_file
+from core.file_classifier import FileClassifier, Classification
+from core.parse_cache import ParseCache
+from core.sources import SOURCES
+
+SCHEMA_SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "db", "calor_systems_schema.sql")
+
+TABELLE_VERIFICA = [
+    'import_fortech_master', 'verifica_contanti_as400', 'verifica_numia',
+    'verifica_ip_portal', 'verifica_satispay',
+]
+
+
+# ============================================================================
+# FIXTURE: database temporaneo e file Excel sintetici
+# ============================================================================
+
+def crea_db_temporaneo():
+    """Crea una root progetto temporanea con db/ inizializzato dallo schema."""
+    root = tempfile.mkdtemp(prefix="calor_test_")
+    os.makedirs(os.path.join(root, "db"))
+    shutil.copy(SCHEMA_SRC, os.path.join(root, "db", Database.SCHEMA_FILE))
+    db = Database(root)
+    assert db.initialize()
+    return root, db
+
+
+def scrivi_excel(path, df, righe_titolo=0, sheets=None):
+    """Scrive un DataFrame (o più fogli) con righe di intestazione extra in testa."""
+    with pd.ExcelWriter(path) as writer:
+        if sheets:
+            for name, sheet_df in sheets.items():
+                sheet_df.to_excel(writer, sheet_name=name, index=False)
+        else:
+            df.to_excel(writer, index=False, startrow=righe_titolo)
+
+
+def crea_file_sorgenti(cartella, n=20):
+    """Genera un file per ogni fonte con n righe (alcune vuote da scartare)."""
+    giorni = pd.date_range('2026-01-13', periods=3, freq='D')
+    files = []
+
+    vendite = pd.DataFrame({
+        'CodicePV': [43809, 43809, 43958],
+        'DataContabile': giorni,
+        'DataInizio': giorni - pd.Timedelta(seconds=1),
+        'DataFine': giorni + pd.Timedelta(hours=23, minutes=59, seconds=59),
+        'StatoGiornata': ['Rettificata', 'Creata', 'Creata'],
+        'Corrispettivo Totale': [5000.0, 4200.5, 3100.0],
+        'Fatture Postpagate Totale': [1500.0, 900.0, 0.0],
+        'Fatture Prepagate Totale': [500.0, 100.0, 0.0],
+        'Buoni Totale': [50.0, 0.0, 10.0],
+        'CorrispettivoVerde': [2000.0, 1800.0, 1200.0],
+    })
+    incassi = pd.DataFrame({
+        'CodicePV': [43809, 43809],
+        'DataContabile': giorni[:2],
+        'CONTANTI': [954.76, 800.0],
+        'PAGOBANCOMAT': [2000.0, 1500.0],
+        'AMEX': [450.98, 0.0],
+        'DKV': [300.0, 200.0],
+        'PAGAMENTIINNOVATIVI': [125.5, 0.0],
+        'CLIENTI CON FATTURA FINE MESE': [3000.0, 0.0],
+    })
+    path = os.path.join(cartella, "A_FILE GENERALE DA FORTECH_TEST.xlsx")
+    scrivi_excel(path, None, sheets={'Vendite': vendite, 'Incassi': incassi})
+    files.append(path)
+
+    as400 = pd.DataFrame({
+        'Stato': ['C'] * n,
+        'Documento//Data': pd.date_range('2026-01-10', periods=n, freq='D'),
+        'Documento//Tipo': ['VC'] * n,
+        'Documento//Numero': range(1000, 1000 + n),
+        'Registrazione//Data': pd.date_range('2026-01-11', periods=n, freq='D'),
+        'Registrazione//Tipo': ['RV'] * n,
+        'Registrazione//Numero': range(148000, 148000 + n),
+        'Descrizione': ['VERSAMENTO CONTANTI'] * n,
+        'Importo': [round(100 + i * 3.17, 2) for i in range(n)],
+        'Segno': ['A'] * n,
+    })
+    as400.loc[3, 'Registrazione//Data'] = pd.NaT   # riga di dettaglio da scartare
+    path = os.path.join(cartella, "1_CONTROLLO CONTANTI DA AS400_TEST.xlsx")
+    scrivi_excel(path, as400)
+    files.append(path)
+
+    numia = pd.DataFrame({
+        'Data e ora': [f"2026-01-15 {h % 24:02d}:{h % 60:02d}:00" for h in range(n)],
+        'Codice autorizzazione': [f"A{i:05d}" for i in range(n)],
+        'Numero carta': ['535400xxxxxxxxx5542'] * n,
+        'Importo': [round(10 + i * 1.01, 2) for i in range(n)],
+        'Circuito': ['MASTERCARD', 'VISA'] * (n // 2),
+        'MID': ['344506900102'] * n,
+        'ID Terminale / TML': ['40045538'] * n,
+        'ID Transazione': [str(569374765708595524 + i) for i in range(n)],
+    })
+    numia.loc[5, 'Importo'] = None
+    path = os.path.join(cartella, "2_CONTROLLO CARTE BANCARIE DA NUMIA_TEST.xlsx")
+    scrivi_excel(path, numia, righe_titolo=2)
+    files.append(path)
+
+    ip_carte = pd.DataFrame({
+        'Gestore': [181706] * n,
+        'PV': [40297, 43809] * (n // 2),
+        'Data\noperazione': ['15/01/2026'] * n,
+        'Ora\noperazione': ['10:50:00'] * n,
+        'Circuito': ['DKV'] * n,
+        'Cod. Prod.': ['G1'] * n,
+        'Quantità': [20.5] * n,
+        'Importo': [round(30 + i, 2) for i in range(n)],
+    })
+    ip_carte.loc[2, 'PV'] = None
+    path = os.path.join(cartella, "3_CONTROLLO CARTE PETROLIFERE DA IPORTAL_TEST.xlsx")
+    scrivi_excel(path, ip_carte, righe_titolo=1)
+    files.append(path)
+
+    ip_buoni = pd.DataFrame({
+        'Gestore': [181706] * n,
+        'Esercente': ['43809 - REPUBBLICA', '49999 - NUOVO'] * (n // 2),
+        'Descrizione esercente': ['Milano'] * n,
+        'Data operazione': ['15/01/2026'] * n,
+        'Importo': [50.0] * n,
+        'Pan': ['7000xxxx'] * n,
+        'Serial number': [f"SN{i}" for i in range(n)],
+    })
+    path = os.path.join(cartella, "4_CONTROLLO BUONI IP DA IPORTAL_ROSSO_TEST.xlsx")
+    scrivi_excel(path, ip_buoni, righe_titolo=1)
+    files.append(path)
+
+    satispay = pd.DataFrame({
+        'id transazione': [f"019bc3be-{i:04d}" for i in range(n)],
+        'data transazione': pd.date_range('2026-01-15 08:00:00.072', periods=n, freq='37min'),
+        'negozio': ['Repubblica'] * n,
+        'codice negozio': ['43809 - OPT1'] * n,
+        'importo totale': [round(5 + i * 0.5, 2) for i in range(n)],
+        'totale commissioni': [0.05] * n,
+        'tipo transazione': ['TO_BUSINESS'] * n,
+    })
+    path = os.path.join(cartella, "5_CONTROLLO SATISPAY DA PORTALE SATISPAY_TEST.xlsx")
+    scrivi_excel(path, satispay)
+    files.append(path)
+
+    return files
+
+
+def dump_tabelle(db):
+    """Contenuto delle tabelle di import, senza id/timestamp, in ordine stabile."""
+    conn = db.get_connection()
+    try:
+        dump = {}
+        for t in TABELLE_VERIFICA + ['impianti']:
+            cols = [r[1] for r in conn.execute(f"PRAGMA table_info({t})")
+                    if r[1] not in ('id', 'data_importazione', 'data_creazione')]
+            rows = conn.execute(f"SELECT {', '.join(cols)} FROM {t} ORDER BY id").fetchall()
+            dump[t] = rows
+        return dump
+    finally:
+        conn.close()
+
+
+# ============================================================================
+# TEST
+# ============================================================================
+
+def test_bulk_equivale_per_riga():
+    """Il percorso bulk scrive le stesse righe del percorso per-riga."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root_bulk, db_bulk = crea_db_temporaneo()
+    root_row, db_row = crea_db_temporaneo()
+    try:
+        files = crea_file_sorgenti(cartella)
+        DataImporter(db_bulk, bulk=True).import_files(files)
+        DataImporter(db_row, bulk=False).import_files(files)
+
+        bulk, row = dump_tabelle(db_bulk), dump_tabelle(db_row)
+        for t in bulk:
+            assert bulk[t] == row[t], f"{t}: bulk e per-riga divergono"
+        assert len(bulk['verifica_numia']) == 19
+        assert len(bulk['verifica_contanti_as400']) == 19
+        print("  PASS: Bulk import - righe identiche al percorso per-riga")
+    finally:
+        for d in (cartella, root_bulk, root_row):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def test_statistiche_throughput():
+    """import_stats riporta righe e righe/sec per ogni file importato."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root, db = crea_db_temporaneo()
+    try:
+        files = crea_file_sorgenti(cartella)
+        importer = DataImporter(db)
+        importer.import_files(files)
+
+        assert len(importer.import_stats) == len(files)
+        per_tipo = {s['tipo']: s for s in importer.import_stats}
+        assert per_tipo['NUMIA']['righe'] == 19
+        assert per_tipo['FORTECH']['righe'] == 3
+        assert all(s['modalita'] == 'bulk' for s in importer.import_stats)
+        print("  PASS: Statistiche throughput per file")
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_resolver_impianti_cache():
+    """Gli impianti sconosciuti vengono creati una sola volta, con contatori hit/miss."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root, db = crea_db_temporaneo()
+    try:
+        files = crea_file_sorgenti(cartella)
+        importer = DataImporter(db, bulk=False)
+        importer.import_files(files)
+
+        stats = importer.resolver.stats()
+        # 40297 (iP carte) e 49999 (iP buoni) non sono nel seed dello schema
+        assert stats['created'] == 2, stats
+        assert stats['misses'] == 2, stats
+        assert stats['hits'] > 50, stats
+
+        conn = db.get_connection()
+        codici = [r[0] for r in conn.execute("SELECT codice_pv_fortech FROM impianti ORDER BY id")]
+        conn.close()
+        assert codici == ['43809', '43958', '42840', '40297', '49999'], codici
+        print(f"  PASS: Resolver impianti - {stats['hits']} hit, {stats['created']} creati in batch")
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_parsing_parallelo():
+    """Con un pool di processi il risultato e i messaggi di progresso non cambiano."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root_seq, db_seq = crea_db_temporaneo()
+    root_par, db_par = crea_db_temporaneo()
+    try:
+        files = crea_file_sorgenti(cartella)
+        log_seq, log_par = [], []
+        DataImporter(db_seq, workers=1).import_files(
+            files, progress_callback=lambda c, t, m: log_seq.append((c, t, m)))
+        DataImporter(db_par, workers=3).import_files(
+            files, progress_callback=lambda c, t, m: log_par.append((c, t, m)))
+
+        assert dump_tabelle(db_seq) == dump_tabelle(db_par)
+        assert log_seq == log_par, log_par
+        assert log_par[-1] == (len(files), len(files), "Import complete.")
+        print(f"  PASS: Parsing parallelo (3 worker) - {len(files)} file, stesso risultato")
+    finally:
+        for d in (cartella, root_seq, root_par):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def test_import_streaming():
+    """Lettura a chunk (openpyxl read-only) -> stesse righe della lettura completa."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root_bulk, db_bulk = crea_db_temporaneo()
+    root_str, db_str = crea_db_temporaneo()
+    try:
+        files = crea_file_sorgenti(cartella)
+        DataImporter(db_bulk).import_files(files)
+        importer = DataImporter(db_str, workers=3, streaming=True, chunk_size=7)
+        importer.import_files(files)
+
+        assert dump_tabelle(db_bulk) == dump_tabelle(db_str)
+        assert all(s['righe'] > 0 for s in importer.import_stats), importer.import_stats
+
+        # Header su riga 2 (Numia) e chunk parziale finale
+        numia = [f for f in files if 'numia' in os.path.basename(f).lower()][0]
+        chunks = list(iter_excel_chunks(numia, header=2, chunk_size=7))
+        assert [len(c) for c in chunks] == [7, 7, 6], [len(c) for c in chunks]
+        assert 'Importo' in chunks[0].columns
+        print("  PASS: Import streaming - chunk da 7 righe, risultato identico")
+    finally:
+        for d in (cartella, root_bulk, root_str):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def test_deduplica_hash():
+    """Un file già importato (stesso contenuto) viene saltato e registrato in log_importazioni."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root, db = crea_db_temporaneo()
+    try:
+        files = crea_file_sorgenti(cartella)
+        DataImporter(db).import_files(files)
+        prima = dump_tabelle(db)
+
+        # Stesso contenuto con un altro nome + un file corrotto
+        copia = os.path.join(cartella, "copia_" + os.path.basename(files[0]))
+        shutil.copy(files[0], copia)
+        rotto = os.path.join(cartella, "5_SATISPAY_ROTTO.xlsx")
+        with open(rotto, 'wb') as f:
+            f.write(b"non un file excel")
+
+        importer = DataImporter(db)
+        log = []
+        importer.import_files(files + [copia, rotto], progress_callback=lambda c, t, m: log.append(m))
+
+        assert dump_tabelle(db) == prima
+        assert [s['modalita'] for s in importer.import_stats].count('duplicato') == len(files) + 1
+        assert any(m.startswith("Skipped") for m in log), log
+
+        conn = db.get_connection()
+        righe = conn.execute(
+            "SELECT nome_file, hash_file, righe_lette, righe_importate, durata_secondi, errori "
+            "FROM log_importazioni ORDER BY id"
+        ).fetchall()
+        conn.close()
+        assert len(righe) == len(files) + 1, righe
+        assert all(r[1] and len(r[1]) == 64 and r[3] > 0 and r[4] is not None and r[5] is None
+                   for r in righe[:-1])
+        assert righe[-1][0] == "5_SATISPAY_ROTTO.xlsx" and righe[-1][5]
+
+        # Il file fallito non è marcato come visto: viene ritentato
+        importer = DataImporter(db)
+        importer.import_files([rotto])
+        assert importer.import_stats == []
+        print(f"  PASS: Deduplica hash - {len(files) + 1} file saltati, errore registrato")
+    finally:
+        for d in (cartella, root):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def test_duplicati_stesso_upload():
+    """Stesso contenuto due volte nello stesso upload: con il pool il secondo non viene nemmeno parsato."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root_ok, db_ok = crea_db_temporaneo()
+    root, db = crea_db_temporaneo()
+    try:
+        files = crea_file_sorgenti(cartella)
+        DataImporter(db_ok, cache=None).import_files(files)
+        copia = os.path.join(cartella, "copia_" + os.path.basename(files[1]))
+        shutil.copy(files[1], copia)
+
+        importer = DataImporter(db, workers=2, cache=None)
+        start_pool = importer._start_pool
+        inviati = []
+
+        def start_pool_contato(*args):
+            pool = start_pool(*args)
+            submit = pool.submit
+
+            def submit_contato(fn, tipo, path, *resto):
+                inviati.append(path)
+                return submit(fn, tipo, path, *resto)
+            pool.submit = submit_contato
+            return pool
+
+        importer._start_pool = start_pool_contato
+        importer.import_files(files + [copia])
+        assert inviati == files, inviati
+        assert [s['modalita'] for s in importer.import_stats].count('duplicato') == 1
+        assert dump_tabelle(db) == dump_tabelle(db_ok)
+        print("  PASS: Duplicati nello stesso upload - un solo parsing")
+    finally:
+        for d in (cartella, root_ok, root):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def test_migrazione_log_importazioni():
+    """Un DB con il vecchio log_importazioni riceve le nuove colonne."""
+    root, db = crea_db_temporaneo()
+    try:
+        conn = db.get_connection()
+        conn.executescript("""
+            DROP TABLE log_importazioni;
+            CREATE TABLE log_importazioni (id INTEGER PRIMARY KEY AUTOINCREMENT, nome_file VARCHAR(255),
+                percorso_file TEXT, tipo_file VARCHAR(50), data_importazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                righe_lette INTEGER, righe_importate INTEGER, righe_errore INTEGER, errori TEXT, note TEXT);
+        """)
+        db.ensure_log_importazioni(conn)
+        colonne = {r[1] for r in conn.execute("PRAGMA table_info(log_importazioni)")}
+        conn.close()
+        assert {'hash_file', 'dimensione_byte', 'durata_secondi'} <= colonne
+        print("  PASS: Migrazione log_importazioni")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_chiavi_naturali_file_sovrapposti():
+    """File diversi con transazioni in comune: inserite solo le righe nuove."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root_row, db_row = crea_db_temporaneo()
+    root_bulk, db_bulk = crea_db_temporaneo()
+    try:
+        files = crea_file_sorgenti(cartella)
+        as400, numia, satispay = files[1], files[2], files[5]
+
+        # Finestre successive: metà righe già viste, metà nuove
+        sovrapposti = []
+        for path, header, chiave in ((numia, 2, 'ID Transazione'), (satispay, 0, 'id transazione')):
+            df = pd.read_excel(path, header=header)
+            df[chiave] = df[chiave].astype(str)   # anche testo vs numero deve combaciare
+            df = pd.concat([df.iloc[10:], df.iloc[10:].assign(**{chiave: df[chiave] + "-NEW"})])
+            nuovo = os.path.join(cartella, "bis_" + os.path.basename(path))
+            scrivi_excel(nuovo, df, righe_titolo=header)
+            sovrapposti.append(nuovo)
+
+        # AS400 con una riga senza numero: la colonna diventa float (148010.0)
+        df = pd.read_excel(as400)
+        df.loc[0, 'Registrazione//Numero'] = None
+        nuovo = os.path.join(cartella, "bis_" + os.path.basename(as400))
+        scrivi_excel(nuovo, df)
+        sovrapposti.append(nuovo)
+
+        for db, bulk in ((db_row, False), (db_bulk, True)):
+            DataImporter(db, bulk=bulk).import_files([as400, numia, satispay])
+            importer = DataImporter(db, bulk=bulk)
+            importer.import_files(sovrapposti)
+            stats = {s['tipo']: (s['righe'], s['duplicate']) for s in importer.import_stats}
+            assert stats == {'NUMIA': (10, 10), 'SATISPAY': (10, 10), 'AS400': (1, 18)}, stats
+
+        assert dump_tabelle(db_row) == dump_tabelle(db_bulk)
+        conn = db_bulk.get_connection()
+        dup = conn.execute("SELECT righe_importate, righe_duplicate FROM log_importazioni "
+                           "WHERE tipo_file = 'NUMIA' ORDER BY id").fetchall()
+        conn.close()
+        assert dup == [(19, 0), (10, 10)], dup
+        print("  PASS: Chiavi naturali - righe duplicate ignorate e contate")
+    finally:
+        for d in (cartella, root_row, root_bulk):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def test_migrazione_chiavi_naturali():
+    """Un DB esistente con duplicati: restano le prime righe e nasce l'indice univoco."""
+    root, db = crea_db_temporaneo()
+    try:
+        conn = db.get_connection()
+        conn.execute("DROP INDEX uq_numia_transazione")
+        conn.executemany("INSERT INTO verifica_numia (id_transazione_numia, importo) VALUES (?, ?)",
+                         [('T1', 1.0), ('T1', 2.0), ('T2', 3.0), (None, 4.0), (None, 5.0)])
+        conn.commit()
+        db.migrate(conn)
+        righe = conn.execute("SELECT id_transazione_numia, importo FROM verifica_numia ORDER BY id").fetchall()
+        conn.close()
+        assert righe == [('T1', 1.0), ('T2', 3.0), (None, 4.0), (None, 5.0)], righe
+        print("  PASS: Migrazione chiavi naturali")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_fortech_join_date_normalizzate():
+    """Incassi con date testuali e righe ripetute si agganciano alle Vendite con Timestamp."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    try:
+        giorni = pd.date_range('2026-01-13', periods=3, freq='D')
+        vendite = pd.DataFrame({
+            'CodicePV': [43809, 43809, 43958],
+            'DataContabile': giorni,
+            'Corrispettivo Totale': [5000.0, 4200.5, 3100.0],
+        })
+        incassi = pd.DataFrame({
+            'CodicePV': ['43809', 43809, 43809, 43958],
+            'DataContabile': ['13/01/2026', '2026-01-14', '2026-01-14', '2026-01-15 00:00:00'],
+            'CONTANTI': [954.76, 800.0, 100.0, 50.0],
+            'PAGOBANCOMAT': [2000.0, None, 1500.0, 10.0],
+            'DKV': [300.0, 200.0, None, None],
+        })
+        path = os.path.join(cartella, "A_FILE GENERALE DA FORTECH_TEST.xlsx")
+        scrivi_excel(path, None, sheets={'Vendite': vendite, 'Incassi': incassi})
+
+        batch = _parse_file('FORTECH', path)
+        righe = [dict(zip(batch.columns, r)) for r in batch.rows]
+        teorici = [(r['codice_pv'], r['incasso_contanti_teorico'], r['incasso_carte_bancarie_teorico'],
+                    r['incasso_carte_petrolifere_teorico']) for r in righe]
+        assert teorici == [('43809', 954.76, 2000.0, 300.0),
+                           ('43809', 900.0, 1500.0, 200.0),
+                           ('43958', 50.0, 10.0, 0.0)], teorici
+        print("  PASS: Fortech join Incassi/Vendite su date normalizzate")
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+
+
+def test_cache_parsing():
+    """Secondo import degli stessi file: fogli riletti dalla cache, stesso risultato."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    dir_cache = tempfile.mkdtemp(prefix="calor_cache_")
+    root_a, db_a = crea_db_temporaneo()
+    root_b, db_b = crea_db_temporaneo()
+    parsers = DataImporter.PARSERS
+    try:
+        files = crea_file_sorgenti(cartella)
+        cache = ParseCache(dir_cache)
+        DataImporter(db_a, cache=cache).import_files(files)
+        assert len(os.listdir(dir_cache)) == len(files)
+
+        # Stesso contenuto, altro nome: file_origine segue il nuovo nome
+        rinominati = []
+        for path in files:
+            nuovo = os.path.join(cartella, "R_" + os.path.basename(path))
+            shutil.copy(path, nuovo)
+            rinominati.append(nuovo)
+
+        DataImporter.PARSERS = {}   # ogni miss fallirebbe
+        importer = DataImporter(db_b, cache=cache)
+        importer.import_files(rinominati)
+        DataImporter.PARSERS = parsers
+
+        assert [s['modalita'] for s in importer.import_stats] == ['bulk'] * len(files)
+        rinomina = lambda righe: [tuple(v.replace("R_", "", 1) if isinstance(v, str) else v for v in r)
+                                  for r in righe]
+        dump_b = {t: rinomina(r) for t, r in dump_tabelle(db_b).items()}
+        assert dump_b == dump_tabelle(db_a)
+
+        # Eviction per dimensione, versione diversa = miss, voce corrotta = miss, svuotamento
+        assert ParseCache(dir_cache, max_mb=0).evict() == len(files) and cache.size() == 0
+        cache.save("abc", "AS400", 1, {"x": 1})
+        assert cache.load("abc", "AS400", 1) == {"x": 1} and cache.load("abc", "AS400", 2) is None
+        with open(cache._path("abc", "AS400", 1), 'wb') as f:
+            f.write(b"troncato")
+        assert cache.load("abc", "AS400", 1) is None and os.listdir(dir_cache) == []
+        cache.save("abc", "AS400", 1, {"x": 1})
+        assert cache.clear() == 1 and os.listdir(dir_cache) == []
+        print(f"  PASS: Cache parsing - {len(files)} fogli riletti senza parsing")
+    finally:
+        DataImporter.PARSERS = parsers
+        for d in (cartella, dir_cache, root_a, root_b):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def test_registro_fonti():
+    """Registro core.sources: classificazione da nome file e sola lettura delle colonne note."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    try:
+        files = crea_file_sorgenti(cartella)
+        classificati = FileClassifier.classify_files(files + ["report.xlsx", "estratto AZZURRO.xlsx"])
+        assert [len(v) for v in classificati.values()] == [1, 1, 1, 2, 1, 1, 1], classificati
+        assert FileClassifier.validate_group(classificati) == ([], True)
+
+        # Colonne extra (foglio largo) scartate, codici letti come testo
+        df = pd.read_excel(files[3], header=1)
+        for i in range(30):
+            df[f"Extra {i}"] = "x"
+        largo = os.path.join(cartella, "largo.xlsx")
+        scrivi_excel(largo, df, righe_titolo=1)
+        letto = SOURCES['IP_CARTE'].read(largo)
+        assert set(letto.columns) <= set(SOURCES['IP_CARTE'].columns)
+        assert letto['PV'].dropna().tolist()[:2] == ['40297', '43809'], letto['PV'].head()
+        print("  PASS: Registro fonti - classificazione e proiezione colonne")
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+
+
+def test_transazione_unica_savepoint():
+    """Un file che fallisce a metà scrittura torna al suo savepoint; un batch interrotto non lascia nulla."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root_ok, db_ok = crea_db_temporaneo()
+    root, db = crea_db_temporaneo()
+    try:
+        files = crea_file_sorgenti(cartella)
+        DataImporter(db_ok).import_files([f for f in files if "AS400" not in f])
+
+        # AS400 fallisce dopo aver già scritto le sue righe
+        importer = DataImporter(db)
+        scrivi = importer._write_batch
+
+        def scrivi_e_fallisci(conn, batch):
+            righe = scrivi(conn, batch)
+            if batch.tipo == 'AS400':
+                raise RuntimeError("disco pieno")
+            return righe
+
+        importer._write_batch = scrivi_e_fallisci
+        importer.import_files(files)
+        assert dump_tabelle(db) == dump_tabelle(db_ok)
+        conn = db.get_connection()
+        errori = conn.execute("SELECT tipo_file, errori FROM log_importazioni WHERE errori IS NOT NULL").fetchall()
+        conn.close()
+        assert errori == [('AS400', 'disco pieno')], errori
+
+        # Interruzione durante il batch: rollback di tutti i file
+        root_vuoto, db_vuoto = crea_db_temporaneo()
+        try:
+            iniziale = dump_tabelle(db_vuoto)
+
+            def interrompi(corrente, totale, messaggio):
+                if corrente == 3:
+                    raise KeyboardInterrupt
+            try:
+                DataImporter(db_vuoto).import_files(files, progress_callback=interrompi)
+                assert False, "KeyboardInterrupt atteso"
+            except KeyboardInterrupt:
+                pass
+            conn = db_vuoto.get_connection()
+            assert conn.execute("SELECT COUNT(*) FROM log_importazioni").fetchone()[0] == 0
+            conn.close()
+            assert dump_tabelle(db_vuoto) == iniziale
+        finally:
+            shutil.rmtree(root_vuoto, ignore_errors=True)
+
+        # Profilo PRAGMA bulk solo dentro bulk_load()
+        conn = db.get_connection()
+        prima = conn.execute("PRAGMA synchronous").fetchone()[0]
+        with db.bulk_load(conn):
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+            assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == prima
+        conn.close()
+        print("  PASS: Transazione unica - savepoint per file, batch interrotto annullato")
+    finally:
+        for d in (cartella, root_ok, root):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def test_scrittore_concorrente_durante_parsing():
+    """Un altro import che fa commit mentre il batch è in parsing: impianti e hash riletti sotto il lock di scrittura."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root_ok, db_ok = crea_db_temporaneo()
+    root, db = crea_db_temporaneo()
+    try:
+        files = crea_file_sorgenti(cartella)
+        DataImporter(db_ok).import_files(files)
+
+        def arrivi():
+            yield files[0]
+            # Stesso Fortech importato da un altro processo (crea anche gli impianti)
+            DataImporter(db).import_files([files[0]])
+            yield from files[1:]
+
+        importer = DataImporter(db)
+        importer.import_files(arrivi())
+        assert len(importer.import_stats) == len(files), importer.import_stats
+        assert importer.import_stats[0]['modalita'] == 'duplicato'
+        assert dump_tabelle(db) == dump_tabelle(db_ok)
+        print("  PASS: Scrittore concorrente - nessun impianto o file duplicato")
+    finally:
+        for d in (cartella, root_ok, root):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def test_parsing_fuori_dal_lock():
+    """Il parsing avviene prima di BEGIN IMMEDIATE: un altro writer non resta bloccato durante il parsing."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root, db = crea_db_temporaneo()
+    parse_file = importer_module._parse_file
+    scritture = []
+
+    def parse_e_scrivi(*args):
+        altra = sqlite3.connect(db.db_path, timeout=0.5)
+        try:
+            altra.execute("UPDATE impianti SET nome_impianto = nome_impianto")
+            altra.commit()
+            scritture.append(True)
+        except sqlite3.OperationalError as e:
+            scritture.append(str(e))
+        finally:
+            altra.close()
+        return parse_file(*args)
+
+    try:
+        files = crea_file_sorgenti(cartella)
+        importer_module._parse_file = parse_e_scrivi
+        importer = DataImporter(db, cache=None)
+        importer.import_files(files)
+        assert scritture and all(r is True for r in scritture), scritture
+        assert len(importer.import_stats) == len(files)
+        print(f"  PASS: Parsing fuori dal lock - {len(scritture)} scritture concorrenti riuscite")
+    finally:
+        importer_module._parse_file = parse_file
+        shutil.rmtree(cartella, ignore_errors=True)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_classificazione_da_contenuto():
+    """Fonte e riga di intestazione dal contenuto; il nome file decide solo a parità o se illeggibile."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    try:
+        files = crea_file_sorgenti(cartella)
+        attesi = [('FORTECH', 0), ('AS400', 0), ('NUMIA', 2), ('IP_CARTE', 1), ('IP_BUONI', 1), ('SATISPAY', 0)]
+
+        # Nomi senza parole chiave o fuorvianti
+        rinominati = []
+        for i, f in enumerate(files):
+            nome = os.path.join(cartella, f"export_{i}.xlsx" if i % 2 else f"{i}_SATISPAY_export.xlsx")
+            shutil.copy(f, nome)
+            rinominati.append(nome)
+        dettagli = {}
+        classificati = FileClassifier.classify_files(rinominati, details=dettagli)
+        assert [(dettagli[f].source, dettagli[f].header_row) for f in rinominati] == attesi
+        assert all(dettagli[f].by == "content" for f in rinominati)
+        assert FileClassifier.validate_group(classificati) == ([], True)
+
+        # Intestazione che soddisfa due firme: vince il nome file
+        ambiguo = pd.DataFrame(columns=list(SOURCES['AS400'].signature) + list(SOURCES['SATISPAY'].signature))
+        for nome, fonte in (("ambiguo.xlsx", 'AS400'), ("ambiguo SATISPAY.xlsx", 'SATISPAY')):
+            path = os.path.join(cartella, nome)
+            scrivi_excel(path, ambiguo)
+            assert FileClassifier.classify_file(path).source == fonte, nome
+
+        # Contenuto illeggibile: solo il nome file
+        rotto = os.path.join(cartella, "NUMIA rotto.xlsx")
+        with open(rotto, 'wb') as f:
+            f.write(b"non un file excel")
+        assert FileClassifier.classify_file(rotto) == Classification('NUMIA', 2, 0.0, "filename")
+        assert FileClassifier.classify_file(os.path.join(cartella, "x.xls")).source == "UNKNOWN"
+        print("  PASS: Classificazione da contenuto - fonte e riga intestazione")
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+
+
+def test_intestazione_spostata():
+    """Righe in più sopra l'intestazione: il file è letto alla riga trovata dal classificatore, in ogni modalità."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    spostati = os.path.join(cartella, "spostati")
+    os.mkdir(spostati)
+    root_ok, db_ok = crea_db_temporaneo()
+    try:
+        files = crea_file_sorgenti(cartella)
+        DataImporter(db_ok, cache=None).import_files(files)
+        copie = []
+        for f in files:
+            wb = openpyxl.load_workbook(f)
+            ws = wb.worksheets[0]
+            ws.insert_rows(1, 2)
+            ws['A1'] = "Report esportato"
+            copia = os.path.join(spostati, os.path.basename(f))
+            wb.save(copia)
+            copie.append(copia)
+        assert FileClassifier.classify_file(copie[2]).header_row == 4   # Numia: 2 + 2
+
+        for opzioni in ({}, {'workers': 2}, {'streaming': True}, {'bulk': False}):
+            root, db = crea_db_temporaneo()
+            try:
+                DataImporter(db, cache=None, **opzioni).import_files(copie)
+                assert dump_tabelle(db) == dump_tabelle(db_ok), opzioni
+            finally:
+                shutil.rmtree(root, ignore_errors=True)
+        print("  PASS: Intestazione spostata - riga del classificatore usata dal parsing")
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+        shutil.rmtree(root_ok, ignore_errors=True)
+
+
+def test_import_zip():
+    """Archivio ZIP: membri estratti uno alla volta e importati come i file singoli."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    estratti = tempfile.mkdtemp(prefix="calor_zip_")
+    root_a, db_a = crea_db_temporaneo()
+    root_b, db_b = crea_db_temporaneo()
+    try:
+        files = crea_file_sorgenti(cartella)
+        archivio = os.path.join(cartella, "mese.zip")
+        with zipfile.ZipFile(archivio, 'w') as zf:
+            for i, f in enumerate(files[1:]):
+                zf.write(f, f"cartella_{i % 2}/{os.path.basename(f)}")
+            zf.writestr("../fuori.txt", "ignorato")
+            zf.writestr("__MACOSX/._x.xlsx", "metadati")
+
+        # Estrazione pigra: un membro su disco per ogni elemento restituito
+        membri = iter_zip_members(archivio, estratti)
+        primo = next(membri)
+        assert os.listdir(estratti) == [os.path.basename(primo)]
+        membri.close()
+        shutil.rmtree(estratti)
+        os.makedirs(estratti)
+
+        DataImporter(db_a).import_files(files)
+        importer = DataImporter(db_b, workers=2)
+        ricevuti = importer.import_files(expand_uploads([files[0], archivio], estratti))
+        assert len(ricevuti) == len(files)
+        assert all(os.path.dirname(p) == estratti for p in ricevuti[1:])
+        assert dump_tabelle(db_b) == dump_tabelle(db_a)
+
+        try:
+            list(iter_zip_members(archivio, estratti, max_mb=0))
+            assert False, "limite di estrazione non applicato"
+        except ValueError:
+            pass
+        print(f"  PASS: Import ZIP - {len(ricevuti)} file, estrazione a flusso")
+    finally:
+        for d in (cartella, estratti, root_a, root_b):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("  CALOR SYSTEMS - Test Importatore")
+    print("=" * 60)
+
+    tests = [
+        test_bulk_equivale_per_riga,
+        test_statistiche_throughput,
+        test_resolver_impianti_cache,
+        test_parsing_parallelo,
+        test_import_streaming,
+        test_deduplica_hash,
+        test_duplicati_stesso_upload,
+        test_migrazione_log_importazioni,
+        test_chiavi_naturali_file_sovrapposti,
+        test_migrazione_chiavi_naturali,
+        test_fortech_join_date_normalizzate,
+        test_cache_parsing,
+        test_registro_fonti,
+        test_transazione_unica_savepoint,
+        test_scrittore_concorrente_durante_parsing,
+        test_parsing_fuori_dal_lock,
+        test_classificazione_da_contenuto,
+        test_intestazione_spostata,
+        test_import_zip,
+    ]
+    passed = 0
+    failed = 0
+
+    for test_fn in tests:
+        try:
+            test_fn()
+            passed += 1
+        except Exception as e:
+            print(f"  FAIL: {test_fn.__name__}: {e}")
+            failed += 1
+
+    print()
+    print("=" * 60)
+    print(f"  Risultati: {passed} passati, {failed} falliti su {len(tests)} test")
+    print("=" * 60)
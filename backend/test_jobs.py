@@ -0,0 +1,172 @@
+"""
+Test script per la coda dei job di importazione + analisi (core.jobs).
+Usa gli stessi file sintetici dei test dell'importatore.
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from core.importer import DataImporter
+from core.jobs import JobQueue, IN_CORSO, MAX_LOG, _Avanzamento
+from test_importer import crea_db_temporaneo, crea_file_sorgenti, dump_tabelle
+
+
+def attendi_job(queue, job_id, timeout=30):
+    fine = time.monotonic() + timeout
+    while time.monotonic() < fine:
+        stato = queue.stato(job_id)
+        if stato['stato'] in ('completato', 'errore'):
+            return stato
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} non terminato: {queue.stato(job_id)}")
+
+
+def test_coda_job_in_background():
+    """Job eseguito dal pool: stato persistito con fase, progresso, throughput e log."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root_ok, db_ok = crea_db_temporaneo()
+    root, db = crea_db_temporaneo()
+    queue = JobQueue(db, workers=2, poll_seconds=0.1)
+    try:
+        files = crea_file_sorgenti(cartella)
+        DataImporter(db_ok).import_files(files)
+
+        cartella_job = queue.nuova_cartella()
+        copie = [shutil.copy(f, cartella_job) for f in files]
+        job_id = queue.submit(copie, cartella_job)
+        assert queue.stato(job_id)['stato'] == 'in_coda'
+
+        queue.start()
+        stato = attendi_job(queue, job_id)
+        assert stato['stato'] == 'completato', stato['errori']
+        assert stato['progresso'] == 1.0 and stato['fase'] == 'Completato'
+        assert stato['righe'] > 0 and stato['righe_sec'] > 0
+        assert stato['risultato']['files_imported'] == len(files) and stato['risultato']['days_analyzed'] > 0
+        assert stato['risultato']['days_skipped'] == 0
+        assert any(m.startswith("Importing") for m in stato['logs']), stato['logs']
+        assert not os.path.exists(cartella_job)
+
+        # File inesistente: job in errore, il pool continua
+        rotto = queue.submit([os.path.join(cartella, "SATISPAY_sparito.xlsx")])
+        stato = attendi_job(queue, rotto)
+        assert stato['stato'] == 'errore' and stato['errori']
+        assert dump_tabelle(db) == dump_tabelle(db_ok)
+        assert queue.stato("inesistente") is None
+        print("  PASS: Coda job - esecuzione in background e stato persistito")
+    finally:
+        queue.stop(timeout=5)
+        for d in (cartella, root_ok, root):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def test_ripresa_job_orfani():
+    """Un job rimasto in_corso per un processo morto viene ripreso da un'altra coda."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root, db = crea_db_temporaneo()
+    try:
+        files = crea_file_sorgenti(cartella)
+        queue = JobQueue(db)
+        job_id = queue.submit(files)
+        assert queue._prendi_job() == job_id
+        assert queue._prendi_job() is None          # già in corso, non orfano
+
+        conn = queue._connetti()
+        conn.execute("UPDATE job_elaborazione SET data_aggiornamento = '2000-01-01T00:00:00' WHERE id = ?", (job_id,))
+        conn.commit()
+        conn.close()
+
+        altra = JobQueue(db)
+        assert altra._prendi_job() == job_id
+        assert altra.stato(job_id)['stato'] == IN_CORSO
+        assert altra.esegui(job_id)['stato'] == 'completato'
+        print("  PASS: Coda job - ripresa dei job orfani")
+    finally:
+        for d in (cartella, root):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def test_heartbeat_job_lungo():
+    """Un passo lungo senza progressi non rende orfano il job: il heartbeat aggiorna data_aggiornamento."""
+    root, db = crea_db_temporaneo()
+    try:
+        queue = JobQueue(db)
+        queue.INTERVALLO_HEARTBEAT = 0.05
+        job_id = queue.submit([])
+        assert queue._prendi_job() == job_id
+        altra = JobQueue(db)
+        ripreso = []
+
+        def passo_lungo(file_paths, cartella, report):
+            conn = queue._connetti()
+            conn.execute("UPDATE job_elaborazione SET data_aggiornamento = '2000-01-01T00:00:00' WHERE id = ?",
+                         (job_id,))
+            conn.commit()
+            conn.close()
+            time.sleep(0.3)
+            ripreso.append(altra._prendi_job())
+            return {}
+
+        queue._importa_e_analizza = passo_lungo
+        assert queue.esegui(job_id)['stato'] == 'completato'
+        assert ripreso == [None]
+        print("  PASS: Coda job - heartbeat durante un passo lungo")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_log_troncato_posizione():
+    """Log oltre MAX_LOG tagliato in testa: log_inizio dice da che riga riparte (anche su calor_jobs.db vecchi)."""
+    root, db = crea_db_temporaneo()
+    try:
+        queue = JobQueue(db)
+        conn = queue._connetti()
+        conn.execute("ALTER TABLE job_elaborazione DROP COLUMN log_scartati")
+        conn.commit()
+        conn.close()
+        queue = JobQueue(db)
+        job_id = queue.submit([])
+        assert queue.stato(job_id)['log_inizio'] == 0
+
+        conn = queue._connetti()
+        report = _Avanzamento(conn, job_id, intervallo=0)
+        for i in range(MAX_LOG + 10):
+            report.aggiorna('Importazione', 0.0, f"riga {i}")
+        conn.close()
+        stato = queue.stato(job_id)
+        assert stato['log_inizio'] == 10 and len(stato['logs']) == MAX_LOG
+        assert stato['logs'][0] == "riga 10"
+        print("  PASS: Coda job - posizione del log troncato")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("  CALOR SYSTEMS - Test Coda Job")
+    print("=" * 60)
+
+    tests = [
+        test_coda_job_in_background,
+        test_ripresa_job_orfani,
+        test_heartbeat_job_lungo,
+        test_log_troncato_posizione,
+    ]
+    passed = 0
+    failed = 0
+
+    for test_fn in tests:
+        try:
+            test_fn()
+            passed += 1
+        except Exception as e:
+            print(f"  FAIL: {test_fn.__name__}: {e}")
+            failed += 1
+
+    print()
+    print("=" * 60)
+    print(f"  Risultati: {passed} passati, {failed} falliti su {len(tests)} test")
+    print("=" * 60)
@@ -139,6 +139,32 @@ def test_giornata_completa():
     print("\n  PASS: Giornata completa - tutte le 5 categorie presenti!")
 
 
+def test_giornata_totali_aggregati():
+    """Totali già aggregati (GROUP BY in SQL) al posto dei record: stesso risultato"""
+    fortech_data = {
+        'data_contabile': '2026-01-15',
+        'incasso_contanti_teorico': 954.76,
+        'incasso_carte_bancarie_teorico': 2450.98,
+        'fatture_postpagate_totale': 1500.0,
+        'fatture_prepagate_totale': 500.0,
+        'incasso_satispay_teorico': 125.50,
+        'incasso_credito_finemese_teorico': 3000.0,
+    }
+    as400_records = [{'data_registrazione': '2026-01-15', 'importo_versato': 955.0}]
+
+    da_record = riconcilia_giornata(
+        fortech_data, as400_records,
+        [{'importo': 2000.0}, {'importo': 450.98}, {'importo': None}],
+        [{'importo': 1500.0}], [],
+        [{'importo_totale': 125.50}], [{'importo_erogazione': 2900.0}]
+    )
+    da_totali = riconcilia_giornata(fortech_data, as400_records, 2450.98, 1500.0, 0.0, 125.50, 2900.0)
+
+    assert da_totali == da_record
+    assert da_totali['risultati']['crediti']['differenza'] == 100.0
+    print("  PASS: Giornata - totali aggregati = somma dei record")
+
+
 # ============================================================================
 # TEST MULTI-GIORNO: VERSAMENTI CUMULATIVI
 # ============================================================================
@@ -298,6 +324,7 @@ if __name__ == "__main__":
         test_crediti_fattura1click,
         test_carte_petrolifere_aggregazione,
         test_giornata_completa,
+        test_giornata_totali_aggregati,
     ]
     
     print("\n--- Test Multi-Giorno (Versamenti Cumulativi) ---")
@@ -0,0 +1,158 @@
+"""
+Test script per l'upload a blocchi riprendibile del server web
+(/api/upload/precheck, /api/upload/chunk, /api/upload/finalize).
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from werkzeug.utils import secure_filename
+
+import server
+from core.importer import DataImporter
+from core.parse_cache import file_hash
+from test_importer import crea_db_temporaneo, crea_file_sorgenti, dump_tabelle
+
+
+def _configura_server(root, db):
+    """Punta il server al DB temporaneo; restituisce i valori originali."""
+    originali = (server.PROJECT_ROOT, server.DB_PATH, server.UPLOAD_STAGING_DIR,
+                 server.ASYNC_JOBS, server._JOB_QUEUE)
+    server.PROJECT_ROOT = root
+    server.DB_PATH = str(db.db_path)
+    server.UPLOAD_STAGING_DIR = os.path.join(root, "db", "upload_staging")
+    # Job eseguito dentro la richiesta: la risposta contiene già il risultato
+    server.ASYNC_JOBS = False
+    server._JOB_QUEUE = None
+    return originali
+
+
+def test_upload_a_blocchi_riprendibile():
+    """Upload interrotto ripreso dall'offset del server; file già importati non vengono ricaricati."""
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root_ok, db_ok = crea_db_temporaneo()
+    root, db = crea_db_temporaneo()
+    originali = _configura_server(root, db)
+    client = server.app.test_client()
+    try:
+        files = crea_file_sorgenti(cartella)
+        # Riferimento con i nomi normalizzati dal server (file_origine)
+        riferimento = [os.path.join(cartella, secure_filename(os.path.basename(f))) for f in files]
+        for f, r in zip(files, riferimento):
+            shutil.copy(f, r)
+        DataImporter(db_ok).import_files(riferimento)
+
+        voci = [{"name": os.path.basename(f), "size": os.path.getsize(f), "hash": file_hash(f)} for f in files]
+        risposta = client.post("/api/upload/precheck", json={"files": voci}).get_json()
+        assert [v["status"] for v in risposta["files"]] == ["missing"] * len(files)
+
+        # Primo file: metà inviata, poi "interruzione"
+        with open(files[0], 'rb') as f:
+            dati = f.read()
+        meta = len(dati) // 2
+        url = f"/api/upload/chunk/{voci[0]['hash']}?size={len(dati)}"
+        r = client.put(url + "&offset=0", data=dati[:meta])
+        assert r.get_json() == {"offset": meta, "complete": False}
+        stato = client.post("/api/upload/precheck", json={"files": voci[:1]}).get_json()["files"][0]
+        assert stato["status"] == "partial" and stato["offset"] == meta
+
+        # Blocco ripetuto: 409 con l'offset corretto, poi ripresa
+        r = client.put(url + "&offset=0", data=dati[:meta])
+        assert r.status_code == 409 and r.get_json()["offset"] == meta
+        r = client.put(url + f"&offset={meta}", data=dati[meta:])
+        assert r.get_json() == {"offset": len(dati), "complete": True}
+
+        # Hash errato: file scartato
+        r = client.put(f"/api/upload/chunk/{'0' * 64}?offset=0&size=3", data=b"abc")
+        assert r.status_code == 422
+
+        # Finalize prima di avere tutti i file: 409 con l'elenco dei mancanti
+        r = client.post("/api/upload/finalize", json={"files": voci})
+        assert r.status_code == 409 and len(r.get_json()["missing"]) == len(files) - 1
+
+        for voce, path in zip(voci[1:], files[1:]):
+            with open(path, 'rb') as f:
+                dati = f.read()
+            size = len(dati)
+            for offset in range(0, size, 4096):
+                r = client.put(f"/api/upload/chunk/{voce['hash']}?offset={offset}&size={size}",
+                               data=dati[offset:offset + 4096])
+            assert r.get_json()["complete"]
+
+        r = client.post("/api/upload/finalize", json={"files": voci})
+        assert r.status_code == 200, r.get_json()
+        assert r.get_json()["stato"] == "completato" and r.get_json()["files_imported"] == len(files)
+        assert client.get(r.get_json()["status_url"]).get_json()["risultato"]["files_imported"] == len(files)
+        assert dump_tabelle(db) == dump_tabelle(db_ok)
+        assert os.listdir(server.UPLOAD_STAGING_DIR) == []
+
+        # Secondo giro: tutto già importato, nessun byte da inviare
+        risposta = client.post("/api/upload/precheck", json={"files": voci}).get_json()
+        assert [v["status"] for v in risposta["files"]] == ["imported"] * len(files)
+        assert client.post("/api/upload/finalize", json={"files": voci}).get_json()["files_imported"] == 0
+        print("  PASS: Upload a blocchi - ripresa, verifica hash, finalize")
+    finally:
+        (server.PROJECT_ROOT, server.DB_PATH, server.UPLOAD_STAGING_DIR,
+         server.ASYNC_JOBS, server._JOB_QUEUE) = originali
+        for d in (cartella, root_ok, root):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def test_upload_lock_tra_processi():
+    """Il chunk attende il lock di staging anche se lo tiene un altro processo (flock)."""
+    if server.fcntl is None:
+        print("  SKIP: Lock di staging tra processi - fcntl non disponibile")
+        return
+    import fcntl
+    import threading
+    root, db = crea_db_temporaneo()
+    originali = _configura_server(root, db)
+    client = server.app.test_client()
+    try:
+        os.makedirs(server.UPLOAD_STAGING_DIR, exist_ok=True)
+        dati = b"contenuto di prova"
+        url = f"/api/upload/chunk/{'a' * 64}?offset=0&size={len(dati) * 2}"
+        risposte = []
+        # Descrittore aperto a parte: per flock vale come un altro processo
+        with open(server.UPLOAD_STAGING_DIR + ".lock", 'a') as altro:
+            fcntl.flock(altro, fcntl.LOCK_EX)
+            t = threading.Thread(target=lambda: risposte.append(client.put(url, data=dati)))
+            t.start()
+            t.join(0.5)
+            assert t.is_alive() and not risposte
+        t.join(10)
+        assert risposte[0].get_json() == {"offset": len(dati), "complete": False}
+        print("  PASS: Lock di staging tra processi - chunk in attesa del flock")
+    finally:
+        (server.PROJECT_ROOT, server.DB_PATH, server.UPLOAD_STAGING_DIR,
+         server.ASYNC_JOBS, server._JOB_QUEUE) = originali
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("  CALOR SYSTEMS - Test Upload a Blocchi")
+    print("=" * 60)
+
+    tests = [
+        test_upload_a_blocchi_riprendibile,
+        test_upload_lock_tra_processi,
+    ]
+    passed = 0
+    failed = 0
+
+    for test_fn in tests:
+        try:
+            test_fn()
+            passed += 1
+        except Exception as e:
+            print(f"  FAIL: {test_fn.__name__}: {e}")
+            failed += 1
+
+    print()
+    print("=" * 60)
+    print(f"  Risultati: {passed} passati, {failed} falliti su {len(tests)} test")
+    print("=" * 60)
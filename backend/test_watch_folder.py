@@ -0,0 +1,126 @@
+"""
+Test script per la cartella di ingresso monitorata (automation.watch_folder).
+Usa gli stessi file sintetici dei test dell'importatore.
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from automation.watch_folder import WatchFolder
+from core.file_classifier import FileClassifier
+from test_importer import crea_db_temporaneo, crea_file_sorgenti, dump_tabelle
+
+
+def test_debounce_finestra_quiete():
+    """Il batch parte solo quando nessun file arriva o cambia per quiet_seconds."""
+    inbox = tempfile.mkdtemp(prefix="calor_inbox_")
+    try:
+        watcher = WatchFolder(None, inbox, quiet_seconds=10)
+        assert watcher.scan(now=0) == 0 and watcher.ready_batch(now=100) == []
+
+        with open(os.path.join(inbox, "1_FORTECH.xlsx"), 'wb') as f:
+            f.write(b"x")
+        with open(os.path.join(inbox, "~$1_FORTECH.xlsx"), 'wb') as f:
+            f.write(b"lock")
+        with open(os.path.join(inbox, "note.txt"), 'w') as f:
+            f.write("ignorato")
+        assert watcher.scan(now=0) == 1
+
+        # Secondo file a t=5: la finestra riparte
+        with open(os.path.join(inbox, "2_SATISPAY.xlsx"), 'wb') as f:
+            f.write(b"y")
+        watcher.scan(now=5)
+        assert watcher.ready_batch(now=12) == []
+
+        # File ancora in copia (dimensione cambiata) a t=12
+        with open(os.path.join(inbox, "2_SATISPAY.xlsx"), 'ab') as f:
+            f.write(b"yy")
+        watcher.scan(now=12)
+        assert watcher.ready_batch(now=20) == []
+        watcher.scan(now=22)
+        pronti = watcher.ready_batch(now=22)
+        assert [p.name for p in pronti] == ["1_FORTECH.xlsx", "2_SATISPAY.xlsx"], pronti
+        print("  PASS: Debounce - batch dopo la finestra di quiete")
+    finally:
+        shutil.rmtree(inbox, ignore_errors=True)
+
+
+def test_batch_import_e_spostamento():
+    """Batch completo: importazione, analisi e file spostati in processed/ o failed/."""
+    inbox = tempfile.mkdtemp(prefix="calor_inbox_")
+    cartella = tempfile.mkdtemp(prefix="calor_xlsx_")
+    root_ok, db_ok = crea_db_temporaneo()
+    root, db = crea_db_temporaneo()
+    try:
+        files = crea_file_sorgenti(cartella)
+        from core.importer import DataImporter
+        DataImporter(db_ok).import_files(files)
+
+        for f in files:
+            shutil.copy(f, inbox)
+        with open(os.path.join(inbox, "report.xlsx"), 'wb') as f:
+            f.write(b"fonte sconosciuta")
+        with open(os.path.join(inbox, "9_SATISPAY_ROTTO.xlsx"), 'wb') as f:
+            f.write(b"non un file excel")
+
+        watcher = WatchFolder(db, inbox, quiet_seconds=5)
+        assert watcher.run_once(now=0) is None          # appena arrivati
+        # Ogni file classificato una sola volta (dall'importatore)
+        classificati = []
+        originale = FileClassifier.__dict__['classify_file']
+        classify_file = FileClassifier.classify_file
+        FileClassifier.classify_file = lambda path: classificati.append(path) or classify_file(path)
+        try:
+            esito = watcher.run_once(now=10)
+        finally:
+            FileClassifier.classify_file = originale
+        assert sorted(map(os.path.basename, classificati)) == sorted(os.listdir(os.path.join(inbox, "processed"))
+                                                                     + os.listdir(os.path.join(inbox, "failed")))
+
+        assert sorted(esito.falliti) == ["9_SATISPAY_ROTTO.xlsx", "report.xlsx"], esito.falliti
+        assert sorted(esito.processati) == sorted(os.path.basename(f) for f in files)
+        assert esito.giorni_analizzati > 0
+        assert sorted(os.listdir(os.path.join(inbox, "processed"))) == sorted(esito.processati)
+        assert sorted(os.listdir(os.path.join(inbox, "failed"))) == sorted(esito.falliti)
+        assert sorted(os.listdir(inbox)) == ["failed", "processed"]
+        assert dump_tabelle(db) == dump_tabelle(db_ok)
+
+        # Stesso file di nuovo: già importato, va in processed/ con un nome distinto
+        shutil.copy(files[0], inbox)
+        esito = watcher.run_once(now=20) or watcher.run_once(now=30)
+        assert esito.processati == [os.path.basename(files[0])]
+        assert len(os.listdir(os.path.join(inbox, "processed"))) == len(files) + 1
+        assert dump_tabelle(db) == dump_tabelle(db_ok)
+        print("  PASS: Watch folder - import, analisi e spostamento file")
+    finally:
+        for d in (inbox, cartella, root_ok, root):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("  CALOR SYSTEMS - Test Cartella di Ingresso")
+    print("=" * 60)
+
+    tests = [
+        test_debounce_finestra_quiete,
+        test_batch_import_e_spostamento,
+    ]
+    passed = 0
+    failed = 0
+
+    for test_fn in tests:
+        try:
+            test_fn()
+            passed += 1
+        except Exception as e:
+            print(f"  FAIL: {test_fn.__name__}: {e}")
+            failed += 1
+
+    print()
+    print("=" * 60)
+    print(f"  Risultati: {passed} passati, {failed} falliti su {len(tests)} test")
+    print("=" * 60)
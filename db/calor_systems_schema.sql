@@ -8,6 +8,8 @@
 -- ============================================================================
 
 -- Pulisci tabelle esistenti (ordine inverso per rispettare foreign keys)
+DROP TABLE IF EXISTS analisi_da_ricalcolare;
+DROP TABLE IF EXISTS log_importazioni;
 DROP TABLE IF EXISTS report_riconciliazioni;
 DROP TABLE IF EXISTS eventi_sicurezza_casse;
 DROP TABLE IF EXISTS verifica_credito_clienti;
@@ -180,6 +182,8 @@ CREATE TABLE verifica_contanti_as400 (
 
 CREATE INDEX idx_as400_data ON verifica_contanti_as400(data_registrazione);
 CREATE INDEX idx_as400_impianto ON verifica_contanti_as400(impianto_id);
+-- Chiave naturale: numero + data registrazione contabile
+CREATE UNIQUE INDEX uq_as400_registrazione ON verifica_contanti_as400(numero_registrazione, data_registrazione);
 
 -- ============================================================================
 -- 3B. 💳 VERIFICA CARTE BANCARIE (Fonte: Numia) - VERDE
@@ -224,6 +228,8 @@ CREATE TABLE verifica_numia (
 
 CREATE INDEX idx_numia_data ON verifica_numia(data_ora_transazione);
 CREATE INDEX idx_numia_impianto ON verifica_numia(impianto_id);
+-- Chiave naturale: gli export Numia coprono finestre sovrapposte
+CREATE UNIQUE INDEX uq_numia_transazione ON verifica_numia(id_transazione_numia);
 
 -- ============================================================================
 -- 3C. ⛽ VERIFICA CARTE PETROLIFERE E BUONI (Fonte: iP Portal) - AZZURRO/ROSSO
@@ -322,6 +328,8 @@ CREATE TABLE verifica_satispay (
 
 CREATE INDEX idx_satispay_data ON verifica_satispay(data_transazione);
 CREATE INDEX idx_satispay_impianto ON verifica_satispay(impianto_id);
+-- Chiave naturale: i file Satispay ripetono le transazioni
+CREATE UNIQUE INDEX uq_satispay_transazione ON verifica_satispay(id_transazione);
 
 -- ============================================================================
 -- 3E. 📄 VERIFICA CREDITO CLIENTI (Fonte: Fattura1Click)
@@ -423,7 +431,8 @@ CREATE TABLE report_riconciliazioni (
     
     -- Metadata
     data_elaborazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    versione_algoritmo VARCHAR(50),
+    versione_algoritmo VARCHAR(50),                 -- ENGINE_VERSION + hash delle TOLLERANZE
+    impronta_input VARCHAR(40),                     -- Hash degli input della giornata (Fortech + totali fonti)
     
     FOREIGN KEY (impianto_id) REFERENCES impianti(id),
     FOREIGN KEY (fortech_master_id) REFERENCES import_fortech_master(id)
@@ -433,6 +442,8 @@ CREATE INDEX idx_report_data ON report_riconciliazioni(data_riferimento);
 CREATE INDEX idx_report_stato ON report_riconciliazioni(stato);
 CREATE INDEX idx_report_impianto ON report_riconciliazioni(impianto_id);
 CREATE INDEX idx_report_categoria ON report_riconciliazioni(categoria);
+-- Un risultato per giorno/impianto/categoria: l'Analyzer fa UPSERT e preserva la verifica dell'operatore
+CREATE UNIQUE INDEX uq_report_giorno_categoria ON report_riconciliazioni(impianto_id, data_riferimento, categoria);
 
 -- ============================================================================
 -- 6. 📝 TABELLA LOG IMPORT
@@ -446,18 +457,32 @@ CREATE TABLE log_importazioni (
     nome_file VARCHAR(255),
     percorso_file TEXT,
     tipo_file VARCHAR(50),                          -- FORTECH, AS400, NUMIA, IP_CARTE, IP_BUONI, SATISPAY
+    hash_file VARCHAR(64),                          -- SHA-256 del contenuto (deduplica re-upload)
+    dimensione_byte INTEGER,
     
     -- Esito
     data_importazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     righe_lette INTEGER,
-    righe_importate INTEGER,
-    righe_errore INTEGER,
+    righe_importate INTEGER,                        -- Righe nuove effettivamente inserite
+    righe_duplicate INTEGER,                        -- Già presenti (chiave naturale)
+    righe_errore INTEGER,                           -- Righe scartate (es. impianto mancante)
+    durata_secondi REAL,
     
     -- Note
-    errori TEXT,
+    errori TEXT,                                    -- NULL = import riuscito
     note TEXT
 );
 
+CREATE INDEX idx_log_hash ON log_importazioni(hash_file);
+
+-- Giorni (impianto, giorno) toccati dalle importazioni e non ancora rianalizzati:
+-- l'analisi incrementale ricalcola solo questi (più la finestra contanti multi-giorno).
+CREATE TABLE analisi_da_ricalcolare (
+    impianto_id INTEGER NOT NULL,
+    giorno DATE NOT NULL,                           -- YYYY-MM-DD
+    PRIMARY KEY (impianto_id, giorno)
+) WITHOUT ROWID;
+
 -- ============================================================================
 -- 📌 DATI INIZIALI: IMPIANTO DI ESEMPIO (Milano Repubblica)
 -- ============================================================================
@@ -120,8 +120,8 @@ fileInput.addEventListener('change', () => {
 
 function addFiles(fileList) {
     for (const file of fileList) {
-        // Only accept Excel/CSV
-        if (!file.name.match(/\.(xlsx|xls|csv)$/i)) continue;
+        // Only accept Excel/CSV or ZIP archives of them
+        if (!file.name.match(/\.(xlsx|xls|csv|zip)$/i)) continue;
         // Avoid duplicates
         if (selectedFiles.some(f => f.name === file.name && f.size === file.size)) continue;
         selectedFiles.push(file);
@@ -194,45 +194,30 @@ async function processFiles() {
     log.innerHTML = '';
     logLine(log, 'Preparazione upload...');
 
-    // Build FormData
-    const formData = new FormData();
-    selectedFiles.forEach(f => formData.append('files[]', f));
-
     try {
-        logLine(log, `Invio di ${selectedFiles.length} file al server...`);
-        phase.textContent = 'Elaborazione sul server...';
-        pct.textContent = '30%';
-        fill.style.width = '30%';
-
-        const resp = await fetch('/api/upload', {
-            method: 'POST',
-            body: formData,
-        });
-
-        pct.textContent = '90%';
-        fill.style.width = '90%';
+        const resp = await uploadChunked(selectedFiles, log, phase, pct, fill);
 
-        const data = await resp.json();
+        const job = await resp.json();
 
         if (!resp.ok) {
-            throw new Error(data.error || 'Errore sconosciuto');
+            throw new Error(job.error || 'Errore sconosciuto');
         }
 
-        // Show logs from server
-        if (data.logs) {
-            data.logs.forEach(msg => logLine(log, msg));
-        }
+        // Import + analysis run as a server job: poll its status and show its logs
+        const data = await waitForJob(job, log, phase, pct, fill);
 
         pct.textContent = '100%';
         fill.style.width = '100%';
         phase.textContent = '✅ Completato!';
 
-        logLine(log, `Importati ${data.files_imported} file, analizzate ${data.days_analyzed} giornate.`);
+        // Days whose inputs did not change keep their stored report
+        const skipped = data.days_skipped ? `, ${data.days_skipped} invariate` : '';
+        logLine(log, `Importati ${data.files_imported} file, analizzate ${data.days_analyzed} giornate${skipped}.`);
 
         // Show results summary
         document.getElementById('resultsSummary').style.display = 'block';
         document.getElementById('resultsStats').textContent =
-            `${data.files_imported} file importati — ${data.days_analyzed} giornate elaborate`;
+            `${data.files_imported} file importati — ${data.days_analyzed} giornate elaborate${skipped}`;
 
         // Clear selection
         selectedFiles = [];
@@ -249,6 +234,201 @@ async function processFiles() {
     }
 }
 
+// ── Chunked upload: only the bytes the server does not have yet ──
+const CHUNK_RETRIES = 5;
+
+// Incremental SHA-256 (FIPS 180-4): the file is hashed one slice at a time,
+// never held in memory whole, and works without Web Crypto (plain http on a LAN address)
+const SHA256_K = new Uint32Array([
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2,
+]);
+const HASH_SLICE = 4 * 1024 * 1024;
+
+class Sha256 {
+    constructor() {
+        this.h = new Uint32Array([
+            0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19,
+        ]);
+        this.w = new Uint32Array(64);
+        this.block = new Uint8Array(64);
+        this.pending = 0;   // bytes waiting in this.block
+        this.length = 0;    // total bytes hashed
+    }
+
+    update(bytes) {
+        let i = 0;
+        this.length += bytes.length;
+        if (this.pending) {
+            const n = Math.min(64 - this.pending, bytes.length);
+            this.block.set(bytes.subarray(0, n), this.pending);
+            this.pending += n;
+            i = n;
+            if (this.pending < 64) return;
+            this.compress(this.block, 0);
+            this.pending = 0;
+        }
+        for (; i + 64 <= bytes.length; i += 64) this.compress(bytes, i);
+        this.block.set(bytes.subarray(i));
+        this.pending = bytes.length - i;
+    }
+
+    compress(bytes, p) {
+        const w = this.w, h = this.h;
+        for (let t = 0; t < 16; t++, p += 4) {
+            w[t] = (bytes[p] << 24) | (bytes[p + 1] << 16) | (bytes[p + 2] << 8) | bytes[p + 3];
+        }
+        for (let t = 16; t < 64; t++) {
+            const a = w[t - 15], b = w[t - 2];
+            const s0 = ((a >>> 7) | (a << 25)) ^ ((a >>> 18) | (a << 14)) ^ (a >>> 3);
+            const s1 = ((b >>> 17) | (b << 15)) ^ ((b >>> 19) | (b << 13)) ^ (b >>> 10);
+            w[t] = w[t - 16] + s0 + w[t - 7] + s1;
+        }
+        let [a, b, c, d, e, f, g, k] = h;
+        for (let t = 0; t < 64; t++) {
+            const s1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+            const t1 = (k + s1 + ((e & f) ^ (~e & g)) + SHA256_K[t] + w[t]) | 0;
+            const s0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+            const t2 = (s0 + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+            k = g; g = f; f = e; e = (d + t1) | 0;
+            d = c; c = b; b = a; a = (t1 + t2) | 0;
+        }
+        h[0] += a; h[1] += b; h[2] += c; h[3] += d;
+        h[4] += e; h[5] += f; h[6] += g; h[7] += k;
+    }
+
+    hex() {
+        // Padding: 0x80, zeros, 64-bit big-endian bit length
+        const bits = this.length * 8;
+        const tail = new Uint8Array((this.pending < 56 ? 64 : 128) - this.pending);
+        tail[0] = 0x80;
+        const view = new DataView(tail.buffer);
+        view.setUint32(tail.length - 8, Math.floor(bits / 0x100000000));
+        view.setUint32(tail.length - 4, bits >>> 0);
+        this.update(tail);
+        return Array.from(this.h, x => x.toString(16).padStart(8, '0')).join('');
+    }
+}
+
+async function sha256Hex(file) {
+    const hash = new Sha256();
+    for (let offset = 0; offset < file.size; offset += HASH_SLICE) {
+        hash.update(new Uint8Array(await file.slice(offset, offset + HASH_SLICE).arrayBuffer()));
+    }
+    return hash.hex();
+}
+
+async function postJson(endpoint, body) {
+    const resp = await fetch(endpoint, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body),
+    });
+    const data = await resp.json();
+    if (!resp.ok) throw new Error(data.error || `HTTP ${resp.status}`);
+    return data;
+}
+
+async function uploadFileChunks(file, hash, offset, chunkSize, onProgress) {
+    let retries = 0;
+    while (offset < file.size) {
+        try {
+            const chunk = file.slice(offset, offset + chunkSize);
+            const resp = await fetch(`/api/upload/chunk/${hash}?offset=${offset}&size=${file.size}`, {
+                method: 'PUT',
+                body: chunk,
+            });
+            const data = await resp.json();
+            // 409 = offset not aligned (e.g. a chunk sent twice after a timeout): resume from the server offset
+            if (!resp.ok && resp.status !== 409) throw new Error(data.error || `HTTP ${resp.status}`);
+            onProgress(data.offset - offset);
+            offset = data.offset;
+            retries = 0;
+            if (data.complete) return;
+        } catch (err) {
+            if (++retries > CHUNK_RETRIES) throw err;
+            await new Promise(r => setTimeout(r, 1000 * retries));
+        }
+    }
+}
+
+async function uploadChunked(files, log, phase, pct, fill) {
+    phase.textContent = 'Calcolo impronte file...';
+    const entries = [];
+    for (const file of files) {
+        entries.push({ file, name: file.name, size: file.size, hash: await sha256Hex(file) });
+    }
+
+    const check = await postJson('/api/upload/precheck', {
+        files: entries.map(e => ({ name: e.name, size: e.size, hash: e.hash })),
+    });
+    check.files.forEach((info, i) => Object.assign(entries[i], info));
+
+    const toSend = entries.filter(e => e.status === 'missing' || e.status === 'partial');
+    const totalBytes = toSend.reduce((sum, e) => sum + e.size - e.offset, 0);
+    entries.forEach(e => {
+        if (e.status === 'imported') logLine(log, `${e.name}: già importato, non ricaricato`);
+        else if (e.status === 'stored') logLine(log, `${e.name}: già presente sul server`);
+        else if (e.status === 'partial') logLine(log, `${e.name}: ripresa da ${formatSize(e.offset)}`);
+    });
+    logLine(log, `Invio di ${formatSize(totalBytes)} in blocchi da ${formatSize(check.chunk_size)}...`);
+
+    phase.textContent = 'Caricamento file...';
+    let sent = 0;
+    for (const e of toSend) {
+        await uploadFileChunks(e.file, e.hash, e.offset, check.chunk_size, bytes => {
+            sent += bytes;
+            const p = 10 + Math.round(60 * sent / Math.max(totalBytes, 1));
+            pct.textContent = `${p}%`;
+            fill.style.width = `${p}%`;
+        });
+    }
+
+    phase.textContent = 'Elaborazione sul server...';
+    pct.textContent = '70%';
+    fill.style.width = '70%';
+    return fetch('/api/upload/finalize', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ files: entries.map(e => ({ name: e.name, hash: e.hash })) }),
+    });
+}
+
+// ── Import/analysis job: polled until done, without holding a connection open ──
+const JOB_POLL_MS = 1000;
+
+async function waitForJob(job, log, phase, pct, fill) {
+    // Lines shown so far, counted on the whole job log (the server trims it from the front)
+    let shown = 0;
+    while (true) {
+        const logs = job.logs || [];
+        const start = job.log_inizio || 0;
+        logs.slice(Math.max(0, shown - start)).forEach(msg => logLine(log, msg));
+        shown = Math.max(shown, start + logs.length);
+
+        if (job.stato === 'completato') return job.risultato || job;
+        if (job.stato === 'errore') throw new Error(job.errori || 'Errore elaborazione');
+
+        const speed = job.righe_sec ? ` — ${Math.round(job.righe_sec)} righe/s` : '';
+        phase.textContent = `${job.fase || 'In coda'}${speed}`;
+        const p = 70 + Math.round(30 * (job.progresso || 0));
+        pct.textContent = `${p}%`;
+        fill.style.width = `${p}%`;
+
+        await new Promise(r => setTimeout(r, JOB_POLL_MS));
+        const resp = await fetch(job.status_url || `/api/jobs/${job.id}`);
+        const next = await resp.json();
+        if (!resp.ok) throw new Error(next.error || `HTTP ${resp.status}`);
+        job = Object.assign(next, { status_url: job.status_url });
+    }
+}
+
 function logLine(container, msg) {
     const time = new Date().toLocaleTimeString('it-IT');
     container.innerHTML += `[${time}] ${msg}\n`;